@@ -0,0 +1,109 @@
+"""
+Adaptive bitrate against simulated loss: two local aiortc peers, the receiver
+drops a share of the incoming RTP packets per phase, the sender side
+AdaptiveController reacts to the receiver reports.
+
+    python -m benchmarks.abr_loopback
+"""
+import asyncio
+import random
+import time
+import numpy as np
+import depthai as dai
+
+from aiortc import RTCPeerConnection, RTCRtpReceiver
+from aiortc.mediastreams import MediaStreamError
+
+from python.adaptive import AdaptiveController
+from python.capture import LatestFrame
+from python.frames import VIDEO_TIME_BASE, FramePool
+from python.metrics import StageStats
+from python.videowriter import VideoTransformTrack
+
+# (seconds, receiver side packet loss). The clean phase is long enough for the controller
+# to probe up to the encoder's ceiling, so the lossy one shows how fast it backs off from there.
+PHASES = [(20, 0.0), (12, 0.2), (12, 0.0)]
+WIDTH, HEIGHT, FPS = 1200, 400, 28
+
+
+class FakeRecorder:
+    # Stand-in for the VideoRecorder engine: publishes moving noise frames at FPS
+    def __init__(self):
+        self.output = LatestFrame()
+        self.stats = StageStats()
+        self.frames = FramePool(WIDTH, HEIGHT)
+        self.rng = np.random.default_rng(0)
+        self.noise = self.rng.integers(0, 255, (HEIGHT, 2 * WIDTH), dtype=np.uint8)
+
+    async def run(self):
+        start = time.monotonic()
+        seq = 0
+        while True:
+            frame, (Y, U, V) = self.frames.next()
+            offset = (seq * 8) % WIDTH
+            Y[:] = self.noise[:, offset:offset + WIDTH]
+            frame.pts = int((time.monotonic() - start) / VIDEO_TIME_BASE)
+            frame.time_base = VIDEO_TIME_BASE
+            self.output.put((frame, dai.Clock.now()))
+            seq += 1
+            await asyncio.sleep(1 / FPS)
+
+
+def simulate_loss(share):
+    # drop incoming RTP on the receiving peer before it reaches the jitter buffer
+    handle = RTCRtpReceiver._handle_rtp_packet
+
+    async def lossy(self, packet, *args, **kwargs):
+        if random.random() < share[0]:
+            return
+        return await handle(self, packet, *args, **kwargs)
+
+    RTCRtpReceiver._handle_rtp_packet = lossy
+
+
+async def consume(track):
+    try:
+        while True:
+            await track.recv()
+    except MediaStreamError:
+        pass
+
+
+async def main():
+    share = [0.0]
+    simulate_loss(share)
+
+    recorder = FakeRecorder()
+    producer = asyncio.ensure_future(recorder.run())
+
+    sender_pc, receiver_pc = RTCPeerConnection(), RTCPeerConnection()
+    track = VideoTransformTrack(recorder, "loopback")
+    sender = sender_pc.addTrack(track)
+    controller = AdaptiveController(sender, track)
+    controller.start()
+
+    @receiver_pc.on("track")
+    def on_track(remote):
+        asyncio.ensure_future(consume(remote))
+
+    await sender_pc.setLocalDescription(await sender_pc.createOffer())
+    await receiver_pc.setRemoteDescription(sender_pc.localDescription)
+    await receiver_pc.setLocalDescription(await receiver_pc.createAnswer())
+    await sender_pc.setRemoteDescription(receiver_pc.localDescription)
+
+    for duration, loss in PHASES:
+        share[0] = loss
+        for _ in range(duration):
+            await asyncio.sleep(1)
+            t = controller.targets
+            print(f"loss {loss:4.0%}  reported {t['loss']:5.1%}  rtt {t['rtt']}  "
+                  f"bitrate {t['bitrate'] / 1000:6.0f} kbps  scale {t['scale']}  fps {t['fps']}")
+
+    controller.stop()
+    producer.cancel()
+    await sender_pc.close()
+    await receiver_pc.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
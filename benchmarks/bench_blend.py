@@ -0,0 +1,44 @@
+"""
+Cost of seam blending and exposure compensation in Compositor.warp against the
+hard seam, for two cameras, checked against the per-frame budget at 28 FPS (FPS in
+python/cameras.py, not imported so the script runs without depthai).
+
+    python -m benchmarks.bench_blend
+"""
+import time
+import numpy as np
+
+from benchmarks.bench_stitch import SIZES, make_images
+from python.compositor import Compositor
+
+FRAMES = 200
+BUDGET_MS = 1000 / 28
+
+
+def measure(compositor, images):
+    compositor.warp(images)  # build tables
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        compositor.warp(images)
+    return (time.perf_counter() - start) * 1000 / FRAMES
+
+
+if __name__ == "__main__":
+    print(f"budget {BUDGET_MS:.1f} ms/frame")
+    for (width, height) in SIZES:
+        images, homography = make_images(width, height)
+        # different exposure per camera, like independent manual exposure on each device
+        images[1] = (images[1] * 0.7).astype(np.uint8)
+
+        start = time.perf_counter()
+        blended = Compositor([homography], (height, width))
+        blended.warp(images)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        for name, compositor in [
+            ("hard seam", Compositor([homography], (height, width), blend=False)),
+            ("feather+gain", blended),
+        ]:
+            ms = measure(compositor, images)
+            print(f"{width}x{height} {name:13s} {ms:7.2f} ms/frame ({100 * ms / BUDGET_MS:5.1f}% of budget)")
+        print(f"{width}x{height} table build   {build_ms:7.2f} ms once per homography")
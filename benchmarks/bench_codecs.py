@@ -0,0 +1,126 @@
+"""
+Recording bytes/sec and host CPU per encoder profile.
+
+Every profile's sample bitstream is replayed at 28 FPS into a SegmentWriter the
+way CameraRecorder does it (keyframe/parameter set inspection, muxing into MP4
+segments). Bytes/sec is what crosses XLink and lands on the USB drive, host CPU
+is the share of one core the writer thread needs.
+
+Sample bitstreams are read from cache/bitstream_<profile>_<w>x<h>.bin (32 bit little
+endian length + packet, as the device emits them). Missing ones are recorded once
+from a synthetic moving scene with the host encoders, configured like the device
+(Annex-B, no B-frames, parameter sets on every keyframe, DEFAULT_* settings).
+
+    python -m benchmarks.bench_codecs [width height]
+"""
+import struct
+import sys
+import tempfile
+import time
+import av
+import numpy as np
+
+from fractions import Fraction
+from python.bitstream import inspect
+from python.encoding import DEFAULT_BITRATE, DEFAULT_KEYFRAME, DEFAULT_QUALITY, PROFILES
+from python.segments import SegmentWriter
+from python.stitchcache import CACHE_DIR
+
+FPS = 28
+SECONDS = 4
+SIZE = (1920, 1080)
+
+# host encoder and options standing in for the device's VideoEncoder
+ENCODERS = {
+    'h265': ('libx265', {'x265-params': f'keyint={DEFAULT_KEYFRAME}:bframes=0:repeat-headers=1:log-level=error',
+                         'b': str(DEFAULT_BITRATE * 1000)}),
+    'h264': ('libx264', {'x264-params': f'keyint={DEFAULT_KEYFRAME}:bframes=0:repeat-headers=1',
+                         'b': str(DEFAULT_BITRATE * 1000)}),
+    # qscale ~ what quality 60 gives, MJPEG quality is not a bitrate target
+    'mjpeg': ('mjpeg', {'qscale': str(max(2, (100 - DEFAULT_QUALITY) // 5))}),
+}
+
+
+def samplePath(profile, size):
+    return CACHE_DIR / f"bitstream_{profile}_{size[0]}x{size[1]}.bin"
+
+
+def loadSample(path):
+    data = path.read_bytes()
+    packets, offset = [], 0
+    while offset < len(data):
+        (length,) = struct.unpack_from('<I', data, offset)
+        packets.append(data[offset + 4:offset + 4 + length])
+        offset += 4 + length
+    return packets
+
+
+def saveSample(path, packets):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        for packet in packets:
+            f.write(struct.pack('<I', len(packet)))
+            f.write(packet)
+
+
+def scene(size, count):
+    # A textured panorama panning by, noise keeps the encoders honest
+    (w, h) = size
+    rng = np.random.default_rng(0)
+    texture = rng.integers(0, 255, (h // 8, (w + count * 4) // 8, 3), dtype=np.uint8)
+    texture = np.repeat(np.repeat(texture, 8, axis=0), 8, axis=1)
+    gradient = np.linspace(0, 96, w, dtype=np.uint8)[None, :, None]
+    for i in range(count):
+        frame = texture[:h, i * 4:i * 4 + w] // 2 + gradient
+        noise = rng.integers(0, 8, frame.shape, dtype=np.uint8)
+        yield frame + noise
+
+
+def recordSample(profile, size):
+    name, options = ENCODERS[profile]
+    codec = av.CodecContext.create(name, 'w')
+    codec.width, codec.height = size
+    codec.pix_fmt = 'yuvj420p' if profile == 'mjpeg' else 'yuv420p'
+    codec.time_base = Fraction(1, FPS)
+    codec.options = options
+    if profile == 'mjpeg':
+        codec.qscale = int(options['qscale'])
+
+    packets = []
+    for i, img in enumerate(scene(size, FPS * SECONDS)):
+        frame = av.VideoFrame.from_ndarray(img, format='bgr24').reformat(format=codec.pix_fmt)
+        frame.pts = i
+        packets += [bytes(p) for p in codec.encode(frame)]
+    packets += [bytes(p) for p in codec.encode(None)]
+    return packets
+
+
+def measure(profile, packets, size, directory):
+    writer = SegmentWriter(directory, profile, PROFILES[profile][1], size, 'yuvj420p' if profile == 'mjpeg' else None,
+                           duration=1000 * 1000, min_free=0)
+    start = time.process_time()
+    for i, data in enumerate(packets):
+        keyframe, extradata = inspect(data, writer.codec)
+        writer.mux(data, i * 1000 * 1000 // FPS, keyframe, extradata)
+    writer.close()
+    cpu = time.process_time() - start
+
+    seconds = len(packets) / FPS
+    written = sum(segment['bytes'] for segment in writer.index)
+    return sum(len(p) for p in packets) / seconds, written / seconds, cpu / seconds, len(writer.index)
+
+
+if __name__ == "__main__":
+    size = (int(sys.argv[1]), int(sys.argv[2])) if len(sys.argv) == 3 else SIZE
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in PROFILES:
+            path = samplePath(profile, size)
+            if not path.exists():
+                print(f"recording {path.name}...")
+                saveSample(path, recordSample(profile, size))
+            packets = loadSample(path)
+
+            stream, written, cpu, segments = measure(profile, packets, size, directory)
+            print(f"{size[0]}x{size[1]} {profile:5s} stream {stream * 8 / 1e6:7.2f} Mbit/s "
+                  f"written {written / 1e6:6.2f} MB/s ({segments} segments) "
+                  f"host CPU {100 * cpu:5.1f}% of a core")
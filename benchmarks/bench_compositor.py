@@ -0,0 +1,64 @@
+"""
+Composite time against camera count: the NV12 planes of N synthetic cameras (luma and
+interleaved chroma, as the engine composes them) warped onto one canvas by the
+Compositor, on the calling thread and with every camera on a thread of its own.
+Checked against the per-frame budget at 28 FPS.
+
+    python -m benchmarks.bench_compositor
+"""
+import os
+import time
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from python.compositor import Compositor
+
+FRAMES = 100
+CAMERAS = [2, 3, 4]
+SIZES = [(600, 400), (1920, 1080)]
+BUDGET_MS = 1000 / 28
+
+
+def make_cameras(count, width, height):
+    rng = np.random.default_rng(0)
+    planes = []
+    for i in range(count):
+        y = rng.integers(0, 255, (height, width), dtype=np.uint8)
+        uv = rng.integers(0, 255, (height // 2, width // 2, 2), dtype=np.uint8)
+        planes.append((y, uv))
+    # every camera sits to the right of its neighbour with ~20% overlap and a slight rotation
+    angle = np.deg2rad(2)
+    homography = np.array([
+        [np.cos(angle), -np.sin(angle), 0.8 * width],
+        [np.sin(angle), np.cos(angle), 0.02 * height],
+        [0, 0, 1],
+    ])
+    return planes, [homography] * (count - 1)
+
+
+def measure(compositor, planes):
+    ys = [y for y, _ in planes]
+    uvs = [uv for _, uv in planes]
+    start = time.perf_counter()
+    compositor.warp(ys)
+    compositor.warp(uvs)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        compositor.warp(ys)
+        compositor.warp(uvs)
+    return (time.perf_counter() - start) * 1000 / FRAMES, build_ms
+
+
+if __name__ == "__main__":
+    print(f"budget {BUDGET_MS:.1f} ms/frame, {os.cpu_count()} CPUs")
+    for (width, height) in SIZES:
+        for count in CAMERAS:
+            planes, homographies = make_cameras(count, width, height)
+            with ThreadPoolExecutor(count, thread_name_prefix="warp") as pool:
+                for name, executor in [("1 thread", None), (f"{count} threads", pool)]:
+                    compositor = Compositor(homographies, (height, width), pool=executor)
+                    ms, build_ms = measure(compositor, planes)
+                    print(f"{width}x{height} x{count} {name:10s} {ms:7.2f} ms/frame ({100 * ms / BUDGET_MS:5.1f}% of budget)"
+                          f"  tables {build_ms:6.1f} ms")
@@ -0,0 +1,71 @@
+"""
+Detection results over the data channel: bytes per second and host CPU of a JSON
+message per camera and frame (the old NEW_RESULTS snippet) against the packed batches
+of DetectionBatcher, for a few cameras and detections per frame at 28 FPS. The
+detections are the canned ones of the fake devices.
+
+    python -m benchmarks.bench_detections   (needs depthai)
+"""
+import json
+import time
+
+from python.cameras import FPS
+from python.detection import BATCH_INTERVAL, DetectionBatcher, unpackBatch
+from python.fakedevice import cannedDetections
+
+SECONDS = 10
+
+
+def as_json(seq, detections):
+    return json.dumps({
+        "type": "NEW_RESULTS",
+        "payload": {
+            "seq": seq,
+            "detections": [
+                {"label": d.label, "confidence": d.confidence, "box": [d.xmin, d.ymin, d.xmax, d.ymax]}
+                for d in detections
+            ],
+        },
+    })
+
+
+def run_json(cameras, count):
+    frames = [cannedDetections(seq, count) for seq in range(FPS * SECONDS)]
+    sent = messages = 0
+    start = time.process_time()
+    for seq, detections in enumerate(frames):
+        for camera in range(cameras):
+            sent += len(as_json(seq, detections))
+            messages += 1
+    return sent, messages, time.process_time() - start
+
+
+def run_packed(cameras, count):
+    frames = [cannedDetections(seq, count) for seq in range(FPS * SECONDS)]
+    batcher = DetectionBatcher(cameras)
+    per_batch = round(BATCH_INTERVAL * FPS)
+    sent = messages = 0
+    start = time.process_time()
+    for seq, detections in enumerate(frames):
+        now = seq / FPS
+        for camera in range(cameras):
+            batcher.composed(camera, seq, seq * 3214)
+            batcher.add(camera, seq, detections, now)
+        if seq % per_batch == per_batch - 1:
+            data = batcher.pack(now)
+            sent += len(data)
+            messages += 1
+    cpu = time.process_time() - start
+    check = unpackBatch(data)
+    assert len(check) == per_batch * cameras and len(check[-1][3]) == count
+    return sent, messages, cpu
+
+
+if __name__ == "__main__":
+    print(f"{SECONDS}s at {FPS} FPS, batches every {BATCH_INTERVAL * 1000:.0f} ms")
+    for cameras in (1, 2, 4):
+        for count in (0, 3, 20):
+            for name, run in (("json", run_json), ("packed", run_packed)):
+                sent, messages, cpu = run(cameras, count)
+                print(f"{cameras} camera(s) {count:2d} detections {name:6s} {sent / SECONDS / 1024:7.1f} KiB/s "
+                      f"{messages / SECONDS:6.1f} msg/s  cpu {1000 * cpu / SECONDS:6.2f} ms/s")
@@ -0,0 +1,73 @@
+"""
+Data channel messages handled per second by the command dispatcher, and how many
+CameraControl messages a burst of exposure/white balance clicks reaches the device as.
+
+Runs the dispatcher against a stand-in channel and engine, the control queues only
+count what they are sent. One flush per simulated 28 FPS frame.
+
+    python -m benchmarks.bench_dispatch   (needs depthai)
+"""
+import json
+import time
+
+from types import SimpleNamespace
+from python.controls import CameraControls
+from python.datachannel import Context, dispatch
+
+MESSAGES = 50000
+FRAME_PERIOD = 1 / 28
+
+CASES = [
+    ("PING", json.dumps({"type": "PING"})),
+    ("legacy button", json.dumps({"type": "EXPOSURE_MORE_CAM1"})),
+    ("parameterized", json.dumps({"type": "EXPOSURE", "cam": 1, "delta": 500})),
+    ("URL quoted", "%7B%22type%22%3A%22WHITE_BALANCE%22%2C%22cam%22%3A2%2C%22delta%22%3A-200%7D"),
+    ("batch of 10", json.dumps([{"type": "EXPOSURE", "cam": 1 + i % 2, "delta": 500} for i in range(10)])),
+    ("unknown", json.dumps({"type": "NOPE"})),
+]
+
+
+class CountingQueue:
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, ctrl):
+        self.sent += 1
+
+
+class Channel:
+    readyState = "open"
+
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, message):
+        self.sent += 1
+
+
+def context():
+    queues = [CountingQueue(), CountingQueue()]
+    engine = SimpleNamespace(controls=CameraControls(queues))
+    app = SimpleNamespace(video_transform=engine, video_transforms={}, pcs_datachannels={})
+    return Context(app, "bench", Channel()), engine.controls
+
+
+if __name__ == "__main__":
+    for name, message in CASES:
+        ctx, controls = context()
+        start = time.perf_counter()
+        for _ in range(MESSAGES):
+            dispatch(ctx, message)
+        elapsed = time.perf_counter() - start
+        print(f"{name:14s} {MESSAGES / elapsed:9.0f} messages/s {elapsed / MESSAGES * 1e6:6.2f} us/message")
+
+    # A held button: 200 clicks/s on both cameras for one second of frames
+    ctx, controls = context()
+    clicks = 0
+    for frame in range(28):
+        for _ in range(int(200 * FRAME_PERIOD)):
+            dispatch(ctx, json.dumps({"type": "EXPOSURE_MORE_CAM1"}))
+            dispatch(ctx, json.dumps({"type": "WHITE_BALANCE", "cam": 2, "delta": 200}))
+            clicks += 2
+        controls.flush()
+    print(f"burst: {clicks} control commands -> {controls.sent} CameraControl messages in 28 frames")
@@ -0,0 +1,123 @@
+"""
+End to end on a plain Linux box: the VideoRecorder engine on the replay backend, so
+capture -> sync -> compose -> WebRTC -> record runs as it would on the rig, with the
+cameras recorded (or synthesized) by record_replay standing in for the OAKs. The
+viewers are local aiortc peers that decode what they receive.
+
+Per case (viewers, recording on/off) reports composed and received frame rates, glass
+to encoder latency, the CPU the process used (1.0 = one core busy) and the per stage
+times, and how many encoded packets were recorded per camera.
+
+    python -m benchmarks.record_replay synthesize   (once)
+    python -m benchmarks.bench_e2e [seconds]
+"""
+import asyncio
+import sys
+import tempfile
+import time
+
+from types import SimpleNamespace
+from aiortc import RTCPeerConnection
+from aiortc.mediastreams import MediaStreamError
+
+from python.replay import REPLAY_DIR, ReplayBackend
+from python.videowriter import VideoRecorder, VideoTransformTrack
+
+SECONDS = 10
+# Boot, sync and the first calibration are left out of the measurements
+WARMUP = 5
+CASES = [(0, False), (1, False), (2, False), (1, True), (2, True)]
+
+
+class Viewer:
+    # A local peer pair: the sender side track as the app would create it, the receiver decodes
+    def __init__(self, recorder, pc_id):
+        self.track = VideoTransformTrack(recorder, pc_id)
+        self.sender = RTCPeerConnection()
+        self.receiver = RTCPeerConnection()
+        self.received = 0
+        self.task = None
+        self.sender.addTrack(self.track)
+
+        @self.receiver.on("track")
+        def on_track(remote):
+            self.task = asyncio.ensure_future(self.consume(remote))
+
+    async def consume(self, remote):
+        try:
+            while True:
+                await remote.recv()
+                self.received += 1
+        except MediaStreamError:
+            pass
+
+    async def connect(self):
+        await self.sender.setLocalDescription(await self.sender.createOffer())
+        await self.receiver.setRemoteDescription(self.sender.localDescription)
+        await self.receiver.setLocalDescription(await self.receiver.createAnswer())
+        await self.sender.setRemoteDescription(self.receiver.localDescription)
+
+    async def close(self):
+        await self.sender.close()
+        await self.receiver.close()
+        if self.task is not None:
+            self.task.cancel()
+
+
+def written(recorder):
+    return {camera.name: camera.writer.written for camera in recorder.cameras}
+
+
+async def measure(recorder, viewers, record, seconds):
+    clients = [Viewer(recorder, f"viewer-{i}") for i in range(viewers)]
+    for client in clients:
+        recorder.application.video_transforms[client.track.pc_id] = client.track
+        await client.connect()
+    recorder.is_recording = record
+    await asyncio.sleep(2)
+
+    recorder.stats.reset()
+    recorder.stats.rates()
+    received = [client.received for client in clients]
+    packets = written(recorder)
+    cpu, start = time.process_time(), time.monotonic()
+    await asyncio.sleep(seconds)
+    elapsed = time.monotonic() - start
+    cpu = (time.process_time() - cpu) / elapsed
+
+    rates = recorder.stats.rates()
+    stages = recorder.stats.summary()
+    fps = [(client.received - count) / elapsed for client, count in zip(clients, received)]
+    packets = {name: count - packets.get(name, 0) for name, count in written(recorder).items()}
+
+    recorder.is_recording = False
+    for client in clients:
+        recorder.application.video_transforms.pop(client.track.pc_id, None)
+        await client.close()
+
+    latency = stages.get("latency", {}).get("ms")
+    print(f"{viewers} viewer(s) recording {'on ' if record else 'off'}  composed {rates.get('compose', 0):5.1f} fps  "
+          f"received {' '.join(f'{f:5.1f}' for f in fps) or '    -'} fps  "
+          f"latency {'-' if latency is None else f'{latency:6.1f} ms'}  cpu {cpu:4.2f}")
+    print("    " + "  ".join(f"{name} {stage['ms']:.2f}ms" for name, stage in sorted(stages.items())))
+    if record:
+        print("    written " + "  ".join(f"{name} {count / elapsed:4.1f}/s" for name, count in packets.items()))
+
+
+async def main(seconds):
+    application = SimpleNamespace(video_transforms={}, pcs_datachannels={})
+    with tempfile.TemporaryDirectory() as recordings:
+        recorder = VideoRecorder(application, ReplayBackend(REPLAY_DIR), recordings)
+        recorder.start()
+        await asyncio.sleep(WARMUP)
+        if not recorder.cameras:
+            sys.exit(f"No replay sets in {REPLAY_DIR}, run python -m benchmarks.record_replay synthesize first")
+        try:
+            for viewers, record in CASES:
+                await measure(recorder, viewers, record, seconds)
+        finally:
+            recorder.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else SECONDS))
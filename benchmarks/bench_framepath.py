@@ -0,0 +1,86 @@
+"""
+Host frame path from two synthetic 600x400 previews to the frame the WebRTC
+encoder consumes, with the per-stage time/copy/conversion counters.
+
+bgr:  getCvFrame() (planar -> interleaved BGR), np.concatenate,
+      av.VideoFrame.from_ndarray(bgr24), reformat to yuv420p in the encoder.
+nv12: NV12 from the device split into plane views, composed straight into a
+      pooled yuv420p frame, nothing left for the encoder to convert.
+
+    python -m benchmarks.bench_framepath
+"""
+import av
+import numpy as np
+
+from python.fakedevice import FakeImgFrame, toNV12
+from python.frames import FramePool, splitNV12
+from python.metrics import StageStats
+
+FRAMES = 300
+WIDTH, HEIGHT = 600, 400
+
+
+def synthetic(seed):
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 255, (HEIGHT, WIDTH, 3), dtype=np.uint8)
+    planar = np.ascontiguousarray(img.transpose(2, 0, 1))
+    return FakeImgFrame(img, 0, None, planar.reshape(-1)), FakeImgFrame(img, 0, None, toNV12(img))
+
+
+def bgr_path(frames, stats):
+    imgs = []
+    for frame in frames:
+        # what getCvFrame() does for a planar BGR preview
+        data = frame.getData()
+        with stats.time("capture", data.nbytes, conversions=1):
+            imgs.append(np.ascontiguousarray(data.reshape(3, HEIGHT, WIDTH).transpose(1, 2, 0)))
+
+    with stats.time("compose", 2 * imgs[0].nbytes):
+        result = np.concatenate(imgs, axis=1)
+    with stats.time("av", result.nbytes):
+        out = av.VideoFrame.from_ndarray(result, format="bgr24")
+    with stats.time("encoder", result.nbytes // 2, conversions=1):
+        out.reformat(format="yuv420p")
+
+
+def nv12_path(frames, stats, pool):
+    planes = []
+    for frame in frames:
+        with stats.time("capture"):
+            planes.append(splitNV12(frame))
+
+    (y1, uv1), (y2, uv2) = planes
+    out, (Y, U, V) = pool.next()
+    with stats.time("compose", Y.nbytes + U.nbytes + V.nbytes):
+        Y[:, :WIDTH] = y1
+        Y[:, WIDTH:] = y2
+        U[:, :WIDTH // 2] = uv1[..., 0]
+        U[:, WIDTH // 2:] = uv2[..., 0]
+        V[:, :WIDTH // 2] = uv1[..., 1]
+        V[:, WIDTH // 2:] = uv2[..., 1]
+    with stats.time("av"):
+        pass
+    with stats.time("encoder", conversions=int(out.format.name != "yuv420p")):
+        pass
+
+
+def report(name, stats):
+    total = 0
+    for stage, s in stats.summary().items():
+        total += s["ms"]
+        print(f"{name:5s} {stage:8s} {s['ms']:6.3f} ms  {s['copied'] / 1024:8.1f} KiB copied  {s['conversions']:.0f} color conversions")
+    print(f"{name:5s} total    {total:6.3f} ms/frame")
+
+
+if __name__ == "__main__":
+    (bgr1, nv1), (bgr2, nv2) = synthetic(1), synthetic(2)
+
+    stats = StageStats()
+    for _ in range(FRAMES):
+        bgr_path([bgr1, bgr2], stats)
+    report("bgr", stats)
+
+    stats, pool = StageStats(), FramePool(2 * WIDTH, HEIGHT)
+    for _ in range(FRAMES):
+        nv12_path([nv1, nv2], stats, pool)
+    report("nv12", stats)
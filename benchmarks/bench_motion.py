@@ -0,0 +1,89 @@
+"""
+Motion triggered recording: detection cost per preview frame against the 28 FPS
+budget, how many frames after an object enters the scene the trigger fires (and how
+often noise alone fires it), and the memory the encoded pre-roll takes per camera.
+
+The previews are a static 600x400 scene with sensor noise, a dark square moves in
+halfway through. The pre-roll is fed packets of the size the H.265 (20 Mbit/s, a
+keyframe every 28 frames) and MJPEG (~87 Mbit/s measured by bench_codecs) profiles
+produce at 4K.
+
+    python -m benchmarks.bench_motion   (needs depthai)
+"""
+import time
+import numpy as np
+import cv2
+
+from datetime import timedelta
+from python.cameras import FPS, PREVIEW_HEIGHT, PREVIEW_WIDTH
+from python.encoding import DEFAULT_BITRATE, DEFAULT_KEYFRAME
+from python.motion import MotionDetector
+from python.recording import PREROLL, PrerollBuffer
+
+FRAMES = 300
+ENTERS = 150
+BUDGET_MS = 1000 / FPS
+PROFILES = [
+    ("h265", DEFAULT_BITRATE * 1000, DEFAULT_KEYFRAME),
+    ("mjpeg", 87 * 1000 * 1000, 1),
+]
+
+
+def make_scene(seed):
+    rng = np.random.default_rng(seed)
+    scene = cv2.GaussianBlur(rng.integers(0, 255, (PREVIEW_HEIGHT, PREVIEW_WIDTH), dtype=np.uint8), (0, 0), 9)
+    scene = cv2.normalize(scene, None, 40, 220, cv2.NORM_MINMAX)
+
+    def frame(i):
+        noisy = cv2.add(scene, rng.integers(0, 12, scene.shape, dtype=np.uint8))
+        if i >= ENTERS:
+            x = 10 * (i - ENTERS)
+            cv2.rectangle(noisy, (x, 150), (x + 60, 250), 0, -1)
+        return noisy
+    return frame
+
+
+def detection(cameras, scale):
+    scenes = [make_scene(seed) for seed in range(cameras)]
+    frames = [[scene(i) for scene in scenes] for i in range(FRAMES)]
+    detector = MotionDetector(scale=scale)
+    fired = None
+    false = 0
+    start = time.perf_counter()
+    for i, images in enumerate(frames):
+        # 28 FPS on the detector's clock
+        if detector.update(images, now=i / FPS) and fired is None:
+            if i < ENTERS:
+                false += 1
+                detector.reset()
+            else:
+                fired = i - ENTERS
+    ms = (time.perf_counter() - start) * 1000 / FRAMES
+    return ms, fired, false, detector.stats()["bytes"]
+
+
+def preroll(bitrate, keyframe):
+    buffer = PrerollBuffer()
+    size = bitrate // 8 // FPS
+    peak = 0
+    for i in range(FPS * 30):
+        # keyframes of H.26x are several times larger than the frames in between
+        is_key = i % keyframe == 0
+        data = bytes(size * 5 if is_key and keyframe > 1 else size)
+        buffer.push(timedelta(seconds=i / FPS), data, is_key, b'')
+        peak = max(peak, buffer.bytes)
+    return buffer.bytes, peak, buffer.span()
+
+
+if __name__ == "__main__":
+    print(f"budget {BUDGET_MS:.1f} ms/frame")
+    for cameras in (1, 2, 4):
+        for scale in (1, 4):
+            ms, fired, false, memory = detection(cameras, scale)
+            print(f"{cameras} camera(s) 1/{scale} size {ms:6.3f} ms/frame ({100 * ms / BUDGET_MS:4.1f}% of budget) "
+                  f"fires {fired} frames after entry, {false} false triggers, {memory / 1024:6.1f} KiB background")
+
+    print(f"pre-roll {PREROLL.total_seconds():.0f}s")
+    for name, bitrate, keyframe in PROFILES:
+        held, peak, span = preroll(bitrate, keyframe)
+        print(f"{name:6s} {held / 2 ** 20:6.1f} MiB held ({peak / 2 ** 20:6.1f} MiB peak) for {span:4.2f}s per camera")
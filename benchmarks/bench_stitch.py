@@ -0,0 +1,90 @@
+"""
+Two cameras: per-frame cv2.warpPerspective into a fresh canvas (the original
+implementation), cv2.remap through precomputed fixed-point tables into a reused canvas,
+and the Compositor, which warps with cv2.warpPerspective straight into its pooled canvas.
+
+Reports ms/frame and the bytes allocated per frame (tracemalloc peak above the
+steady state, numpy and the OpenCV bindings both allocate through it).
+
+    python -m benchmarks.bench_stitch
+"""
+import time
+import tracemalloc
+import numpy as np
+import cv2
+
+from python.compositor import Compositor
+from python.stitching import CanvasPool
+
+FRAMES = 200
+SIZES = [(600, 400), (1920, 1080)]
+
+
+def warp_perspective(homography, images):
+    (imageB, imageA) = images
+    result = cv2.warpPerspective(imageA, homography, (imageA.shape[1] + imageB.shape[1], imageA.shape[0]))
+    result[0:imageB.shape[0], 0:imageB.shape[1]] = imageB
+    return result
+
+
+def remap_tables(homography, images):
+    # Where every canvas pixel samples imageA, evaluated once instead of per frame
+    (imageB, imageA) = images
+    (h, w) = imageA.shape[:2]
+    xs, ys = np.meshgrid(np.arange(2 * w, dtype=np.float32), np.arange(h, dtype=np.float32))
+    points = cv2.perspectiveTransform(np.dstack([xs, ys]).reshape(-1, 1, 2), np.linalg.inv(homography))
+    map1, map2 = cv2.convertMaps(points.reshape(h, 2 * w, 2), None, cv2.CV_16SC2)
+    canvases = CanvasPool((h, 2 * w) + imageA.shape[2:])
+
+    def warp(images):
+        (imageB, imageA) = images
+        result = canvases.next()
+        cv2.remap(imageA, map1, map2, cv2.INTER_LINEAR, dst=result, borderMode=cv2.BORDER_CONSTANT)
+        result[0:imageB.shape[0], 0:imageB.shape[1]] = imageB
+        return result
+    return warp
+
+
+def make_images(width, height):
+    rng = np.random.default_rng(0)
+    imageB = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    imageA = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    # imageA sits to the right of imageB with ~20% overlap and a slight rotation
+    angle = np.deg2rad(2)
+    homography = np.array([
+        [np.cos(angle), -np.sin(angle), 0.8 * width],
+        [np.sin(angle), np.cos(angle), 0.02 * height],
+        [0, 0, 1],
+    ])
+    return [imageB, imageA], homography
+
+
+def measure(warp, images):
+    warp(images)  # build tables / warm up
+    start = time.perf_counter()
+    for _ in range(FRAMES):
+        warp(images)
+    ms = (time.perf_counter() - start) * 1000 / FRAMES
+
+    tracemalloc.start()
+    warp(images)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for _ in range(FRAMES):
+        warp(images)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ms, peak - current
+
+
+if __name__ == "__main__":
+    for (width, height) in SIZES:
+        images, homography = make_images(width, height)
+        compositor = Compositor([homography], (height, width), blend=False)
+        for name, warp in [
+            ("warpPerspective", lambda imgs: warp_perspective(homography, imgs)),
+            ("remap tables", remap_tables(homography, images)),
+            ("Compositor", compositor.warp),
+        ]:
+            ms, allocated = measure(warp, images)
+            print(f"{width}x{height} {name:16s} {ms:7.2f} ms/frame  {allocated / 1024:9.1f} KiB allocated/frame")
@@ -0,0 +1,57 @@
+"""
+Hardware timestamp sync of two fake 28 FPS devices.
+
+The devices free-run half a frame apart on clocks that are seconds off from each other
+and from the host. cam2 drops frames and delivers them with jitter, which is where
+pairing the heads of the two queues goes out of step. Prints the FrameSync statistics
+and the true capture time difference of the published pairs, which must stay within
+the tolerance.
+
+    python -m benchmarks.bench_sync
+"""
+import asyncio
+import numpy as np
+
+from python.capture import CaptureThread
+from python.fakedevice import FakeQueue
+from python.sync import FrameSync
+
+DURATION = 5.0
+# (jitter s, drop share) of cam2
+SCENARIOS = [(0.0, 0.0), (0.02, 0.0), (0.0, 0.1), (0.03, 0.2)]
+
+
+async def run(jitter, drop):
+    q1 = FakeQueue(seed=1, offset=12.5)
+    await asyncio.sleep(0.5 / 28)
+    q2 = FakeQueue(seed=2, offset=-3.25, jitter=jitter, drop=drop)
+
+    sync = FrameSync()
+    threads = [CaptureThread(q1, sync.inputs[0], "cam1"), CaptureThread(q2, sync.inputs[1], "cam2")]
+    for t in threads:
+        t.start()
+
+    errors, seen = [], 0
+    loop = asyncio.get_event_loop()
+    end = loop.time() + DURATION
+    while loop.time() < end:
+        seen, (captured1, captured2) = await sync.output.next(seen)
+        # The fake host timestamps are the true capture times
+        errors.append(abs((captured1.timestamp - captured2.timestamp).total_seconds()))
+
+    q1.close()
+    q2.close()
+    for t in threads:
+        t.stop()
+
+    stats = sync.stats()
+    errors = np.array(errors) * 1000
+    print(f"jitter={jitter * 1000:4.0f} ms drop={drop:4.0%} pairs={stats['matched']:4d} "
+          f"unmatched={stats['unmatched']} offset={stats['offset_ms'][1]:10.3f} ms "
+          f"sync error mean={stats['error_ms']['mean']:6.3f} p95={stats['error_ms']['p95']:6.3f} ms "
+          f"true max={errors.max():6.3f} ms (tolerance {sync.tolerance.total_seconds() * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    for jitter, drop in SCENARIOS:
+        asyncio.run(run(jitter, drop))
@@ -0,0 +1,89 @@
+"""
+Requests/sec for the web client files: read from disk on every request (the old
+index/javascript handlers) against the in-memory AssetCache, compressed and
+revalidated with If-None-Match (304).
+
+Serves the real client/ files from a local aiohttp server and keeps CONCURRENCY
+requests in flight for DURATION seconds per case.
+
+    python -m benchmarks.load_static
+"""
+import asyncio
+import time
+import aiohttp
+
+from pathlib import Path
+from aiohttp import web
+from python.assets import AssetCache
+
+CLIENT = Path(__file__).parent.parent / 'client'
+DURATION = 3.0
+CONCURRENCY = 32
+PORT = 8089
+
+
+async def index_from_disk(request):
+    with (CLIENT / 'index.html').open() as f:
+        return web.Response(content_type="text/html", text=f.read())
+
+
+async def javascript_from_disk(request):
+    with (CLIENT / 'js/client.js').open() as f:
+        return web.Response(content_type="application/javascript", text=f.read())
+
+
+def make_app():
+    assets = AssetCache()
+    assets.add("index", CLIENT / 'index.html', "text/html")
+    assets.add("javascript", CLIENT / 'js/client.js', "application/javascript")
+
+    app = web.Application()
+    app.router.add_get("/disk/", index_from_disk)
+    app.router.add_get("/disk/client.js", javascript_from_disk)
+    app.router.add_get("/cached/", assets.handler("index"))
+    app.router.add_get("/cached/client.js", assets.handler("javascript"))
+    return app
+
+
+async def load(session, paths, headers):
+    end = time.monotonic() + DURATION
+    counts = {"requests": 0, "bytes": 0}
+
+    async def worker(i):
+        while time.monotonic() < end:
+            path = paths[(counts["requests"] + i) % len(paths)]
+            async with session.get(f"http://127.0.0.1:{PORT}{path}", headers=headers, auto_decompress=False) as resp:
+                body = await resp.read()
+            counts["requests"] += 1
+            counts["bytes"] += len(body)
+
+    await asyncio.gather(*(worker(i) for i in range(CONCURRENCY)))
+    return counts["requests"] / DURATION, counts["bytes"] / max(counts["requests"], 1)
+
+
+async def main():
+    runner = web.AppRunner(make_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", PORT).start()
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"http://127.0.0.1:{PORT}/cached/") as resp:
+            etag = resp.headers["ETag"]
+        async with session.get(f"http://127.0.0.1:{PORT}/cached/client.js") as resp:
+            etag_js = resp.headers["ETag"]
+
+        cases = [
+            ("disk, every request", ["/disk/", "/disk/client.js"], {}),
+            ("cached, identity", ["/cached/", "/cached/client.js"], {"Accept-Encoding": "identity"}),
+            ("cached, gzip/br", ["/cached/", "/cached/client.js"], {"Accept-Encoding": "gzip, br"}),
+            ("cached, 304", ["/cached/", "/cached/client.js"], {"If-None-Match": f"{etag}, {etag_js}"}),
+        ]
+        for name, paths, headers in cases:
+            rate, size = await load(session, paths, headers)
+            print(f"{name:20s} {rate:8.0f} requests/s {size:8.0f} bytes/response")
+
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
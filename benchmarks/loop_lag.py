@@ -0,0 +1,77 @@
+"""
+Event-loop lag with two fake 28 FPS devices.
+
+Compares reading the preview queues directly inside the coroutine (the old
+get_frame) against the CaptureThread/LatestFrame path. A probe task sleeps for
+5 ms in a loop and records how late it wakes up; with a responsive loop the lag
+stays well under a frame period.
+
+    python -m benchmarks.loop_lag
+"""
+import asyncio
+import time
+import numpy as np
+
+from python.capture import CaptureThread, LatestFrame
+from python.fakedevice import FakeQueue
+
+DURATION = 3.0
+PROBE_INTERVAL = 0.005
+
+
+async def probe(lags, stop):
+    while not stop.is_set():
+        start = time.monotonic()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.monotonic() - start - PROBE_INTERVAL)
+
+
+async def consume_blocking(q1, q2, stop):
+    frames = 0
+    while not stop.is_set():
+        q1.get().getCvFrame()
+        q2.get().getCvFrame()
+        frames += 1
+        await asyncio.sleep(0)
+    return frames
+
+
+async def consume_threaded(q1, q2, stop):
+    slot1, slot2 = LatestFrame(), LatestFrame()
+    threads = [CaptureThread(q1, slot1, "cam1"), CaptureThread(q2, slot2, "cam2")]
+    for t in threads:
+        t.start()
+
+    frames, seen1, seen2 = 0, 0, 0
+    while not stop.is_set():
+        (seen1, _), (seen2, _) = await asyncio.gather(slot1.next(seen1), slot2.next(seen2))
+        frames += 1
+
+    for t in threads:
+        t.running = False
+    q1.close()
+    q2.close()
+    for t in threads:
+        t.stop()
+    return frames
+
+
+async def run(consumer):
+    q1, q2 = FakeQueue(seed=1), FakeQueue(seed=2)
+    lags, stop = [], asyncio.Event()
+    probe_task = asyncio.ensure_future(probe(lags, stop))
+    consumer_task = asyncio.ensure_future(consumer(q1, q2, stop))
+    await asyncio.sleep(DURATION)
+    stop.set()
+    frames = await consumer_task
+    await probe_task
+
+    lags = np.array(lags) * 1000
+    print(f"{consumer.__name__:18s} fps={frames / DURATION:5.1f} "
+          f"lag p50={np.percentile(lags, 50):6.2f} ms "
+          f"p99={np.percentile(lags, 99):6.2f} ms max={lags.max():6.2f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(consume_blocking))
+    asyncio.run(run(consume_threaded))
@@ -0,0 +1,128 @@
+"""
+Replay sets for DEVICE_BACKEND=replay and bench_e2e: every camera of cameras.json
+recorded to cache/replay/<mxid>/ (see python/replay.py).
+
+record      the preview frames and encoded packets of the connected cameras, as the
+            pipeline delivers them (needs the OAKs)
+synthesize  a wide textured scene panning by, seen by the cameras side by side with
+            20% overlap: NV12 previews and a bitstream from the host encoder set up
+            like the device one (bench_codecs), at 1920x1080 unless given
+
+    python -m benchmarks.record_replay record [seconds]
+    python -m benchmarks.record_replay synthesize [seconds] [profile] [width height]
+"""
+import sys
+import threading
+import time
+import av
+import cv2
+import numpy as np
+
+from datetime import timedelta
+from fractions import Fraction
+from benchmarks.bench_codecs import ENCODERS
+from python.cameras import FPS, PREVIEW_HEIGHT, PREVIEW_WIDTH, Camera, OakBackend, load_config
+from python.encoding import PROFILES, EncoderSettings
+from python.fakedevice import toNV12
+from python.replay import REPLAY_DIR, ReplayWriter
+
+SECONDS = 10
+SIZE = (1920, 1080)
+OVERLAP = 0.2
+# Device clocks of the synthetic cameras run this far ahead of the host, a little more per camera
+DEVICE_OFFSET = 1.5
+DEVICE_OFFSET_STEP = 0.003
+
+
+def drain(queue, writer, stream, until):
+    while time.monotonic() < until:
+        for message in queue.tryGetAll():
+            writer.writeFrame(stream, message)
+        time.sleep(0.002)
+
+
+def record(seconds):
+    settings = EncoderSettings.from_env()
+    cameras = [Camera(camera["name"], camera.get("mxid"), OakBackend()) for camera in load_config()]
+    threads = [threading.Thread(target=camera.boot, args=(settings,)) for camera in cameras]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    until = time.monotonic() + seconds
+    writers, threads = [], []
+    for camera in cameras:
+        if not camera.running:
+            continue
+        segments = camera.segments
+        writer = ReplayWriter(REPLAY_DIR, camera.mxid, (PREVIEW_WIDTH, PREVIEW_HEIGHT), segments.codec,
+                              segments.size, segments.pix_fmt, FPS)
+        writers.append(writer)
+        threads += [threading.Thread(target=drain, args=(queue, writer, stream, until))
+                    for queue, stream in ((camera.preview, 'preview'), (camera.encoded, 'encoded'))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for writer in writers:
+        writer.close()
+        print(f"recorded {writer.directory}")
+    for camera in cameras:
+        camera.stop()
+
+
+def synthesize(seconds, profile, size):
+    (w, h) = size
+    cameras = load_config()
+    frames = FPS * seconds
+    step = int(w * (1 - OVERLAP))
+    rng = np.random.default_rng(0)
+    # Blurred noise at two scales reads like a scene to SIFT and the encoders alike
+    width = step * (len(cameras) - 1) + w + frames * 4
+    texture = cv2.resize(rng.integers(0, 255, (h // 16, width // 16, 3), dtype=np.uint8), (width, h),
+                         interpolation=cv2.INTER_CUBIC)
+    texture = cv2.addWeighted(texture, 0.7, rng.integers(0, 255, (h, width, 3), dtype=np.uint8), 0.3, 0)
+
+    name, options = ENCODERS[profile]
+    codec_name, pix_fmt = PROFILES[profile][1], 'yuvj420p' if profile == 'mjpeg' else 'yuv420p'
+    start = time.monotonic()
+    for index, camera in enumerate(cameras):
+        mxid = camera.get("mxid") or camera["name"]
+        writer = ReplayWriter(REPLAY_DIR, mxid, (PREVIEW_WIDTH, PREVIEW_HEIGHT), codec_name, size, pix_fmt, FPS)
+        codec = av.CodecContext.create(name, 'w')
+        codec.width, codec.height = size
+        codec.pix_fmt = pix_fmt
+        codec.time_base = Fraction(1, FPS)
+        codec.options = {**options, 'preset': 'ultrafast'} if profile != 'mjpeg' else options
+        if profile == 'mjpeg':
+            codec.qscale = int(options['qscale'])
+        offset = timedelta(seconds=DEVICE_OFFSET + index * DEVICE_OFFSET_STEP)
+
+        for i in range(frames):
+            x = index * step + i * 4
+            img = np.ascontiguousarray(texture[:, x:x + w])
+            ts = timedelta(seconds=start + i / FPS)
+            preview = cv2.resize(img, (PREVIEW_WIDTH, PREVIEW_HEIGHT), interpolation=cv2.INTER_AREA)
+            writer.write('preview', i, ts, ts + offset, toNV12(preview))
+
+            frame = av.VideoFrame.from_ndarray(img, format='bgr24').reformat(format=pix_fmt)
+            frame.pts = i
+            for packet in codec.encode(frame):
+                # No B-frames, every packet belongs to the frame just captured
+                writer.write('encoded', i, ts, ts + offset, bytes(packet))
+        writer.close()
+        print(f"synthesized {writer.directory} ({frames} frames)")
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'synthesize'
+    seconds = int(sys.argv[2]) if len(sys.argv) > 2 else SECONDS
+    if command == 'record':
+        record(seconds)
+    elif command == 'synthesize':
+        profile = sys.argv[3] if len(sys.argv) > 3 else 'h265'
+        size = (int(sys.argv[4]), int(sys.argv[5])) if len(sys.argv) > 5 else SIZE
+        synthesize(seconds, profile, size)
+    else:
+        sys.exit(__doc__)
@@ -58,7 +58,13 @@ class WebRTC {
                 },
                 method: 'POST'
             }))
-            .then(response => response.json())
+            .then(response => response.json().then(answer => {
+                // 503 when the server has as many viewers as it takes
+                if (!response.ok) {
+                    throw new Error(answer.error);
+                }
+                return answer;
+            }))
             .then(answer => this.pc.setRemoteDescription(answer))
             .catch(e => alert(e))
     }
@@ -69,6 +75,8 @@ class WebRTC {
 
     createDataChannel(name, onClose, onOpen, onMessage) {
         const dc = this.pc.createDataChannel(name, {ordered: true});
+        // Detection batches come as binary messages
+        dc.binaryType = 'arraybuffer';
         dc.onclose = onClose;
         dc.onopen = onOpen;
         dc.onmessage = onMessage;
@@ -102,19 +110,91 @@ class WebRTC {
 let dataChannel;
 let webrtcInstance;
 
+// Lines kept in the status box, older ones are dropped
+const STATUS_LINES = 200;
+// Newest STATS and ABR pushes, shown in place rather than logged
+let latest = {};
+// Newest detections per camera: {seq, pts, detections: [{label, confidence, box}]}
+let detections = {};
+let detectionsOn = false;
+
+function parseDetections(buffer) {
+    // Packed batch, see python/detection.py: header 'D', version, frame count, then per
+    // frame camera, sequence number, pts (-1 for none) and its detections
+    const view = new DataView(buffer);
+    if (view.getUint8(0) !== 'D'.charCodeAt(0) || view.getUint8(1) !== 1) {
+        return;
+    }
+    const count = view.getUint16(2, true);
+    let offset = 4;
+    for (let f = 0; f < count; f++) {
+        const camera = view.getUint8(offset);
+        const seq = view.getUint32(offset + 1, true);
+        const pts = Number(view.getBigInt64(offset + 5, true));
+        const n = view.getUint16(offset + 13, true);
+        offset += 15;
+        const items = [];
+        for (let i = 0; i < n; i++) {
+            const box = [0, 1, 2, 3].map(j => view.getUint16(offset + 3 + 2 * j, true) / 65535);
+            items.push({label: view.getUint16(offset, true), confidence: view.getUint8(offset + 2) / 255, box: box});
+            offset += 11;
+        }
+        detections[camera] = {seq: seq, pts: pts < 0 ? null : pts, detections: items};
+    }
+}
+
+function log(text) {
+    const status = document.getElementById('status');
+    status.value = (status.value + "\n" + text).split("\n").slice(-STATUS_LINES).join("\n");
+}
+
+function renderStats() {
+    // STATS come every 2 s and ABR on every level change, only the newest of each is shown
+    const lines = [];
+    const stats = latest.STATS;
+    if (stats) {
+        const compose = stats.stages.compose || {};
+        const latency = stats.stages.latency || {};
+        lines.push(`compose ${compose.fps ?? '-'} fps ${compose.ms ?? '-'} ms  latency ${latency.ms ?? '-'} ms  ` +
+                   `viewers ${stats.viewers}  recording ${stats.recording}`);
+    }
+    const abr = latest.ABR;
+    if (abr) {
+        lines.push(`bitrate ${Math.round(abr.bitrate / 1000)} kbps  scale ${abr.scale}  fps ${abr.fps}  ` +
+                   `loss ${abr.loss}  rtt ${abr.rtt}`);
+    }
+    document.getElementById('stats').textContent = lines.join("\n");
+}
+
 function onMessage(evt) {
+    if (evt.data instanceof ArrayBuffer) {
+        parseDetections(evt.data);
+        return;
+    }
     const action = JSON.parse(evt.data);
-    document.getElementById('status').value += "\n" + action;
+    if (action.type === "STATS" || action.type === "ABR") {
+        latest[action.type] = action.payload;
+        renderStats();
+        return;
+    }
+    log(JSON.stringify(action));
+}
+
+function toggleDetections() {
+    detectionsOn = !detectionsOn;
+    if (dataChannel) {
+        dataChannel.send(JSON.stringify({'type': 'DETECTIONS', 'subscribe': detectionsOn}));
+    }
 }
 
 function stream_start() {
-    document.getElementById('status').value += "\nStarting stream..";
+    log("Starting stream..");
     
     webrtcInstance = new WebRTC();
     dataChannel = webrtcInstance.createDataChannel(
         'pingChannel',
-        () => document.getElementById('status').value += "\n[DC] closed",
-        () => document.getElementById('status').value += "\n[DC] opened",
+        () => log("[DC] closed"),
+        () => log("[DC] opened"),
         onMessage,
     );
     webrtcInstance.addMediaHandles(
@@ -125,7 +205,7 @@ function stream_start() {
 }
 
 function stream_stop() {
-    document.getElementById('status').value += "\nStopping stream..";
+    log("Stopping stream..");
 
     if(dataChannel) {
         dataChannel.send(JSON.stringify({
@@ -136,7 +216,7 @@ function stream_stop() {
 }
 
 function sendMessage(msg) {
-    document.getElementById('status').value += "\n" + msg + "...";
+    log(msg + "...");
     
     if(dataChannel) {
         dataChannel.send(JSON.stringify({
@@ -152,7 +232,7 @@ function confirmPowerDown() {
 }
 
 async function server_stop() {
-    document.getElementById('status').value += "\nStopping server...";
+    log("Stopping server...");
     const response = await fetch("/stop");
     console.log(response);
 }
@@ -9,8 +9,13 @@ from pathlib import Path
 from aiohttp import web
 from aiortc import RTCPeerConnection, RTCSessionDescription
 
-from python.datachannel import setup_datachannel
-from python.videowriter import VideoRecorder
+from python.adaptive import AdaptiveController
+from python.assets import AssetCache
+from python.datachannel import notify, setup_datachannel
+from python.footage import Footage
+from python.metrics import Exposition
+from python.sessions import SessionManager
+from python.videowriter import VideoRecorder, VideoTransformTrack
 
 logging.basicConfig(level=logging.INFO)
 logging.getLogger().addHandler(logging.StreamHandler())
@@ -25,23 +30,41 @@ async def test(request):
         }
     )
 
-async def index(request):
-    with (Path(__file__).parent / 'client/index.html').open() as f:
-        return web.Response(content_type="text/html", text=f.read())
+def load_assets():
+    # Client files are served from memory, precompressed, with 304 revalidation
+    assets = AssetCache()
+    assets.add("index", Path(__file__).parent / 'client/index.html', "text/html")
+    assets.add("javascript", Path(__file__).parent / 'client/js/client.js', "application/javascript")
+    return assets
 
 
-async def javascript(request):
-    with (Path(__file__).parent / 'client/js/client.js').open() as f:
-        return web.Response(content_type="application/javascript", text=f.read())
+async def metrics(request):
+    # Prometheus scrape target for the capture/compose/encode pipeline
+    engine = request.app.video_transform
+    sessions = Exposition()
+    request.app.sessions.expose(sessions)
+    return web.Response(
+        text=(engine.metrics() if engine is not None else "") + sessions.text(),
+        headers={"Content-Type": Exposition.CONTENT_TYPE}
+    )
 
 
 async def offer(request):
     params = await request.json()
     rtc_offer = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
 
+    sessions = request.app.sessions
+    if not sessions.admit():
+        return web.Response(
+            status=503,
+            content_type="application/json",
+            text=json.dumps({"error": f"At most {sessions.max_viewers} viewers at a time"}),
+        )
+
     pc = RTCPeerConnection()
     pc_id = "PeerConnection({})".format(uuid.uuid4())
-    request.app.pcs.add(pc)
+    # Closed with everything registered for it when the connection ends or goes idle
+    sessions.add(pc, pc_id)
 
     # handle offer
     await pc.setRemoteDescription(rtc_offer)
@@ -51,16 +74,23 @@ async def offer(request):
     setup_datachannel(pc, pc_id, request.app)
     for transceiver in pc.getTransceivers():
         if transceiver.kind == "video":
-            request.app.video_transform = VideoRecorder(request.app, pc_id)
-            pc.addTrack(request.app.video_transform)
-
+            # Viewers only subscribe to the shared engine, the devices are opened once at startup
+            track = VideoTransformTrack(request.app.video_transform, pc_id)
+            sender = pc.addTrack(track)
+
+            # Bitrate, scale and frame rate follow this viewer's RTCP receiver reports
+            track.controller = AdaptiveController(
+                sender, track,
+                on_change=lambda targets: notify(request.app, pc_id, "ABR", targets)
+            )
+            track.controller.start()
+            sessions.attach_track(pc_id, track, track.controller)
 
     @pc.on("iceconnectionstatechange")
     async def on_iceconnectionstatechange():
         logger.info("ICE connection state is {}".format(pc.iceConnectionState))
         if pc.iceConnectionState == "failed":
-            await pc.close()
-            request.app.pcs.discard(pc)
+            await sessions.close(pc_id, "ice_failed")
 
     @pc.on("track")
     def on_track(track):
@@ -80,16 +110,30 @@ async def stop_server(request):
     print("Attempting to stop server...")
     exit(1)
 
+async def on_startup(application):
+    # One capture/compose engine shared by every peer connection
+    application.video_transform = VideoRecorder(application)
+    application.video_transform.start()
+    application.sessions.start()
+
 async def on_shutdown(application):
     # close peer connections
+    await application.sessions.stop()
     coroutines = [pc.close() for pc in application.pcs]
     await asyncio.gather(*coroutines)
     application.pcs.clear()
 
+    if application.video_transform is not None:
+        application.video_transform.stop()
+
 def init_app(application):
     setattr(application, 'pcs', set())
     setattr(application, 'pcs_datachannels', {})
     setattr(application, 'video_transforms', {})
+    setattr(application, 'video_transform', None)
+    setattr(application, 'assets', load_assets())
+    setattr(application, 'sessions', SessionManager(application))
+    setattr(application, 'footage', Footage())
 
 if __name__ == "__main__":
     # Ensure usb drive is mounted
@@ -97,9 +141,11 @@ if __name__ == "__main__":
 
     app = web.Application()
     init_app(app)
+    app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
-    app.router.add_get("/", index)
-    app.router.add_get("/client.js", javascript)
+    app.router.add_get("/", app.assets.handler("index"))
+    app.router.add_get("/client.js", app.assets.handler("javascript"))
+    app.router.add_get("/metrics", metrics)
     cors = aiohttp_cors.setup(app, defaults={
         "*": aiohttp_cors.ResourceOptions(
                 allow_credentials=True,
@@ -110,4 +156,7 @@ if __name__ == "__main__":
     cors.add(app.router.add_get("/test", test))
     cors.add(app.router.add_post("/offer", offer))
     cors.add(app.router.add_get("/stop", stop_server))
+    # Recorded segments: listing, Range requests, keyframe index and thumbnails
+    for route in app.footage.routes(app.router.add_get):
+        cors.add(route)
     web.run_app(app, access_log=None, port=8080)
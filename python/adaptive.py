@@ -0,0 +1,132 @@
+import asyncio
+import traceback
+
+# Bitrate bounds and start value of the per-viewer controller (bps)
+MIN_BITRATE = 150000
+MAX_BITRATE = 3000000
+START_BITRATE = 1000000
+
+# Loss above HIGH_LOSS backs off multiplicatively, below LOW_LOSS probes upward
+HIGH_LOSS = 0.10
+LOW_LOSS = 0.02
+DECREASE = 0.85
+INCREASE = 1.08
+# A round trip time this much above the lowest seen means queues are building up
+RTT_RISE = 0.1  # s
+
+# (minimum bitrate, output scale, frame rate) from best to worst
+LEVELS = [
+    (1500000, 1.0, 28),
+    (800000, 1.0, 20),
+    (500000, 0.75, 20),
+    (300000, 0.5, 15),
+    (0, 0.5, 10),
+]
+
+RTP_CLOCK_RATE = 90000
+
+
+class AdaptiveController:
+    """
+    Adapts one viewer's encoder bitrate, output scale and frame rate to its link,
+    from the receiver reports of the RTCP channel of its sender (loss, RTT, jitter).
+    """
+    def __init__(self, sender, track, interval=1.0, on_change=None):
+        self.sender = sender
+        self.track = track
+        self.interval = interval
+        self.on_change = on_change
+        self.task = None
+
+        self.bitrate = START_BITRATE
+        self.applied = None
+        self.min_rtt = None
+        self.last_lost = None
+        self.level = None
+        (_, scale, fps) = next(level for level in LEVELS if self.bitrate >= level[0])
+        self.targets = {
+            "bitrate": self.bitrate,
+            "scale": scale,
+            "fps": fps,
+            "loss": 0.0,
+            "rtt": None,
+            "jitter": None,
+        }
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.track.readyState != "live" or self.sender.transport.state == "closed":
+                return
+            report = await self.sender.getStats()
+
+            remote = [s for s in report.values() if s.type == "remote-inbound-rtp"]
+            if not remote:
+                continue
+            try:
+                self.update(remote[0])
+            except Exception:
+                traceback.print_exc()
+
+    def update(self, stats):
+        loss = stats.fractionLost / 256
+        rtt = stats.roundTripTime
+        jitter = stats.jitter / RTP_CLOCK_RATE
+
+        # a report without new losses is a good one even if fractionLost is stale
+        if self.last_lost is not None and stats.packetsLost <= self.last_lost:
+            loss = 0.0
+        self.last_lost = stats.packetsLost
+
+        congested = loss > HIGH_LOSS
+        if rtt is not None:
+            self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+            congested = congested or rtt - self.min_rtt > RTT_RISE
+
+        if congested:
+            self.bitrate *= DECREASE
+        elif loss < LOW_LOSS:
+            self.bitrate *= INCREASE
+        self.bitrate = int(min(max(self.bitrate, MIN_BITRATE), MAX_BITRATE))
+
+        changed = self.apply()
+        self.targets.update({
+            "bitrate": self.bitrate,
+            "loss": round(loss, 3),
+            "rtt": None if rtt is None else round(rtt, 4),
+            "jitter": round(jitter, 4),
+        })
+        if changed and self.on_change is not None:
+            self.on_change(self.targets)
+
+    def apply(self):
+        # returns whether the scale/frame rate level changed
+        # aiortc has no public handle on a sender's encoder, it exists after the first frame
+        encoder = getattr(self.sender, "_RTCRtpSender__encoder", None)
+        if encoder is not None and hasattr(encoder, "target_bitrate"):
+            # aiortc applies REMB estimates directly; never exceed what the receiver asked for
+            if self.applied is not None and encoder.target_bitrate < self.applied:
+                self.bitrate = max(min(self.bitrate, encoder.target_bitrate), MIN_BITRATE)
+            encoder.target_bitrate = self.bitrate
+            # the encoder clamps (VP8 to 1.5 Mbps), carry on from what it took or a long
+            # clean period leaves the controller far above it and slow to back off
+            self.bitrate = encoder.target_bitrate
+            self.applied = encoder.target_bitrate
+
+        level = next(i for i, (minimum, _, _) in enumerate(LEVELS) if self.bitrate >= minimum)
+        if level == self.level:
+            return False
+
+        self.level = level
+        (_, scale, fps) = LEVELS[level]
+        self.track.scale = scale
+        self.track.max_fps = fps
+        self.targets.update({"scale": scale, "fps": fps})
+        return True
@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import time
+
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:
+    # Optional, gzip is served without it
+    brotli = None
+
+# Seconds between mtime checks of an asset, at most one stat per asset and interval
+CHECK_INTERVAL = 1.0
+
+
+class Asset:
+    def __init__(self, path, content_type):
+        self.path = Path(path)
+        self.content_type = content_type
+        self.mtime = None
+        self.checked = 0
+        self.load()
+
+    def load(self):
+        stat = self.path.stat()
+        body = self.path.read_bytes()
+        self.mtime = stat.st_mtime_ns
+        self.body = body
+        # encoding -> precompressed body, the identity body is always there
+        self.variants = {"gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=11)
+        # One ETag per representation, caches must not hand out a compressed body for another
+        digest = hashlib.sha1(body).hexdigest()[:16]
+        self.etags = {None: f'"{digest}"', "gzip": f'"{digest}-gz"', "br": f'"{digest}-br"'}
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+
+    def refresh(self):
+        # Reloads the asset when its file changed, rechecked at most every CHECK_INTERVAL
+        now = time.monotonic()
+        if now - self.checked < CHECK_INTERVAL:
+            return
+        self.checked = now
+        try:
+            if self.path.stat().st_mtime_ns != self.mtime:
+                self.load()
+        except OSError:
+            # Keep serving what was loaded, e.g. while an editor replaces the file
+            pass
+
+    def not_modified(self, request, etag):
+        etags = request.headers.get("If-None-Match")
+        if etags is not None:
+            # Weak comparison, a proxy may have marked the tag weak
+            return etag in (tag.strip().removeprefix("W/") for tag in etags.split(",")) or etags.strip() == "*"
+        since = request.headers.get("If-Modified-Since")
+        if since is not None:
+            try:
+                return parsedate_to_datetime(since) >= parsedate_to_datetime(self.last_modified)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def encoding(self, request):
+        accepted = set()
+        for part in request.headers.get("Accept-Encoding", "").split(","):
+            (name, *params) = part.split(";")
+            quality = 1.0
+            for param in params:
+                (key, _, value) = param.strip().partition("=")
+                if key.strip().lower() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            # q=0 (also written 0.0, 0.00...) means not acceptable
+            if quality > 0:
+                accepted.add(name.strip().lower())
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.variants:
+                return encoding
+        return None
+
+    def response(self, request):
+        encoding = self.encoding(request)
+        headers = {
+            "ETag": self.etags[encoding],
+            "Last-Modified": self.last_modified,
+            # Revalidated on every load, a 304 costs no body
+            "Cache-Control": "no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if self.not_modified(request, headers["ETag"]):
+            return web.Response(status=304, headers=headers)
+
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        body = self.body if encoding is None else self.variants[encoding]
+        return web.Response(body=body, content_type=self.content_type, charset="utf-8", headers=headers)
+
+
+class AssetCache:
+    """
+    Web client files held in memory with gzip (and brotli when installed) variants
+    precomputed, served with ETag/Last-Modified and answered with 304 when unchanged.
+    A file edited on disk is reloaded on the next request after CHECK_INTERVAL.
+    """
+    def __init__(self):
+        self.assets = {}
+
+    def add(self, name, path, content_type):
+        self.assets[name] = Asset(path, content_type)
+
+    def handler(self, name):
+        async def serve(request):
+            asset = self.assets[name]
+            asset.refresh()
+            return asset.response(request)
+        return serve
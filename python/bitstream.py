@@ -0,0 +1,57 @@
+import re
+
+# Annex-B start code, 3 bytes (a 4 byte one is a 3 byte one after a zero byte)
+START_CODE = re.compile(b'\x00\x00\x01')
+
+# NAL unit types of parameter sets and of slices that start a decodable picture
+H264_PARAMETER_SETS = {7, 8}  # SPS, PPS
+H264_KEYFRAMES = {5}  # IDR slice
+H265_PARAMETER_SETS = {32, 33, 34}  # VPS, SPS, PPS
+H265_KEYFRAMES = set(range(16, 22))  # BLA, IDR, CRA (IRAP pictures)
+
+
+def nalUnits(data):
+    """
+    Splits an Annex-B access unit (what the depthai VideoEncoder emits for H.264/H.265)
+    into (nal type, nal unit with its start code) tuples.
+    """
+    data = bytes(data)
+    starts = [m.start() for m in START_CODE.finditer(data)]
+    units = []
+    for i, start in enumerate(starts):
+        # The zero byte of a 4 byte start code belongs to the next unit
+        begin = start - 1 if start > 0 and data[start - 1] == 0 else start
+        end = starts[i + 1] if i + 1 < len(starts) else len(data)
+        if i + 1 < len(starts) and data[end - 1] == 0:
+            end -= 1
+        header = data[start + 3] if start + 3 < len(data) else 0
+        units.append((header, data[begin:end]))
+    return units
+
+
+def nalType(header, codec):
+    if codec == 'h264':
+        return header & 0x1f
+    return (header >> 1) & 0x3f
+
+
+def inspect(data, codec):
+    """
+    Returns (keyframe, parameter sets) of one encoded packet. MJPEG frames are all
+    keyframes without parameter sets, for H.264/H.265 the parameter sets are the
+    Annex-B extradata the MP4 muxer turns into its avcC/hvcC box.
+    """
+    if codec not in ('h264', 'hevc'):
+        return True, b''
+    parameter_sets = H264_PARAMETER_SETS if codec == 'h264' else H265_PARAMETER_SETS
+    keyframes = H264_KEYFRAMES if codec == 'h264' else H265_KEYFRAMES
+
+    keyframe = False
+    extradata = []
+    for header, unit in nalUnits(data):
+        kind = nalType(header, codec)
+        if kind in parameter_sets:
+            extradata.append(unit)
+        elif kind in keyframes:
+            keyframe = True
+    return keyframe, b''.join(extradata)
@@ -0,0 +1,152 @@
+import math
+import multiprocessing
+import time
+import cv2
+
+from concurrent.futures import ProcessPoolExecutor
+from python.stitching import Stitcher, estimateHomography, scoreHomography
+
+# Feature matching runs on frames downscaled by this factor
+CALIBRATION_SCALE = 0.5
+# Seconds between automatic refinements once a homography is in use, None disables them.
+# A refinement only replaces the homography if the scene drifted enough for it to score better.
+REFINE_INTERVAL = 60
+# A candidate replaces the homography in use only by this margin on the held-out matches:
+# this much larger a share of inliers, or as many and this much lower an RMS error
+MIN_INLIER_GAIN = 0.05
+MIN_ERROR_GAIN = 0.1
+
+
+def finite(value):
+    # inf is not valid JSON for the browser
+    return value if math.isfinite(value) else None
+
+
+def better(candidate, current):
+    # (inliers, error) on the same held-out matches, whether the difference is more than noise
+    (inliers, error) = candidate
+    (current_inliers, current_error) = current
+    if inliers > current_inliers * (1 + MIN_INLIER_GAIN):
+        return True
+    return inliers >= current_inliers and error < current_error * (1 - MIN_ERROR_GAIN)
+
+
+def idle_status():
+    return {
+        "state": "idle",
+        "inliers": 0,
+        "error": None,
+        "candidate_inliers": 0,
+        "candidate_error": None,
+        "swaps": 0,
+        "rejected": 0,
+        "failures": 0,
+    }
+
+
+class Calibrator:
+    """
+    Estimates homographies in a worker process so SIFT/FLANN/MAGSAC never stall the
+    stream. The stitcher in use keeps warping until a result arrives, and a new
+    homography replaces it only if it scores clearly better (see better()) on fresh
+    matches held out of its fit.
+    """
+    def __init__(self, scale=CALIBRATION_SCALE, refine_interval=REFINE_INTERVAL, reprojThresh=5.0):
+        self.scale = scale
+        self.refine_interval = refine_interval
+        self.reprojThresh = reprojThresh
+
+        self.pool = None
+        self.future = None
+        self.last_run = 0
+        self.size = None
+        # Seam (left device, right device, preview shape) the calibration and status are of
+        self.key = None
+        self.status = idle_status()
+
+    @property
+    def busy(self):
+        return self.future is not None and not self.future.done()
+
+    def submit(self, images, key=None):
+        self.switch(key)
+        if self.busy:
+            return False
+
+        if self.pool is None:
+            # spawn, a forked child would inherit the depthai/OpenCV threads of the parent
+            self.pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+        self.size = images[1].shape[:2]
+        small = [cv2.resize(img, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA) for img in images]
+        self.future = self.pool.submit(estimateHomography, small, self.scale, self.reprojThresh)
+        self.last_run = time.monotonic()
+        self.status["state"] = "running"
+        return True
+
+    def refine_due(self, stitcher):
+        if stitcher is None or self.refine_interval is None or self.busy:
+            return False
+        return time.monotonic() - self.last_run >= self.refine_interval
+
+    def switch(self, key):
+        # The seam now joins other cameras (TOGGLE) or previews: a result still being
+        # computed is of the old pair and is dropped, the status starts over
+        if key == self.key:
+            return
+        if self.future is not None:
+            self.future.cancel()
+            self.future = None
+        self.key = key
+        self.status = idle_status()
+
+    def status_of(self, left, right):
+        # Status of the seam between the `left` and `right` devices
+        if self.key is not None and self.key[:2] != (left, right):
+            return idle_status()
+        return self.status
+
+    def poll(self, stitcher, key=None):
+        """
+        Returns a new Stitcher when a finished calibration of the seam `key` beats
+        `stitcher`, otherwise None.
+        """
+        self.switch(key)
+        if self.future is None or not self.future.done():
+            return None
+
+        future, self.future = self.future, None
+        try:
+            homography, pts1, pts2 = future.result()
+        except Exception as e:
+            print(f"Calibration failed: {e}")
+            self.status["state"] = "failed"
+            self.status["failures"] += 1
+            return None
+
+        inliers, error = scoreHomography(homography, pts1, pts2, self.reprojThresh)
+        self.status["candidate_inliers"] = inliers
+        self.status["candidate_error"] = finite(error)
+
+        if stitcher is not None:
+            # Score the homography in use on the same held-out matches
+            current_inliers, current_error = scoreHomography(stitcher.homography, pts1, pts2, self.reprojThresh)
+            self.status["inliers"] = current_inliers
+            self.status["error"] = finite(current_error)
+            if not better((inliers, error), (current_inliers, current_error)):
+                self.status["state"] = "kept"
+                self.status["rejected"] += 1
+                return None
+
+        new_stitcher = Stitcher.from_homography(homography, size=self.size)
+        new_stitcher.inliers, new_stitcher.error = inliers, error
+        self.status["state"] = "swapped"
+        self.status["inliers"] = inliers
+        self.status["error"] = finite(error)
+        self.status["swaps"] += 1
+        return new_stitcher
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
@@ -0,0 +1,279 @@
+import json
+import os
+import time
+import traceback
+import depthai as dai
+
+from pathlib import Path
+from python.capture import CaptureThread
+from python.detection import DetectionReader
+from python.frames import splitNV12
+from python.recording import CameraRecorder
+from python.replay import REPLAY_DIR, ReplayBackend
+from python.segments import RECORDING_DIR, SegmentWriter
+
+PREVIEW_WIDTH = 600
+PREVIEW_HEIGHT = 400
+# FPS = 30
+FPS = 28
+# FPS = 20
+# ColorCamera.video, what the preview is cropped from (4K, or the centre of the 12MP sensor)
+VIDEO_WIDTH = 3840
+VIDEO_HEIGHT = 2160
+
+# Cameras of the rig, left to right. CAMERAS_CONFIG points elsewhere
+CONFIG_PATH = Path(__file__).parent.parent / 'cameras.json'
+
+
+def load_config(path=None):
+    """
+    [{"name": ..., "mxid": ...}] from the camera config. An entry without "mxid"
+    takes any connected device the other entries don't claim.
+    """
+    path = Path(path or os.environ.get('CAMERAS_CONFIG', CONFIG_PATH))
+    with open(path) as f:
+        config = json.load(f)
+    cameras = config["cameras"]
+    names = [camera["name"] for camera in cameras]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Camera names in {path} are not unique: {names}")
+    return cameras
+
+
+def regionRect(zoom=1.0, x=0.5, y=0.5):
+    """
+    Normalized (xmin, ymin, xmax, ymax) of the video frame a preview region covers:
+    the largest rectangle of the preview's aspect ratio, shrunk by `zoom` around (x, y)
+    and kept inside the frame.
+    """
+    width = min(1.0, PREVIEW_WIDTH * VIDEO_HEIGHT / (PREVIEW_HEIGHT * VIDEO_WIDTH)) / zoom
+    height = min(1.0, PREVIEW_HEIGHT * VIDEO_WIDTH / (PREVIEW_WIDTH * VIDEO_HEIGHT)) / zoom
+    xmin = min(max(x - width / 2, 0.0), 1.0 - width)
+    ymin = min(max(y - height / 2, 0.0), 1.0 - height)
+    return xmin, ymin, xmin + width, ymin + height
+
+
+def regionConfig(rect):
+    # Crop of the video frame, scaled to the preview size and converted to NV12
+    config = dai.ImageManipConfig()
+    config.setCropRect(*rect)
+    config.setResize(PREVIEW_WIDTH, PREVIEW_HEIGHT)
+    config.setKeepAspectRatio(False)
+    config.setFrameType(dai.RawImgFrame.Type.NV12)
+    return config
+
+
+def create_pipeline(settings, detection=None):
+    # ---------- Create pipeline
+    pipeline = dai.Pipeline()
+
+    # ---------- Define sources and outputs
+    cam = pipeline.create(dai.node.ColorCamera)
+    cam.setFps(FPS)
+    if settings.resolution == '12mp':
+        cam.setResolution(dai.ColorCameraProperties.SensorResolution.THE_12_MP) # (4056, 3040)
+    else:
+        cam.setResolution(dai.ColorCameraProperties.SensorResolution.THE_4_K)
+    # cam.setResolution(dai.ColorCameraProperties.SensorResolution.THE_1080_P)
+    cam.setVideoSize(VIDEO_WIDTH, VIDEO_HEIGHT)
+    cam.setImageOrientation(dai.CameraImageOrientation.ROTATE_180_DEG)
+
+    # Preview cropped from the 4K video frame and converted to NV12 on the device: the
+    # region of interest (pan/zoom, sent to the 'config' input) keeps full sensor detail
+    # and the host composes it straight into the yuv420p frames the WebRTC encoders
+    # take, no getCvFrame() conversion
+    previewManip = pipeline.create(dai.node.ImageManip)
+    previewManip.initialConfig.setCropRect(*regionRect())
+    previewManip.initialConfig.setResize(PREVIEW_WIDTH, PREVIEW_HEIGHT)
+    previewManip.initialConfig.setKeepAspectRatio(False)
+    previewManip.initialConfig.setFrameType(dai.RawImgFrame.Type.NV12)
+    previewManip.setMaxOutputFrameSize(PREVIEW_WIDTH * PREVIEW_HEIGHT * 3 // 2)
+    # A busy ImageManip skips video frames rather than holding up the encoder
+    previewManip.inputImage.setBlocking(False)
+    previewManip.inputImage.setQueueSize(1)
+
+    # Encoder, profile/bitrate/keyframe interval/resolution from the RECORD_* settings
+    videoEnc = settings.build(pipeline, cam, FPS)
+
+    # Optional detection network on the preview region, see DetectionSettings.build
+    if detection is not None and detection.enabled:
+        detection.build(pipeline, previewManip)
+
+    """
+    LINKING -- MAKE SURE THIS PART IS CORRECT! FAILURE IS HARD TO DETECT
+    """
+    outPreview = pipeline.create(dai.node.XLinkOut)
+    outEncoded = pipeline.create(dai.node.XLinkOut)
+
+    outPreview.setStreamName('preview')
+    outEncoded.setStreamName('encoded')
+
+    print(f"Preview: {outPreview}")
+    print(f"Encoded: {outEncoded}")
+
+    # Preview stream
+    # CAM VIDEO --> IMAGE MANIPULATOR (crop, resize, NV12) --> XLINKOUT (HOST)
+    cam.video.link(previewManip.inputImage)
+    previewManip.out.link(outPreview.input)
+    # Encoded stream
+    # (see EncoderSettings.build) --> VIDEO ENCODER --> XLINKOUT (HOST)
+    videoEnc.bitstream.link(outEncoded.input)
+
+    """
+    CONTROL CAMERA CONFIGURATION SETTINGS (EXPOSURE, WHITE BALANCE, ETC.) AND PREVIEW REGION
+    """
+    controlIn = pipeline.create(dai.node.XLinkIn)
+    configIn = pipeline.create(dai.node.XLinkIn)
+
+    controlIn.setStreamName('control')
+    configIn.setStreamName('config')
+
+    controlIn.out.link(cam.inputControl)
+    # Only the preview is cropped, the recording always has the full frame
+    configIn.out.link(previewManip.inputConfig)
+    return pipeline
+
+
+class OakBackend:
+    """
+    The OAK devices connected to the host. A backend finds the cameras (discover) and
+    opens one (open), returning its device, anything with the getOutputQueue/
+    getInputQueue/close of a dai.Device, and the encoder settings in effect. With an
+    enabled `detection` the device has a 'detections' output queue as well.
+    """
+    name = "oak"
+
+    def discover(self):
+        # MXIDs of the devices connected and not booted by another process
+        return [info.getMxId() for info in dai.Device.getAllAvailableDevices()]
+
+    def open(self, mxid, settings, detection=None):
+        # Get device by ID
+        info = dai.DeviceInfo(mxid)
+        try:
+            return dai.Device(create_pipeline(settings, detection), info), settings
+        except RuntimeError as e:
+            if settings.profile == 'mjpeg':
+                raise
+            print(f"{mxid}: {settings.profile} pipeline failed ({e}), falling back to MJPEG")
+            settings = settings.fallback()
+            return dai.Device(create_pipeline(settings, detection), info), settings
+
+
+def backend_from_env(environ=os.environ):
+    # DEVICE_BACKEND=replay replays the cameras recorded in REPLAY_DIR instead
+    name = environ.get('DEVICE_BACKEND', 'oak').lower()
+    if name == 'oak':
+        return OakBackend()
+    if name == 'replay':
+        return ReplayBackend(environ.get('REPLAY_DIR', REPLAY_DIR))
+    raise ValueError(f"Unknown device backend {name}, expected oak or replay")
+
+
+class Camera:
+    """
+    One OAK device of the rig: its pipeline, queues, preview capture thread and
+    recording writer. boot() blocks for seconds and is run on a worker thread, all
+    cameras boot at the same time. A camera that fails to boot stays "missing" or
+    "failed" and the rig runs without it. The device comes from `backend`, recordings
+    go to `<recordings>/<name>/`.
+    """
+    def __init__(self, name, mxid=None, backend=None, recordings=RECORDING_DIR):
+        self.name = name
+        self.mxid = mxid
+        self.backend = backend or OakBackend()
+        self.recordings = recordings
+        self.state = "pending"
+        self.error = None
+        self.boot_time = None
+
+        self.device = None
+        self.preview = None
+        self.control = None
+        self.config = None
+        self.encoded = None
+        self.detections = None
+        self.segments = None
+        self.capture = None
+        self.writer = None
+        self.detector = None
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def boot(self, settings, detection=None):
+        start = time.perf_counter()
+        try:
+            self.open(settings.resolve(FPS), detection)
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            traceback.print_exc()
+        else:
+            self.state = "running"
+        finally:
+            self.boot_time = time.perf_counter() - start
+        print(f"{self.name} ({self.mxid}): {self.state} after {self.boot_time:.2f}s")
+        return self
+
+    def open(self, settings, detection=None):
+        """
+        GET QUEUES AFTER CREATING DEVICE OBJECT
+        """
+        device, settings = self.backend.open(self.mxid, settings, detection)
+        self.device = device
+
+        # Set up recording, rotating segments in <recordings>/<name>/
+        self.segments = SegmentWriter(self.recordings, self.name, settings.codec, settings.size, settings.pix_fmt)
+
+        # Output queue
+        self.preview = device.getOutputQueue(name="preview", maxSize=4, blocking=False)
+        self.encoded = device.getOutputQueue(name="encoded", maxSize=30, blocking=False)
+        if detection is not None and detection.enabled:
+            self.detections = device.getOutputQueue(name="detections", maxSize=8, blocking=False)
+
+        self.control = device.getInputQueue('control')
+        self.config = device.getInputQueue('config')
+
+        print(f"Camera: {device}")
+        print(f"Queue: {self.preview}")
+        print(f"Recorder: {self.segments}")
+        print(f"Queue Encoded: {self.encoded}")
+
+    def start(self, slot, to_host, stats, on_detections=None):
+        # NV12 straight from the device, split into plane views without copying
+        self.capture = CaptureThread(self.preview, slot, f"capture-{self.name}", splitNV12, stats)
+        # Encoded packets are drained and muxed on a writer thread of their own
+        self.writer = CameraRecorder(self.encoded, self.segments, f"writer-{self.name}", to_host=to_host, stats=stats)
+        self.capture.start()
+        self.writer.start()
+        if self.detections is not None and on_detections is not None:
+            self.detector = DetectionReader(self.detections, on_detections, f"detections-{self.name}")
+            self.detector.start()
+
+    def stop(self):
+        # Closing the device unblocks the capture and writer threads
+        for worker in (self.capture, self.writer, self.detector):
+            if worker is not None:
+                worker.running = False
+        if self.device is not None:
+            self.device.close()
+        if self.capture is not None:
+            self.capture.stop()
+        if self.detector is not None:
+            self.detector.stop()
+        if self.writer is not None:
+            self.writer.stop()
+        elif self.segments is not None:
+            self.segments.close()
+        self.device = None
+
+    def status(self):
+        return {
+            "name": self.name,
+            "mxid": self.mxid,
+            "state": self.state,
+            "boot_s": None if self.boot_time is None else round(self.boot_time, 3),
+            "error": self.error,
+        }
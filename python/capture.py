@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+import traceback
+
+from collections import deque, namedtuple
+
+# A converted frame with its capture time on the host-synced clock (dai.Clock.now()),
+# on the device's own clock, and its device sequence number
+Captured = namedtuple('Captured', 'image timestamp device_timestamp sequence')
+
+
+class LatestFrame:
+    """
+    Single slot holding the newest frame of a device.
+
+    A capture thread overwrites the slot, coroutines await the next value without
+    blocking the event loop. Older values are never queued: a slow reader simply
+    skips the frames it missed. The last `history` values stay available for pairing.
+    """
+    def __init__(self, loop=None, history=1):
+        self.loop = loop or asyncio.get_event_loop()
+        self.value = None
+        self.seq = 0
+        self.history = deque(maxlen=history)
+        self._waiters = []
+
+    def put(self, value):
+        # Safe to call from any thread
+        self.loop.call_soon_threadsafe(self._set, value)
+
+    def _set(self, value):
+        self.value = value
+        self.seq += 1
+        self.history.append(value)
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def next(self, seen=0):
+        # Wait for a value newer than sequence number `seen`, return (seq, value)
+        while self.seq <= seen:
+            waiter = self.loop.create_future()
+            self._waiters.append(waiter)
+            await waiter
+        return self.seq, self.value
+
+
+class CaptureThread(threading.Thread):
+    """
+    Pulls frames from a blocking depthai output queue on a dedicated thread and
+    publishes them to a LatestFrame slot as Captured tuples. `convert` (getCvFrame by
+    default) runs here as well, so whatever it costs never touches the event loop.
+
+    Latency first: whatever queued up behind the frame just read is drained and only
+    the newest frame is converted and published. `skipped` counts the drained frames,
+    `dropped` the sequence numbers that never reached the host and `depth` is how many
+    frames were queued at the last read.
+    """
+    def __init__(self, queue, slot, name, convert=None, stats=None):
+        super().__init__(name=name, daemon=True)
+        self.queue = queue
+        self.slot = slot
+        self.convert = convert or (lambda frame: frame.getCvFrame())
+        self.stats = stats
+        self.running = True
+        self.frames = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.depth = 0
+        self.last_seq = None
+
+    def run(self):
+        while self.running:
+            start = time.perf_counter()
+            try:
+                frame = self.queue.get()
+            except RuntimeError:
+                # Queue was closed together with its device
+                break
+            if self.stats is not None:
+                self.stats.record("capture_wait", time.perf_counter() - start)
+
+            depth = 1
+            while True:
+                newer = self.queue.tryGet()
+                if newer is None:
+                    break
+                frame = newer
+                depth += 1
+            self.skipped += depth - 1
+            self.depth = depth
+
+            seq = frame.getSequenceNum()
+            if self.last_seq is not None and seq > self.last_seq + depth:
+                self.dropped += seq - self.last_seq - depth
+            self.last_seq = seq
+
+            start = time.perf_counter()
+            try:
+                img = self.convert(frame)
+            except Exception:
+                traceback.print_exc()
+                continue
+
+            if img is None:
+                print(f"{self.name}: empty image after frame conversion")
+                continue
+
+            if self.stats is not None:
+                self.stats.record("capture", time.perf_counter() - start)
+            self.frames += 1
+            self.slot.put(Captured(img, frame.getTimestamp(), frame.getTimestampDevice(), frame.getSequenceNum()))
+
+    def stop(self, timeout=1.0):
+        self.running = False
+        self.join(timeout)
@@ -0,0 +1,241 @@
+import numpy as np
+import cv2
+
+from python.stitching import BLEND, GAIN_INTERVAL, GAIN_LIMITS, GAIN_SMOOTHING, CanvasPool, scaleHomography
+
+
+def adjacent(width):
+    # Homography of a camera not calibrated yet: placed right of its neighbour, no overlap
+    return np.array([[1.0, 0.0, width], [0.0, 1.0, 0.0], [0.0, 0.0, 1.0]])
+
+
+def span(homography, shape, width):
+    # Canvas columns the image covers once warped, clipped to the canvas
+    (h, w) = shape[:2]
+    corners = np.float32([[0, 0], [w, 0], [w, h], [0, h]]).reshape(-1, 1, 2)
+    xs = cv2.perspectiveTransform(corners, homography).reshape(-1, 2)[:, 0]
+    return int(np.clip(np.floor(xs.min()), 0, width)), int(np.clip(np.ceil(xs.max()), 0, width))
+
+
+class Piece:
+    # Canvas columns x0..x1 of one camera, warped straight into them. Where the camera is
+    # only shifted sideways by whole pixels (the reference camera, neighbours not
+    # calibrated yet) its columns are copied instead.
+    def __init__(self, homography, shape, columns, rows):
+        self.columns = columns
+        self.rows = rows
+        dx = homography[0, 2]
+        self.shift = None
+        if np.allclose(homography, [[1, 0, dx], [0, 1, 0], [0, 0, 1]]) and dx == int(dx):
+            if 0 <= columns[0] - dx and columns[1] - dx <= shape[1] and rows <= shape[0]:
+                self.shift = int(dx)
+        # Onto the piece's own columns, so it is warped into a view of the canvas
+        self.homography = np.array([[1, 0, -columns[0]], [0, 1, 0], [0, 0, 1]]) @ homography
+
+    @property
+    def empty(self):
+        return self.columns[0] >= self.columns[1]
+
+    def source(self, image, rows):
+        (x0, x1) = self.columns
+        return image[:rows, x0 - self.shift:x1 - self.shift]
+
+    @property
+    def size(self):
+        return (self.columns[1] - self.columns[0], self.rows)
+
+    def warp(self, image, dst, border):
+        if self.shift is not None:
+            dst[:] = self.source(image, dst.shape[0])
+        else:
+            # Into the pooled canvas, nothing allocated per frame. Faster than remapping
+            # through precomputed tables, see bench_stitch.
+            cv2.warpPerspective(image, self.homography, self.size, dst=dst, flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=border)
+
+    def coverage(self, shape, rows):
+        # 1 where the camera's image is fully behind the canvas pixel
+        if self.shift is not None:
+            return np.ones((rows, self.columns[1] - self.columns[0]), np.uint8)
+        ones = np.full(shape[:2], 255, np.uint8)
+        valid = cv2.warpPerspective(ones, self.homography, self.size, flags=cv2.INTER_LINEAR,
+                                    borderMode=cv2.BORDER_CONSTANT)
+        return (valid == 255).astype(np.uint8)
+
+
+class Seam:
+    # Overlap of two neighbouring cameras: both are warped into buffers of their own
+    # and feathered into the canvas with weights fixed by the homographies
+    def __init__(self, left, right, shapeL, shapeR, rows, channels):
+        self.columns = left.columns
+        self.left = left
+        self.right = right
+        (x0, x1) = self.columns
+        self.bufferL = np.zeros((rows, x1 - x0) + channels, dtype=np.uint8)
+        self.bufferR = np.zeros_like(self.bufferL)
+
+        # distance to the edge of either image, each padded on the side its neighbour takes over
+        validL = left.coverage(shapeL, rows)
+        validR = right.coverage(shapeR, rows)
+        distL = cv2.distanceTransform(cv2.copyMakeBorder(validL, 0, 0, 0, 1, cv2.BORDER_CONSTANT, value=0), cv2.DIST_L2, 3)[:, :-1]
+        distR = cv2.distanceTransform(cv2.copyMakeBorder(validR, 0, 0, 1, 0, cv2.BORDER_CONSTANT, value=0), cv2.DIST_L2, 3)[:, 1:]
+        total = distL + distR
+        weightR = np.divide(distR, total, out=np.full_like(total, 0.5), where=total > 0)
+
+        self.weightR = np.ascontiguousarray(weightR, dtype=np.float32)
+        self.weightL = np.ascontiguousarray(1 - weightR, dtype=np.float32)
+        # pixels both cameras see, where their brightness is compared
+        self.mask = (validL & validR) * 255
+
+    def means(self):
+        # Per channel means of both sides, called while the buffers hold the frame as captured
+        meanL = np.array(cv2.mean(self.bufferL, self.mask)[:3])
+        meanR = np.array(cv2.mean(self.bufferR, self.mask)[:3])
+        return meanL, meanR
+
+
+class CanvasTables:
+    """
+    Pieces, seams and blend weights of one plane geometry of N cameras. The canvas
+    is split into columns covered by a single camera, warped straight into the canvas,
+    and the seams of neighbouring cameras, blended. The cameras are warped in parallel,
+    then the seams.
+    """
+    def __init__(self, homographies, shapes, blend=BLEND):
+        self.shapes = shapes
+        rows = shapes[0][0]
+        width = sum(shape[1] for shape in shapes)
+        channels = tuple(shapes[0][2:])
+
+        # interleaved NV12 chroma is centred on 128: that is its black, and scaling it
+        # for exposure compensation would shift the colours
+        self.chroma = channels == (2,)
+        self.border = (128, 128) if self.chroma else 0
+        self.gain = not self.chroma
+        self.canvases = CanvasPool((rows, width) + channels, fill=128 if self.chroma else 0)
+
+        # Seam between camera i and i + 1: from where the right one starts to where the left
+        # one ends. Only neighbours may overlap, a seam never reaches into the next one.
+        spans = [span(homography, shape, width) for homography, shape in zip(homographies, shapes)]
+        seams = []
+        end = 0
+        for i in range(1, len(shapes)):
+            if blend:
+                start = min(max(spans[i][0], end), width)
+                end = min(max(spans[i - 1][1], start), width)
+            else:
+                # hard seam, the left camera is shown as far as it reaches
+                start = end = min(max(spans[i - 1][1], end), width)
+            seams.append((start, end))
+
+        # Each camera fills its own columns, and its halves of the seams on either side
+        self.pieces = []
+        self.seams = []
+        for i, (homography, shape) in enumerate(zip(homographies, shapes)):
+            x0 = seams[i - 1][1] if i > 0 else 0
+            x1 = seams[i][0] if i < len(seams) else width
+            self.pieces.append(Piece(homography, shape, (x0, x1), rows))
+        for i, columns in enumerate(seams):
+            if columns[0] < columns[1]:
+                left = Piece(homographies[i], shapes[i], columns, rows)
+                right = Piece(homographies[i + 1], shapes[i + 1], columns, rows)
+                self.seams.append((i, Seam(left, right, shapes[i], shapes[i + 1], rows, channels)))
+        # Gains are only estimated on seams, without any they stay 1 and cost a multiply per pixel
+        self.gain = self.gain and bool(self.seams)
+
+        self.gains = [(1.0, 1.0, 1.0, 0.0)] * len(shapes)
+        self.frame = 0
+
+    def warpCamera(self, i, image, result, gains):
+        piece = self.pieces[i]
+        if not piece.empty:
+            (x0, x1) = piece.columns
+            dst = result[:, x0:x1]
+            if self.gain and piece.shift is not None:
+                cv2.multiply(piece.source(image, dst.shape[0]), gains[i], dst=dst)
+            else:
+                piece.warp(image, dst, self.border)
+                if self.gain:
+                    cv2.multiply(dst, gains[i], dst=dst)
+        for (left, seam) in self.seams:
+            if left == i:
+                seam.left.warp(image, seam.bufferL, self.border)
+            elif left + 1 == i:
+                seam.right.warp(image, seam.bufferR, self.border)
+
+    def blendSeam(self, left, seam, result, gains):
+        (x0, x1) = seam.columns
+        if self.gain:
+            cv2.multiply(seam.bufferL, gains[left], dst=seam.bufferL)
+            cv2.multiply(seam.bufferR, gains[left + 1], dst=seam.bufferR)
+        cv2.blendLinear(seam.bufferL, seam.bufferR, seam.weightL, seam.weightR, dst=result[:, x0:x1])
+
+    def updateGains(self):
+        # Chain the brightness ratios across the seams and split the differences over all
+        # cameras, so neither end of the panorama drifts darker
+        target = [np.ones(3)]
+        for i in range(1, len(self.shapes)):
+            ratio = np.ones(3)
+            for (left, seam) in self.seams:
+                if left + 1 == i:
+                    meanL, meanR = seam.means()
+                    ratio = (meanL + 1) / (meanR + 1)
+            target.append(target[-1] * ratio)
+        target = np.array(target)
+        target /= np.exp(np.log(target).mean(axis=0))
+
+        previous = np.array([gain[:3] for gain in self.gains])
+        gains = np.clip(previous + GAIN_SMOOTHING * (target - previous), *GAIN_LIMITS)
+        return [tuple(float(g) for g in gain) + (0.0,) for gain in gains]
+
+    def warp(self, images, pool=None, out=None):
+        result = self.canvases.next() if out is None else out
+        run = map if pool is None else pool.map
+        gains = self.gains
+
+        list(run(self.warpCamera, range(len(images)), images, [result] * len(images), [gains] * len(images)))
+
+        # the seam buffers still hold this frame as captured
+        update = self.gain and self.seams and self.frame % GAIN_INTERVAL == 0
+        self.frame += 1
+        gains_next = self.updateGains() if update else gains
+
+        if self.seams:
+            (lefts, seams) = zip(*self.seams)
+            list(run(self.blendSeam, lefts, seams, [result] * len(seams), [gains] * len(seams)))
+        self.gains = gains_next
+        return result
+
+
+class Compositor:
+    """
+    Composes the images of N cameras, left to right, on one canvas as wide as all of them.
+
+    Takes the homographies between neighbouring cameras (camera i onto camera i - 1, as
+    estimated by the Calibrator) and chains them onto the leftmost camera, whose pixels
+    are the canvas pixels. Pieces, seams and blend weights are built once per plane
+    geometry. With a `pool` every camera is warped on a thread of its own, OpenCV
+    releases the GIL.
+    """
+    def __init__(self, homographies, size, blend=BLEND, pool=None):
+        # (h, w) of the images the homographies were estimated on, other planes get scaled copies
+        self.size = tuple(size)
+        self.blend = blend
+        self.pool = pool
+
+        self.homographies = [np.eye(3)]
+        for homography in homographies:
+            self.homographies.append(self.homographies[-1] @ homography)
+        self.tables = {}
+
+    def tablesFor(self, shapes):
+        tables = self.tables.get(shapes)
+        if tables is None:
+            scale = shapes[0][1] / self.size[1]
+            homographies = [scaleHomography(homography, scale) for homography in self.homographies]
+            tables = CanvasTables(homographies, shapes, self.blend)
+            self.tables[shapes] = tables
+        return tables
+
+    def warp(self, images, out=None):
+        return self.tablesFor(tuple(image.shape for image in images)).warp(images, self.pool, out)
@@ -0,0 +1,205 @@
+import numpy as np
+import depthai as dai
+
+from python.cameras import PREVIEW_HEIGHT, PREVIEW_WIDTH, regionConfig, regionRect
+
+# Manual exposure/white-balance limits of the color sensor
+EXPOSURE_LIMITS = (1, 33000)  # us
+ISO_LIMITS = (100, 1600)
+WHITE_BALANCE_LIMITS = (1000, 12000)  # K
+# Digital zoom of the preview region, at 5.4x a preview pixel is a sensor pixel
+ZOOM_LIMITS = (1.0, 5.4)
+
+AWB_MODES = [item for name, item in vars(dai.CameraControl.AutoWhiteBalanceMode).items() if name.isupper()]
+
+
+def clamp(value, limits):
+    return max(limits[0], min(value, limits[1]))
+
+
+def selectCameras(cam, count):
+    # 1-based camera number, None for all of them
+    if cam is None:
+        return range(count)
+    if not 1 <= cam <= count:
+        raise ValueError(f"No camera {cam}")
+    return [cam - 1]
+
+
+class CameraControls:
+    """
+    Manual exposure, sensitivity and white balance per camera, `queues` are their
+    control input queues (None for a camera that isn't running).
+
+    Changes only update the target values, flush() sends them as one CameraControl per
+    camera that changed. Called once per composed frame, a held button costs the
+    device at most one control message per frame instead of one per click.
+    """
+    def __init__(self, queues, exposure=20000, iso=800, white_balance=4000):
+        self.queues = queues
+        self.state = [{"exposure": exposure, "iso": iso, "white_balance": white_balance, "awb_mode": None}
+                      for _ in queues]
+        self.pending = [set() for _ in queues]
+        self.requested = 0
+        self.sent = 0
+
+    def cameras(self, cam):
+        return selectCameras(cam, len(self.queues))
+
+    def set(self, cam, name, value=None, delta=0, limits=None):
+        for i in self.cameras(cam):
+            state = self.state[i]
+            target = (state[name] if value is None else value) + delta
+            state[name] = target if limits is None else clamp(target, limits)
+            self.pending[i].add(name)
+            self.requested += 1
+        return [self.state[i][name] for i in self.cameras(cam)]
+
+    def exposure(self, cam=None, value=None, delta=0):
+        return self.set(cam, "exposure", value, delta, EXPOSURE_LIMITS)
+
+    def iso(self, cam=None, value=None, delta=0):
+        return self.set(cam, "iso", value, delta, ISO_LIMITS)
+
+    def white_balance(self, cam=None, value=None, delta=0):
+        # Manual white balance turns AWB off, whichever came last wins
+        for i in self.cameras(cam):
+            self.state[i]["awb_mode"] = None
+            self.pending[i].discard("awb_mode")
+        return self.set(cam, "white_balance", value, delta, WHITE_BALANCE_LIMITS)
+
+    def next_awb_mode(self, cam=None):
+        modes = []
+        for i in self.cameras(cam):
+            current = self.state[i]["awb_mode"]
+            mode = AWB_MODES[(AWB_MODES.index(current) + 1) % len(AWB_MODES)] if current in AWB_MODES else AWB_MODES[0]
+            self.state[i]["awb_mode"] = mode
+            self.pending[i].discard("white_balance")
+            self.pending[i].add("awb_mode")
+            self.requested += 1
+            modes.append(mode)
+        return modes
+
+    def flush(self):
+        for queue, state, pending in zip(self.queues, self.state, self.pending):
+            if not pending:
+                continue
+            if queue is None:
+                # Camera not running
+                pending.clear()
+                continue
+            ctrl = dai.CameraControl()
+            if "exposure" in pending or "iso" in pending:
+                ctrl.setManualExposure(state["exposure"], state["iso"])
+            if "white_balance" in pending:
+                ctrl.setManualWhiteBalance(state["white_balance"])
+            if "awb_mode" in pending:
+                ctrl.setAutoWhiteBalanceMode(state["awb_mode"])
+            pending.clear()
+            queue.send(ctrl)
+            self.sent += 1
+
+    def stats(self):
+        return {
+            "requested": self.requested,
+            "sent": self.sent,
+            "cameras": [{k: str(v) if k == "awb_mode" and v is not None else v for k, v in state.items()}
+                        for state in self.state],
+        }
+
+
+class CameraRegions:
+    """
+    Digital pan/zoom per camera: the region of the video frame its preview shows,
+    cropped and scaled by the preview's ImageManip on the device, so a zoomed preview
+    has the detail of the sensor and costs the host nothing. `queues` are the cameras'
+    config input queues (None for a camera that isn't running).
+
+    Like CameraControls, changes only move the target region and flush() sends one
+    ImageManipConfig per camera that changed. `generation` counts the changes, the
+    compositor is rebuilt for a new one.
+    """
+    def __init__(self, queues):
+        self.queues = queues
+        # Centre of the region in the video frame (0-1) and zoom
+        self.state = [{"zoom": 1.0, "x": 0.5, "y": 0.5} for _ in queues]
+        self.pending = [False for _ in queues]
+        self.generation = 0
+        self.requested = 0
+        self.sent = 0
+
+    def cameras(self, cam):
+        return selectCameras(cam, len(self.queues))
+
+    def rect(self, i):
+        state = self.state[i]
+        return regionRect(state["zoom"], state["x"], state["y"])
+
+    def update(self, i):
+        # The centre follows the region where it stopped at the edge of the frame
+        (xmin, ymin, xmax, ymax) = self.rect(i)
+        self.state[i]["x"] = (xmin + xmax) / 2
+        self.state[i]["y"] = (ymin + ymax) / 2
+        self.pending[i] = True
+        self.generation += 1
+        self.requested += 1
+
+    def pan(self, cam=None, dx=0, dy=0):
+        # By preview pixels of the region as shown, steps stay the same size on screen at any zoom
+        for i in self.cameras(cam):
+            (xmin, ymin, xmax, ymax) = self.rect(i)
+            self.state[i]["x"] += dx * (xmax - xmin) / PREVIEW_WIDTH
+            self.state[i]["y"] += dy * (ymax - ymin) / PREVIEW_HEIGHT
+            self.update(i)
+        return [self.region(i) for i in self.cameras(cam)]
+
+    def zoom(self, cam=None, value=None, delta=0.0):
+        for i in self.cameras(cam):
+            state = self.state[i]
+            state["zoom"] = clamp((state["zoom"] if value is None else value) + delta, ZOOM_LIMITS)
+            self.update(i)
+        return [self.region(i) for i in self.cameras(cam)]
+
+    def reset(self, cam=None):
+        for i in self.cameras(cam):
+            self.state[i] = {"zoom": 1.0, "x": 0.5, "y": 0.5}
+            self.update(i)
+        return [self.region(i) for i in self.cameras(cam)]
+
+    def full(self, i):
+        return self.rect(i) == regionRect()
+
+    def affine(self, i):
+        """
+        3x3 matrix taking the preview pixels of the full view to those of the region,
+        so homographies estimated on the full views apply to the regions too.
+        """
+        (xmin, ymin, xmax, ymax) = self.rect(i)
+        (fxmin, fymin, fxmax, fymax) = regionRect()
+        zoom = (fxmax - fxmin) / (xmax - xmin)
+        return np.array([
+            [zoom, 0.0, (fxmin - xmin) * PREVIEW_WIDTH / (xmax - xmin)],
+            [0.0, zoom, (fymin - ymin) * PREVIEW_HEIGHT / (ymax - ymin)],
+            [0.0, 0.0, 1.0],
+        ])
+
+    def region(self, i):
+        return {"zoom": round(self.state[i]["zoom"], 3), "rect": [round(v, 4) for v in self.rect(i)]}
+
+    def flush(self):
+        for i, queue in enumerate(self.queues):
+            if not self.pending[i]:
+                continue
+            self.pending[i] = False
+            if queue is None:
+                # Camera not running
+                continue
+            queue.send(regionConfig(self.rect(i)))
+            self.sent += 1
+
+    def stats(self):
+        return {
+            "requested": self.requested,
+            "sent": self.sent,
+            "cameras": [self.region(i) for i in range(len(self.queues))],
+        }
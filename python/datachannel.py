@@ -1,156 +1,385 @@
 import json
+import re
 import urllib.parse
 import traceback
-import depthai as dai
 import os
 
 from json import JSONDecodeError
-from itertools import cycle
 
-# Step size ('W','A','S','D' controls)
+# Step size ('W','A','S','D' controls), preview pixels
 STEP_SIZE = 8
+ZOOM_STEP = 0.25
 # Manual exposure/focus/white-balance set step
 EXP_STEP = 500  # us
 ISO_STEP = 50
 LENS_STEP = 3
 WB_STEP = 200
 
+# Message type -> Command
+COMMANDS = {}
+# Old style button messages like EXPOSURE_MORE_CAM1, mapped onto parameterized commands
+LEGACY = re.compile(r'^(EXPOSURE|WHITE_BALANCE|ISO|AWB_MODE)(?:_(MORE|LESS))?_CAM(\d+)$')
+LEGACY_STEPS = {"EXPOSURE": EXP_STEP, "WHITE_BALANCE": WB_STEP, "ISO": ISO_STEP}
+# Key messages W/A/S/D (pan), ZOOM_IN/ZOOM_OUT and ROI_RESET, optionally _CAM<n>, mapped
+# onto PAN, ZOOM and ROI_RESET
+KEYS = re.compile(r'^(W|A|S|D|ZOOM_IN|ZOOM_OUT|ROI_RESET)(?:_CAM(\d+))?$')
+KEY_STEPS = {
+    "W": ("PAN", "dy", -STEP_SIZE),
+    "S": ("PAN", "dy", STEP_SIZE),
+    "A": ("PAN", "dx", -STEP_SIZE),
+    "D": ("PAN", "dx", STEP_SIZE),
+    "ZOOM_IN": ("ZOOM", "delta", ZOOM_STEP),
+    "ZOOM_OUT": ("ZOOM", "delta", -ZOOM_STEP),
+    "ROI_RESET": ("ROI_RESET", None, None),
+}
+# Handlers returning this reply on their own
+NO_REPLY = object()
+
+
+def notify(app, pc_id, msg_type, payload):
+    # Push a message to a peer outside of a request/response exchange
+    channel = app.pcs_datachannels.get(pc_id)
+    if channel is not None and channel.readyState == "open":
+        channel.send(json.dumps({
+            "type": msg_type,
+            "payload": payload
+        }))
+
+
+def send_binary(app, pc_id, data):
+    # Push packed bytes (see python/detection.py) to a peer, returns whether they went out
+    channel = app.pcs_datachannels.get(pc_id)
+    if channel is not None and channel.readyState == "open":
+        channel.send(data)
+        return True
+    return False
+
+
+class Context:
+    __slots__ = ("app", "pc_id", "channel")
+
+    def __init__(self, app, pc_id, channel):
+        self.app = app
+        self.pc_id = pc_id
+        self.channel = channel
+
+    @property
+    def engine(self):
+        return self.app.video_transform
+
+
+class Command:
+    def __init__(self, name, handler, params, reply):
+        self.name = name
+        self.handler = handler
+        self.params = params
+        self.reply = reply or name
+
+    def __call__(self, ctx, data):
+        # Only declared parameters are passed, converted to their declared type
+        kwargs = {name: kind(data[name]) for name, kind in self.params.items() if data.get(name) is not None}
+        return self.handler(ctx, **kwargs)
+
+
+def boolean(value):
+    # Parameter type for flags: JSON booleans, 0/1 and their string forms, anything else is invalid
+    if isinstance(value, str):
+        value = value.strip().lower()
+        if value in ("true", "1", "yes", "on"):
+            return True
+        if value in ("false", "0", "no", "off"):
+            return False
+    elif value in (True, False):
+        return bool(value)
+    raise ValueError(f"Expected a boolean, got {value!r}")
+
+
+def command(name, reply=None, **params):
+    """
+    Registers a handler for messages of type `name`. `params` are the accepted message
+    fields and their types, e.g. @command("EXPOSURE", cam=int, delta=int) is called as
+    handler(ctx, cam=1, delta=500) for {"type": "EXPOSURE", "cam": 1, "delta": 500}.
+    The handler's return value is sent back as the payload of a `reply` message.
+    """
+    def register(handler):
+        COMMANDS[name] = Command(name, handler, params, reply)
+        return handler
+    return register
+
+
+def parse(message):
+    # Messages are JSON, optionally URL quoted. Returns the decoded object.
+    if '%' in message:
+        message = urllib.parse.unquote(message)
+    return json.loads(message)
+
+
+def normalize(data):
+    # {"type": ...} with the type upper cased, old style button messages expanded
+    if not isinstance(data, dict) or not isinstance(data.get('type'), str):
+        raise TypeError("A command is an object with a string 'type'")
+    msg_type = data['type'].upper()
+    legacy = LEGACY.match(msg_type)
+    if legacy is not None:
+        (name, direction, cam) = legacy.groups()
+        data = {**data, "type": name, "cam": int(cam)}
+        if direction is not None:
+            data["delta"] = LEGACY_STEPS[name] if direction == "MORE" else -LEGACY_STEPS[name]
+        return data
+    key = KEYS.match(msg_type)
+    if key is not None:
+        (name, field, step) = KEY_STEPS[key.group(1)]
+        data = {**data, "type": name}
+        if field is not None:
+            data[field] = step
+        if key.group(2) is not None:
+            data["cam"] = int(key.group(2))
+        return data
+    if msg_type != data['type']:
+        data = {**data, "type": msg_type}
+    return data
+
+
+def execute(ctx, data, message):
+    # Runs one command, returns its reply (None when the handler replied itself)
+    try:
+        data = normalize(data)
+        cmd = COMMANDS.get(data['type'])
+        if cmd is None:
+            return {
+                "type": "BAD_REQUEST",
+                "payload": {
+                    "message": "Unknown action type " + data['type'],
+                    "received": message,
+                }
+            }
+        payload = cmd(ctx, data)
+    except (TypeError, ValueError) as e:
+        return {
+            "type": "BAD_REQUEST",
+            "payload": {
+                "message": "Data passed to API is invalid",
+                "received": message,
+                "error": str(e),
+            }
+        }
+    except Exception as e:
+        traceback.print_exc()
+        return {
+            "type": "SERVER_ERROR",
+            "payload": {
+                "message": "Something's wrong on the server side",
+                "error": str(e),
+            }
+        }
+
+    if payload is NO_REPLY:
+        return None
+    if payload is None:
+        return {"type": cmd.reply}
+    return {"type": cmd.reply, "payload": payload}
+
+
+def dispatch(ctx, message):
+    """
+    Handles one data channel message: a command object or a list of them. A list is
+    answered with a list of replies in one message.
+    """
+    if isinstance(message, bytes):
+        # Binary messages are taken as UTF-8 JSON too, undecodable bytes fail to parse
+        message = message.decode('utf-8', 'replace')
+    try:
+        data = parse(message)
+    except JSONDecodeError as e:
+        ctx.channel.send(json.dumps({
+            "type": "BAD_REQUEST",
+            "payload": {
+                "message": "Data passed to API is invalid",
+                "received": message,
+                "error": str(e),
+            }
+        }))
+        return
+
+    if isinstance(data, list):
+        replies = [reply for reply in (execute(ctx, item, message) for item in data) if reply is not None]
+        if replies:
+            ctx.channel.send(json.dumps(replies))
+        return
+
+    reply = execute(ctx, data, message)
+    if reply is not None:
+        ctx.channel.send(json.dumps(reply))
+
+
 def setup_datachannel(pc, pc_id, app):
     @pc.on("datachannel")
     def on_datachannel(channel):
         app.pcs_datachannels[pc_id] = channel
+        ctx = Context(app, pc_id, channel)
 
         @channel.on("message")
         def on_message(message):
-            try:
-                unquoted = urllib.parse.unquote(message)
-                data = json.loads(unquoted)
-                if data['type'].upper() == 'PING':
-                    channel.send(json.dumps({
-                        'type': 'PONG'
-                    }))
-                elif data['type'].upper() == 'STREAM_CLOSED':
-                    channel.send(json.dumps({
-                        "type": "CLOSED_SUCCESSFUL",
-                        "payload": "Channel is closing..."
-                    }))
-                    channel.close()
-                elif data['type'].upper() == 'STITCH':
-                    app.video_transform.is_stitch = True
-                    channel.send(json.dumps({
-                        "type": "STITCH",
-                        "payload": "Stitched images!"
-                    }))
-                elif data['type'].upper() == 'TOGGLE':
-                    toggle = app.video_transform.is_toggle
-                    app.video_transform.is_toggle = not toggle
-                    channel.send(json.dumps({
-                        "type": "TOGGLE",
-                        "payload": "Toggle images!"
-                    }))
-                elif data['type'].upper() == 'RECORD_START':
-                    app.video_transform.is_recording = True
-                    channel.send(json.dumps({
-                        "type": "RECORD_START",
-                        "payload": "Start recording video!"
-                    }))
-                elif data['type'].upper() == 'RECORD_STOP':
-                    app.video_transform.is_recording = False
-                    channel.send(json.dumps({
-                        "type": "RECORD_STOP",
-                        "payload": "Stop recording video!"
-                    }))
-                elif data['type'].upper() == 'SHUTDOWN':
-                    if "raspbery" in os.uname: 
-                        request.app.shutdown()
-                        os.system("shutdown now -h")
-
-                    channel.send(json.dumps({
-                        "type": "SHUTDOWN",
-                        "payload": "Shutdown Raspi!"
-                    }))
-                elif data['type'].upper() == 'AWB_MODE':
-                    awb_mode = cycle([item for name, item in vars(dai.CameraControl.AutoWhiteBalanceMode).items() if name.isupper()])
-                    awb = next(awb_mode)
-
-                    ctrl = dai.CameraControl()
-                    ctrl.setAutoWhiteBalanceMode(awb)
-                    
-                    channel.send(json.dumps({
-                        "type": "AWB_MODE",
-                        "payload": "AWB Mode changed to: " + awb
-                    }))
-                elif 'WHITE_BALANCE' in data['type'].upper():
-                    if 'MORE' in data['type'].upper():
-                        mod = WB_STEP
-                    elif 'LESS' in data['type'].upper():
-                        mod = -WB_STEP
-
-                    wht_balance = app.video_transform.wbManual + mod 
-                    app.video_transform.wbManual = wht_balance
-                    
-                    ctrl = dai.CameraControl()
-                    ctrl.setManualWhiteBalance(wht_balance)
-
-                    print(f"Increase white balance: {wht_balance}")
-
-                    if 'CAM1' in data['type'].upper():
-                        app.video_transform.qControl1.send(ctrl)
-                    elif 'CAM2' in data['type'].upper():
-                        app.video_transform.qControl2.send(ctrl)
-
-                    channel.send(json.dumps({
-                        "type": "WHITE_BALANCE",
-                        "payload": "White balance set to: " + wht_balance
-                    }))
-                elif 'EXPOSURE' in data['type'].upper():
-                    if 'MORE'  in data['type'].upper():
-                        mod = EXP_STEP
-                    elif 'LESS'  in data['type'].upper():
-                        mod = -EXP_STEP
-                    # expTime = clamp(expTime, 1, 33000)
-                    # sensIso = clamp(sensIso, 100, 1600)
-
-                    expTime = app.video_transform.expTime + mod 
-                    sensIso = app.video_transform.sensIso
-
-                    print("Setting manual exposure, time: ", expTime, "iso: ", sensIso)
-
-                    ctrl = dai.CameraControl()
-                    ctrl.setManualExposure(expTime, sensIso)
-
-                    if 'CAM1' in data['type'].upper():
-                        app.video_transform.qControl1.send(ctrl)
-                    elif 'CAM2' in data['type'].upper():
-                        app.video_transform.qControl2.send(ctrl)
-
-                    channel.send(json.dumps({
-                        "type": "EXPOSURE",
-                        "payload": "Set exposure to: " + expTime
-                    }))
-                else:
-                    channel.send(json.dumps({
-                        "type": "BAD_REQUEST",
-                        "payload": {
-                            "message": "Unknown action type " + data['type'],
-                            "received": message,
-                        }
-                    }))
-            except (JSONDecodeError, TypeError) as e:
-                channel.send(json.dumps({
-                    "type": "BAD_REQUEST",
-                    "payload": {
-                        "message": "Data passed to API is invalid",
-                        "received": message,
-                        "error": str(e),
-                    }
-                }))
-            except Exception as e:
-                traceback.print_exc()
-                channel.send(json.dumps({
-                    "type": "SERVER_ERROR",
-                    "payload": {
-                        "message": "Something's wrong on the server side",
-                        "error": str(e),
-                    }
-                }))
+            app.sessions.touch(pc_id)
+            dispatch(ctx, message)
+
+
+@command("PING", reply="PONG")
+def ping(ctx):
+    return None
+
+
+@command("STREAM_CLOSED")
+def stream_closed(ctx):
+    ctx.channel.send(json.dumps({
+        "type": "CLOSED_SUCCESSFUL",
+        "payload": "Channel is closing..."
+    }))
+    ctx.channel.close()
+    return NO_REPLY
+
+
+@command("STITCH")
+def stitch(ctx):
+    ctx.engine.is_stitch = True
+    return "Stitching images..."
+
+
+@command("STITCH_STATUS")
+def stitch_status(ctx):
+    return ctx.engine.stitch_status()
+
+
+@command("TOGGLE")
+def toggle(ctx):
+    ctx.engine.is_toggle = not ctx.engine.is_toggle
+    return "Toggle images!"
+
+
+@command("RECORD_START")
+def record_start(ctx):
+    ctx.engine.is_recording = True
+    return "Start recording video!"
+
+
+@command("RECORD_STOP")
+def record_stop(ctx):
+    ctx.engine.is_recording = False
+    return "Stop recording video!"
+
+
+@command("RECORD_TRIGGER", trigger=str)
+def record_trigger(ctx, trigger=None):
+    # 'manual' or 'motion', without `trigger` only reports the current one
+    if trigger is not None:
+        return ctx.engine.set_trigger(trigger.lower())
+    return ctx.engine.motion_stats()
+
+
+@command("RECORD_STATS")
+def record_stats(ctx):
+    return ctx.engine.recording_stats()
+
+
+@command("LATENCY")
+def latency(ctx):
+    track = ctx.app.video_transforms.get(ctx.pc_id)
+    payload = ctx.engine.latency_stats()
+    payload["viewer"] = track.latency if track else None
+    return payload
+
+
+@command("CAMERAS")
+def cameras(ctx):
+    return ctx.engine.cameras_status()
+
+
+@command("SYNC_STATS")
+def sync_stats(ctx):
+    return ctx.engine.sync_stats()
+
+
+@command("DETECTIONS", subscribe=boolean)
+def detections(ctx, subscribe=None):
+    # Batches of detections follow as binary messages while subscribed
+    if subscribe is not None:
+        subscribers = ctx.engine.detections.subscribers
+        if subscribe:
+            subscribers.add(ctx.pc_id)
+        else:
+            subscribers.discard(ctx.pc_id)
+    return ctx.engine.detection_stats()
+
+
+@command("SESSIONS")
+def sessions(ctx):
+    return ctx.app.sessions.stats()
+
+
+@command("STATS")
+def stats(ctx):
+    return ctx.engine.stats_payload()
+
+
+@command("ABR")
+def abr(ctx):
+    track = ctx.app.video_transforms.get(ctx.pc_id)
+    return track.controller.targets if track and track.controller else None
+
+
+@command("SHUTDOWN")
+def shutdown(ctx):
+    if "raspberry" in os.uname().nodename:
+        os.system("shutdown now -h")
+    return "Shutdown Raspi!"
+
+
+# Camera controls are merged by the engine into one CameraControl per camera and frame.
+# Without `cam` they apply to both cameras, `value` sets an absolute value, `delta` steps it.
+
+@command("EXPOSURE", cam=int, value=int, delta=int)
+def exposure(ctx, cam=None, value=None, delta=0):
+    return {"cam": cam, "exposure": ctx.engine.controls.exposure(cam, value, delta)}
+
+
+@command("ISO", cam=int, value=int, delta=int)
+def iso(ctx, cam=None, value=None, delta=0):
+    return {"cam": cam, "iso": ctx.engine.controls.iso(cam, value, delta)}
+
+
+@command("WHITE_BALANCE", cam=int, value=int, delta=int)
+def white_balance(ctx, cam=None, value=None, delta=0):
+    return {"cam": cam, "white_balance": ctx.engine.controls.white_balance(cam, value, delta)}
+
+
+@command("AWB_MODE", cam=int)
+def awb_mode(ctx, cam=None):
+    return {"cam": cam, "awb_mode": [str(mode) for mode in ctx.engine.controls.next_awb_mode(cam)]}
+
+
+@command("CONTROLS")
+def controls(ctx):
+    return ctx.engine.controls.stats()
+
+
+# Preview regions are cropped on the device. Without `cam` they apply to all cameras,
+# `dx`/`dy` pan by preview pixels, `value` sets the zoom and `delta` steps it.
+
+@command("PAN", cam=int, dx=int, dy=int)
+def pan(ctx, cam=None, dx=0, dy=0):
+    return {"cam": cam, "regions": ctx.engine.regions.pan(cam, dx, dy)}
+
+
+@command("ZOOM", cam=int, value=float, delta=float)
+def zoom(ctx, cam=None, value=None, delta=0.0):
+    return {"cam": cam, "regions": ctx.engine.regions.zoom(cam, value, delta)}
+
+
+@command("ROI_RESET", cam=int)
+def roi_reset(ctx, cam=None):
+    return {"cam": cam, "regions": ctx.engine.regions.reset(cam)}
+
+
+@command("ROI")
+def roi(ctx):
+    return ctx.engine.regions.stats()
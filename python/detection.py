@@ -0,0 +1,245 @@
+import os
+import struct
+import threading
+import time
+import traceback
+import numpy as np
+import depthai as dai
+import blobconverter
+
+from collections import OrderedDict, deque
+
+# Model of the optional detection stage, a blobconverter zoo name. Unset, there is none.
+DEFAULT_CONFIDENCE = 0.5
+DEFAULT_SHAVES = 6
+# Input size of the MobileNet-SSD family
+NN_WIDTH = 300
+NN_HEIGHT = 300
+
+# Detections are sent to the subscribed viewers in one binary message per interval (s)
+BATCH_INTERVAL = 0.1
+# Detections of a preview frame wait this long for the frame to be composed (s), a
+# frame the engine skipped goes out without a video frame
+COMPOSE_WAIT = 0.25
+# Video frames remembered per camera, by preview sequence number
+COMPOSED_HISTORY = 64
+
+# Binary batch: magic b'D', format version, frame count, then per frame its camera
+# (0-based in cameras.json order), preview sequence number, pts of the video frame it
+# was composed into (VIDEO_TIME_BASE, -1 for none) and detection count, followed by
+# the detections. Boxes are normalized to the preview region, in 1/65535ths.
+MAGIC = b'D'
+VERSION = 1
+BATCH = struct.Struct('<cBH')
+FRAME = struct.Struct('<BIqH')
+DETECTION = np.dtype([('label', '<u2'), ('confidence', 'u1'), ('box', '<u2', 4)])
+
+
+class DetectionSettings:
+    """
+    Optional on-device detection stage: a MobileNetDetectionNetwork fed the preview
+    region of every camera. Read from the DETECTION_* environment variables at start,
+    disabled unless DETECTION_MODEL names a model.
+    """
+    def __init__(self, model=None, confidence=DEFAULT_CONFIDENCE, shaves=DEFAULT_SHAVES):
+        confidence = float(confidence)
+        if not 0.0 <= confidence <= 1.0:
+            raise ValueError(f"Detection confidence {confidence} is not between 0 and 1")
+        self.model = model or None
+        self.confidence = confidence
+        self.shaves = int(shaves)
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            model=environ.get('DETECTION_MODEL'),
+            confidence=environ.get('DETECTION_CONFIDENCE', DEFAULT_CONFIDENCE),
+            shaves=environ.get('DETECTION_SHAVES', DEFAULT_SHAVES),
+        )
+
+    @property
+    def enabled(self):
+        return self.model is not None
+
+    def build(self, pipeline, preview):
+        """
+        Creates the network fed by the `preview` ImageManip and its 'detections'
+        XLinkOut. The detections keep the sequence numbers of the preview frames.
+        """
+        # PREVIEW (NV12) --> IMAGE MANIPULATOR (BGR planar, NN input size) --> NN --> XLINKOUT (HOST)
+        nnManip = pipeline.create(dai.node.ImageManip)
+        nnManip.initialConfig.setResize(NN_WIDTH, NN_HEIGHT)
+        nnManip.initialConfig.setKeepAspectRatio(False)
+        nnManip.initialConfig.setFrameType(dai.RawImgFrame.Type.BGR888p)
+        # The network runs at whatever rate it manages, it never holds up the preview
+        nnManip.inputImage.setBlocking(False)
+        nnManip.inputImage.setQueueSize(1)
+
+        nn = pipeline.create(dai.node.MobileNetDetectionNetwork)
+        nn.setBlobPath(blobconverter.from_zoo(name=self.model, shaves=self.shaves))
+        nn.setConfidenceThreshold(self.confidence)
+        nn.input.setBlocking(False)
+        nn.input.setQueueSize(1)
+
+        outDetections = pipeline.create(dai.node.XLinkOut)
+        outDetections.setStreamName('detections')
+
+        preview.out.link(nnManip.inputImage)
+        nnManip.out.link(nn.input)
+        nn.out.link(outDetections.input)
+        return nn
+
+    def as_dict(self):
+        return {"model": self.model, "confidence": self.confidence, "shaves": self.shaves}
+
+
+def clip(value):
+    return min(max(value, 0.0), 1.0)
+
+
+def packDetections(detections):
+    # dai.ImgDetection list -> DETECTION records
+    packed = np.empty(len(detections), DETECTION)
+    for i, d in enumerate(detections):
+        packed[i] = (d.label, round(clip(d.confidence) * 255),
+                     tuple(round(clip(v) * 65535) for v in (d.xmin, d.ymin, d.xmax, d.ymax)))
+    return packed.tobytes()
+
+
+def unpackBatch(data):
+    """
+    [(camera, seq, pts, [(label, confidence, xmin, ymin, xmax, ymax)])] of a batch,
+    the inverse of DetectionBatcher.pack.
+    """
+    (magic, version, count) = BATCH.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a detection batch: {magic!r} version {version}")
+    offset = BATCH.size
+    frames = []
+    for _ in range(count):
+        (camera, seq, pts, n) = FRAME.unpack_from(data, offset)
+        offset += FRAME.size
+        records = np.frombuffer(data, DETECTION, n, offset)
+        offset += n * DETECTION.itemsize
+        detections = [(int(r['label']), int(r['confidence']) / 255, *(float(v) / 65535 for v in r['box']))
+                      for r in records]
+        frames.append((camera, seq, None if pts < 0 else pts, detections))
+    return frames
+
+
+class DetectionBatcher:
+    """
+    Collects the detections of all cameras and sends them in batches: one binary
+    message (see BATCH) per BATCH_INTERVAL instead of a JSON message per frame.
+
+    Detections are matched to the video frame their preview frame was composed into by
+    the preview sequence number. They usually reach the host after that frame, so the
+    engine records which pts every preview frame ended up in (composed) and pack() only
+    holds back detections whose frame isn't composed yet, at most COMPOSE_WAIT.
+    """
+    def __init__(self, cameras, wait=COMPOSE_WAIT, history=COMPOSED_HISTORY):
+        self.wait = wait
+        self.lock = threading.Lock()
+        # Per camera: preview sequence number -> pts
+        self.frames = [OrderedDict() for _ in range(cameras)]
+        self.history = history
+        # (camera, seq, arrival, packed detections)
+        self.pending = deque()
+        # pc_ids of the viewers receiving the batches
+        self.subscribers = set()
+
+        # Counters
+        self.received = 0
+        self.detections = 0
+        self.unmatched = 0
+        self.batches = 0
+        self.bytes = 0
+        # Bytes sent, a batch counts once per viewer it went to
+        self.sent = 0
+
+    def composed(self, camera, seq, pts):
+        with self.lock:
+            frames = self.frames[camera]
+            frames[seq] = pts
+            while len(frames) > self.history:
+                frames.popitem(last=False)
+
+    def add(self, camera, seq, detections, now=None):
+        packed = packDetections(detections)
+        with self.lock:
+            self.pending.append((camera, seq, time.monotonic() if now is None else now, packed))
+            self.received += 1
+            self.detections += len(detections)
+
+    def pack(self, now=None):
+        """
+        The batch of every frame ready to go, None when there is none. Frames go out in
+        the order their detections arrived.
+        """
+        now = time.monotonic() if now is None else now
+        parts = []
+        with self.lock:
+            waiting = deque()
+            while self.pending:
+                (camera, seq, arrival, packed) = entry = self.pending.popleft()
+                pts = self.frames[camera].get(seq)
+                if pts is None:
+                    if now - arrival < self.wait:
+                        waiting.append(entry)
+                        continue
+                    pts = -1
+                    self.unmatched += 1
+                parts.append(FRAME.pack(camera, seq, pts, len(packed) // DETECTION.itemsize) + packed)
+            self.pending = waiting
+        if not parts:
+            return None
+        data = BATCH.pack(MAGIC, VERSION, len(parts)) + b''.join(parts)
+        self.batches += 1
+        self.bytes += len(data)
+        return data
+
+    def clear(self):
+        # Drops what is pending, nobody would receive it
+        with self.lock:
+            self.pending.clear()
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "received": self.received,
+            "detections": self.detections,
+            "unmatched": self.unmatched,
+            "batches": self.batches,
+            "bytes": self.bytes,
+            "sent_bytes": self.sent,
+            "pending": len(self.pending),
+        }
+
+
+class DetectionReader(threading.Thread):
+    """
+    Drains a camera's 'detections' queue on a thread of its own, handing every result to
+    `add(seq, detections)`. Unlike the preview, every result is kept: each one belongs
+    to a different frame.
+    """
+    def __init__(self, queue, add, name):
+        super().__init__(name=name, daemon=True)
+        self.queue = queue
+        self.add = add
+        self.running = True
+
+    def run(self):
+        while self.running:
+            try:
+                message = self.queue.get()
+            except RuntimeError:
+                # Queue was closed together with its device
+                break
+            try:
+                self.add(message.getSequenceNum(), message.detections)
+            except Exception:
+                traceback.print_exc()
+
+    def stop(self, timeout=1.0):
+        self.running = False
+        self.join(timeout)
@@ -0,0 +1,118 @@
+import os
+import depthai as dai
+
+# profile -> (depthai VideoEncoder profile, codec of the recorded stream)
+PROFILES = {
+    'h265': ('H265_MAIN', 'hevc'),
+    'h264': ('H264_MAIN', 'h264'),
+    'mjpeg': ('MJPEG', 'mjpeg'),
+}
+# resolution -> recorded size. 4k is ColorCamera.video, 12mp the full sensor through
+# ImageManip (width multiple of 32, height of 8 for the H.26x encoders)
+RESOLUTIONS = {
+    '4k': (3840, 2160),
+    '12mp': (4032, 3040),
+}
+# The H.26x encoder handles up to 4K at 30 FPS
+H26X_MAX_PIXEL_RATE = 3840 * 2160 * 30
+
+DEFAULT_PROFILE = 'h265'
+DEFAULT_BITRATE = 20000  # kbps, H.26x only
+DEFAULT_KEYFRAME = 28  # frames, also bounds how far a segment cut can land after its boundary
+DEFAULT_QUALITY = 60  # MJPEG only, higher quality would produce huge files
+DEFAULT_RESOLUTION = '4k'
+
+
+class EncoderSettings:
+    """
+    On-device encoder setup of the recorded stream: profile, bitrate, keyframe interval,
+    MJPEG quality and resolution. Read from the RECORD_* environment variables at start,
+    so they change without touching the code.
+    """
+    def __init__(self, profile=DEFAULT_PROFILE, bitrate=DEFAULT_BITRATE, keyframe=DEFAULT_KEYFRAME,
+                 quality=DEFAULT_QUALITY, resolution=DEFAULT_RESOLUTION):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown encoder profile {profile}, expected one of {', '.join(PROFILES)}")
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution}, expected one of {', '.join(RESOLUTIONS)}")
+        self.profile = profile
+        self.bitrate = int(bitrate)
+        self.keyframe = int(keyframe)
+        self.quality = int(quality)
+        self.resolution = resolution
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            profile=environ.get('RECORD_PROFILE', DEFAULT_PROFILE).lower(),
+            bitrate=environ.get('RECORD_BITRATE', DEFAULT_BITRATE),
+            keyframe=environ.get('RECORD_KEYFRAME', DEFAULT_KEYFRAME),
+            quality=environ.get('RECORD_QUALITY', DEFAULT_QUALITY),
+            resolution=environ.get('RECORD_RESOLUTION', DEFAULT_RESOLUTION).lower(),
+        )
+
+    @property
+    def codec(self):
+        return PROFILES[self.profile][1]
+
+    @property
+    def size(self):
+        return RESOLUTIONS[self.resolution]
+
+    @property
+    def pix_fmt(self):
+        # Full range YUV is what the MJPEG encoder emits
+        return "yuvj420p" if self.profile == 'mjpeg' else "yuv420p"
+
+    def fallback(self):
+        # MJPEG with the same resolution/quality, encodes whatever the H.26x encoder can't
+        return EncoderSettings('mjpeg', self.bitrate, self.keyframe, self.quality, self.resolution)
+
+    def resolve(self, fps):
+        # Settings the encoder can sustain at `fps`
+        (w, h) = self.size
+        if self.profile != 'mjpeg' and w * h * fps > H26X_MAX_PIXEL_RATE:
+            print(f"{self.profile} can't encode {w}x{h} at {fps} FPS, falling back to MJPEG")
+            return self.fallback()
+        return self
+
+    def build(self, pipeline, cam, fps):
+        """
+        Creates the encoder (and the ImageManip of the 12mp path) fed by `cam`,
+        returns the VideoEncoder node.
+        """
+        videoEnc = pipeline.create(dai.node.VideoEncoder)
+        videoEnc.setDefaultProfilePreset(fps, getattr(dai.VideoEncoderProperties.Profile, PROFILES[self.profile][0]))
+        if self.profile == 'mjpeg':
+            videoEnc.setQuality(self.quality)
+        else:
+            videoEnc.setBitrateKbps(self.bitrate)
+            videoEnc.setKeyframeFrequency(self.keyframe)
+            # No reordering, pts == dts in the recording
+            videoEnc.setNumBFrames(0)
+
+        if self.resolution == '4k':
+            # CAM VIDEO (NV12) --> VIDEO ENCODER
+            cam.video.link(videoEnc.input)
+        else:
+            # ColorCamera.video can output up to 4K, the full sensor goes through
+            # CAM ISP (YUV420) --> IMAGE MANIPULATOR (NV12) --> VIDEO ENCODER
+            (w, h) = self.size
+            imageManip = pipeline.create(dai.node.ImageManip)
+            imageManip.initialConfig.setFrameType(dai.RawImgFrame.Type.NV12)
+            imageManip.initialConfig.setResize(w, h)
+            imageManip.setMaxOutputFrameSize(w * h * 3 // 2)
+            cam.isp.link(imageManip.inputImage)
+            imageManip.out.link(videoEnc.input)
+        return videoEnc
+
+    def as_dict(self):
+        return {
+            "profile": self.profile,
+            "codec": self.codec,
+            "bitrate": self.bitrate,
+            "keyframe": self.keyframe,
+            "quality": self.quality,
+            "resolution": self.resolution,
+            "size": self.size,
+        }
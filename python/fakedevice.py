@@ -0,0 +1,230 @@
+import threading
+import time
+import numpy as np
+import cv2
+
+from datetime import timedelta
+
+# Stand-ins for the depthai objects used by the host code, so the capture path can
+# be exercised without an OAK device attached.
+
+def toNV12(img):
+    # BGR -> NV12 byte layout, what an ImageManip with frame type NV12 emits
+    (h, w) = img.shape[:2]
+    i420 = cv2.cvtColor(img, cv2.COLOR_BGR2YUV_I420).reshape(-1)
+    nv12 = np.empty(h * w * 3 // 2, np.uint8)
+    nv12[:h * w] = i420[:h * w]
+    nv12[h * w::2] = i420[h * w:h * w * 5 // 4]
+    nv12[h * w + 1::2] = i420[h * w * 5 // 4:]
+    return nv12
+
+
+class FakeImgFrame:
+    def __init__(self, img, seq, ts, data=None, ts_device=None):
+        self.img = img
+        self.seq = seq
+        self.ts = ts
+        self.ts_device = ts if ts_device is None else ts_device
+        self.data = img.reshape(-1) if data is None else data
+
+    def getCvFrame(self):
+        return self.img
+
+    def getData(self):
+        return self.data
+
+    def getWidth(self):
+        return self.img.shape[1]
+
+    def getHeight(self):
+        return self.img.shape[0]
+
+    def getSequenceNum(self):
+        return self.seq
+
+    def getTimestamp(self):
+        return self.ts
+
+    def getTimestampDevice(self):
+        return self.ts_device
+
+
+class PacedQueue:
+    """
+    Mimics dai.DataOutputQueue: get() blocks until the next message is due, tryGet()/has()
+    never block. Subclasses produce the messages in _make(), which returns the message
+    due at `next_due` (time.monotonic()) or None for one lost before reaching the host,
+    and moves `next_due` on to the next one. `jitter` delays delivery by up to that many
+    seconds.
+    """
+    def __init__(self, jitter=0.0, seed=0, start=None):
+        self.jitter = jitter
+        self.rng = np.random.default_rng(seed)
+        self.start = time.monotonic() if start is None else start
+        self.next_due = self.start
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def _make(self):
+        raise NotImplementedError
+
+    def _due(self):
+        return time.monotonic() >= self.next_due
+
+    def get(self):
+        while True:
+            if self.closed:
+                raise RuntimeError("Queue closed")
+            delay = self.next_due - time.monotonic()
+            if self.jitter:
+                delay += self.rng.uniform(0, self.jitter)
+            if delay > 0:
+                time.sleep(delay)
+            if self.closed:
+                raise RuntimeError("Queue closed")
+            frame = self._make()
+            if frame is not None:
+                return frame
+
+    def tryGet(self):
+        while not self.closed and self._due():
+            frame = self._make()
+            if frame is not None:
+                return frame
+        return None
+
+    def tryGetAll(self):
+        frames = []
+        while True:
+            frame = self.tryGet()
+            if frame is None:
+                return frames
+            frames.append(frame)
+
+    def has(self):
+        return not self.closed and self._due()
+
+    def close(self):
+        self.closed = True
+
+
+class FakeQueue(PacedQueue):
+    """
+    Frames due at `fps`, a moving gradient so consecutive frames differ. With `nv12`
+    getData() returns NV12 like the preview ImageManip.
+
+    `drop` is the share of frames lost before reaching the host (their sequence numbers
+    are skipped) and the device clock runs `offset` seconds ahead of the host clock.
+    """
+    def __init__(self, width=600, height=400, fps=28, jitter=0.0, seed=0, nv12=False, drop=0.0, offset=0.0):
+        super().__init__(jitter, seed)
+        self.width = width
+        self.height = height
+        self.period = 1.0 / fps
+        self.drop = drop
+        self.offset = timedelta(seconds=offset)
+        self.nv12 = nv12
+        self.seq = 0
+
+        base = np.linspace(0, 255, width, dtype=np.uint8)
+        self.base = np.dstack([np.tile(base, (height, 1))] * 3)
+
+    def _make(self):
+        # Next frame, None if it was dropped before reaching the host
+        with self.lock:
+            seq = self.seq
+            captured = self.next_due
+            self.seq += 1
+            self.next_due += self.period
+            if self.drop and self.rng.random() < self.drop:
+                return None
+        img = np.roll(self.base, seq * 4, axis=1)
+        data = toNV12(img) if self.nv12 else None
+        # Captured when it was due, on the host monotonic clock (the steady clock
+        # dai.Clock.now() reads) and on the device's own clock
+        ts = timedelta(seconds=captured)
+        return FakeImgFrame(img, seq, ts, data, ts + self.offset)
+
+
+class FakeInputQueue:
+    # Mimics dai.DataInputQueue, keeps count of what was sent
+    def __init__(self):
+        self.sent = 0
+        self.last = None
+
+    def send(self, message):
+        self.sent += 1
+        self.last = message
+
+
+class FakeDetection:
+    # Mimics dai.ImgDetection, box normalized to the frame
+    def __init__(self, label, confidence, xmin, ymin, xmax, ymax):
+        self.label = label
+        self.confidence = confidence
+        self.xmin = xmin
+        self.ymin = ymin
+        self.xmax = xmax
+        self.ymax = ymax
+
+
+class FakeImgDetections:
+    # Mimics dai.ImgDetections, sequence number and timestamps of the frame it was run on
+    def __init__(self, detections, seq, ts, ts_device=None):
+        self.detections = detections
+        self.seq = seq
+        self.ts = ts
+        self.ts_device = ts if ts_device is None else ts_device
+
+    def getSequenceNum(self):
+        return self.seq
+
+    def getTimestamp(self):
+        return self.ts
+
+    def getTimestampDevice(self):
+        return self.ts_device
+
+
+def cannedDetections(seq, count=3):
+    # `count` boxes sliding across the frame, one step per frame, same for the same seq
+    detections = []
+    for i in range(count):
+        x = ((seq * 0.01 + i / count) % 1.0) * 0.8
+        y = 0.1 + 0.25 * i
+        detections.append(FakeDetection(label=15 if i % 2 == 0 else 7, confidence=max(0.9 - 0.1 * i, 0.5),
+                                        xmin=x, ymin=y, xmax=x + 0.2, ymax=y + 0.2))
+    return detections
+
+
+class FakeDetectionQueue(PacedQueue):
+    """
+    The 'detections' queue of a camera running a network: canned detections (see
+    cannedDetections) for the frames of `frames`, any queue of preview frames, `latency`
+    seconds after each frame. Without `frames`, for frames due at `fps`.
+    """
+    def __init__(self, frames=None, fps=28, latency=0.0, count=3):
+        super().__init__(start=frames.start if frames is not None else None)
+        self.frames = frames
+        self.period = 1.0 / fps
+        self.latency = latency
+        self.count = count
+        self.seq = 0
+        self.next_due = (frames.next_due if frames is not None else self.start) + latency
+
+    def _make(self):
+        if self.frames is None:
+            with self.lock:
+                seq = self.seq
+                ts = timedelta(seconds=self.next_due - self.latency)
+                self.seq += 1
+                self.next_due += self.period
+            return FakeImgDetections(cannedDetections(seq, self.count), seq, ts)
+
+        frame = self.frames._make()
+        with self.lock:
+            self.next_due = self.frames.next_due + self.latency
+        if frame is None:
+            return None
+        return FakeImgDetections(cannedDetections(frame.getSequenceNum(), self.count), frame.getSequenceNum(),
+                                 frame.getTimestamp(), frame.getTimestampDevice())
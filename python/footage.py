@@ -0,0 +1,141 @@
+import asyncio
+import bisect
+import os
+import traceback
+import av
+import cv2
+
+from pathlib import Path
+from aiohttp import web
+from python.segments import INDEX_NAME, RECORDING_DIR, readIndex
+
+THUMBNAIL_DIR = Path(__file__).parent.parent / 'cache' / 'thumbnails'
+THUMBNAIL_WIDTH = 320
+THUMBNAIL_QUALITY = 80
+# Segment files go out in chunks this large where sendfile isn't available
+CHUNK_SIZE = 256 * 1024
+
+
+class Footage:
+    """
+    Recorded segments over HTTP, for review on the LAN without pulling the stick.
+
+    The listing comes from every camera's index.json (see SegmentWriter), which holds
+    each complete segment's start, duration and keyframe times and byte offsets, so
+    nothing is read from the videos to answer it. Segments are served as files with
+    Range support (sendfile where the OS has it), a player seeking within a 4K segment
+    fetches the bytes from a keyframe on. Thumbnails decode a single keyframe, scaled
+    down, and are kept on disk.
+    """
+    def __init__(self, directory=RECORDING_DIR, thumbnails=THUMBNAIL_DIR, width=THUMBNAIL_WIDTH):
+        self.directory = Path(directory)
+        self.thumbnails = Path(thumbnails)
+        self.width = width
+        # Thumbnails being made, requests for the same one wait for it
+        self.making = {}
+
+    def cameras(self):
+        if not self.directory.is_dir():
+            return []
+        return sorted(path.parent.name for path in self.directory.glob(f"*/{INDEX_NAME}"))
+
+    def segment(self, camera, filename):
+        # Index entry of a complete segment, None for anything else (never a path outside the index)
+        if camera not in self.cameras():
+            return None
+        return next((entry for entry in readIndex(self.directory / camera) if entry['file'] == filename), None)
+
+    def listing(self):
+        return {
+            camera: [
+                {
+                    "file": entry['file'],
+                    "started": entry['started'],
+                    "duration": entry.get('duration'),
+                    "frames": entry['frames'],
+                    "bytes": entry.get('bytes'),
+                    "keyframes": len(entry.get('keyframes', [])),
+                    "url": f"/recordings/{camera}/{entry['file']}",
+                }
+                for entry in readIndex(self.directory / camera)
+            ]
+            for camera in self.cameras()
+        }
+
+    async def list(self, request):
+        return web.json_response(self.listing())
+
+    def lookup(self, request):
+        (camera, filename) = (request.match_info['camera'], request.match_info['file'])
+        entry = self.segment(camera, filename)
+        if entry is None:
+            raise web.HTTPNotFound(text=f"No recording {camera}/{filename}")
+        return camera, entry
+
+    async def index(self, request):
+        # The segment's index entry with its keyframes, [seconds, byte offset]
+        (camera, entry) = self.lookup(request)
+        return web.json_response(entry)
+
+    async def video(self, request):
+        (camera, entry) = self.lookup(request)
+        # aiohttp answers Range/If-Range requests with 206 and sends the file without copying it
+        return web.FileResponse(self.directory / camera / entry['file'], chunk_size=CHUNK_SIZE,
+                                headers={"Content-Type": "video/mp4", "Cache-Control": "max-age=3600"})
+
+    def keyframe(self, entry, seconds):
+        # Index of the last keyframe at or before `seconds`
+        times = [t for t, _ in entry.get('keyframes', [])]
+        return max(bisect.bisect_right(times, seconds) - 1, 0)
+
+    def makeThumbnail(self, source, seconds, path):
+        with av.open(str(source)) as container:
+            stream = container.streams.video[0]
+            # Seeks to the keyframe through the moov index, only that sample is read
+            container.seek(int(seconds / stream.time_base), stream=stream, backward=True, any_frame=False)
+            frame = next(container.decode(stream))
+        height = round(frame.height * self.width / frame.width / 2) * 2
+        image = frame.reformat(width=self.width, height=height, format='bgr24').to_ndarray()
+        ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+        if not ok:
+            raise ValueError(f"Could not encode a thumbnail of {source}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        tmp.write_bytes(jpeg.tobytes())
+        os.replace(tmp, path)
+
+    async def thumbnail(self, request):
+        # ?t=<seconds into the segment>, snapped to the keyframe before it
+        (camera, entry) = self.lookup(request)
+        try:
+            seconds = float(request.query.get('t', 0))
+        except ValueError:
+            raise web.HTTPBadRequest(text="t is seconds into the segment")
+        number = self.keyframe(entry, seconds)
+        keyframes = entry.get('keyframes')
+        seconds = keyframes[number][0] if keyframes else 0.0
+        path = self.thumbnails / camera / f"{Path(entry['file']).stem}_{number:04d}.jpg"
+
+        if not path.exists():
+            making = self.making.get(path)
+            if making is None:
+                loop = asyncio.get_event_loop()
+                making = self.making[path] = loop.run_in_executor(
+                    None, self.makeThumbnail, self.directory / camera / entry['file'], seconds, path)
+            try:
+                await asyncio.shield(making)
+            except Exception as e:
+                traceback.print_exc()
+                raise web.HTTPInternalServerError(text=str(e))
+            finally:
+                self.making.pop(path, None)
+        return web.FileResponse(path, headers={"Content-Type": "image/jpeg", "Cache-Control": "max-age=86400"})
+
+    def routes(self, add):
+        # `add` registers a route, e.g. app.router.add_get
+        return [
+            add("/recordings", self.list),
+            add("/recordings/{camera}/{file}", self.video),
+            add("/recordings/{camera}/{file}/index", self.index),
+            add("/recordings/{camera}/{file}/thumbnail", self.thumbnail),
+        ]
@@ -0,0 +1,53 @@
+import numpy as np
+import av
+
+from fractions import Fraction
+
+VIDEO_TIME_BASE = Fraction(1, 90000)
+
+
+def planeView(plane, width, height):
+    # Writable numpy view of an AVFrame plane, rows may be padded to line_size
+    return np.frombuffer(plane, np.uint8).reshape(-1, plane.line_size)[:height, :width]
+
+
+def splitNV12(frame):
+    """
+    Planes of a depthai NV12 ImgFrame as views into its data: luma (h, w) and
+    interleaved chroma (h/2, w/2, 2). No copy, no color conversion.
+    """
+    width, height = frame.getWidth(), frame.getHeight()
+    data = frame.getData()
+    y = data[:width * height].reshape(height, width)
+    uv = data[width * height:width * height * 3 // 2].reshape(height // 2, width // 2, 2)
+    return y, uv
+
+
+class FramePool:
+    """
+    Preallocated yuv420p av.VideoFrames the composed output is written into directly,
+    handed to every viewer as is. The encoders take yuv420p, so nothing between the
+    device and the encoder converts colors. Frames are reused round robin; with
+    `count` frames in flight an encoder has count - 1 frame periods to finish.
+    """
+    def __init__(self, width, height, count=4):
+        self.width = width
+        self.height = height
+        self.frames = []
+        for _ in range(count):
+            frame = av.VideoFrame(width, height, 'yuv420p')
+            planes = (
+                planeView(frame.planes[0], width, height),
+                planeView(frame.planes[1], width // 2, height // 2),
+                planeView(frame.planes[2], width // 2, height // 2),
+            )
+            # black, also where a stitched canvas is never written
+            planes[0][:] = 0
+            planes[1][:] = 128
+            planes[2][:] = 128
+            self.frames.append((frame, planes))
+        self.index = 0
+
+    def next(self):
+        self.index = (self.index + 1) % len(self.frames)
+        return self.frames[self.index]
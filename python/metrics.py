@@ -0,0 +1,121 @@
+import bisect
+import threading
+import time
+
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets (s), from sub-millisecond stages to a stall
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class StageStats:
+    """
+    Per-stage frame counters: time spent (with a latency histogram), bytes copied and
+    color conversions. Cheap enough to stay on, a lock, a bisect and a few additions
+    per stage and frame.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        # Frame counts at the last rates() call
+        self.last_counts = {}
+        self.last_time = time.monotonic()
+
+    def record(self, name, seconds, copied=0, conversions=0):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = [0, 0.0, 0, 0, [0] * (len(BUCKETS) + 1)]
+            stage[0] += 1
+            stage[1] += seconds
+            stage[2] += copied
+            stage[3] += conversions
+            stage[4][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    @contextmanager
+    def time(self, name, copied=0, conversions=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, copied, conversions)
+
+    def summary(self):
+        with self.lock:
+            return {
+                name: {
+                    "frames": count,
+                    "ms": 1000 * seconds / count,
+                    "copied": copied / count,
+                    "conversions": conversions / count,
+                }
+                for name, (count, seconds, copied, conversions, _) in self.stages.items()
+            }
+
+    def histograms(self):
+        # name -> (count, seconds, copied, conversions, per bucket counts) snapshot
+        with self.lock:
+            return {name: (*stage[:4], list(stage[4])) for name, stage in self.stages.items()}
+
+    def rates(self):
+        # Frames per second of every stage since the previous call
+        now = time.monotonic()
+        with self.lock:
+            counts = {name: stage[0] for name, stage in self.stages.items()}
+        elapsed = now - self.last_time
+        rates = {
+            name: (count - self.last_counts.get(name, 0)) / elapsed if elapsed > 0 else 0.0
+            for name, count in counts.items()
+        }
+        self.last_counts, self.last_time = counts, now
+        return rates
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+        self.last_counts = {}
+
+
+def labelString(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class Exposition:
+    """
+    Prometheus text format (0.0.4) writer. Values are gathered when scraped, so
+    exposing them costs nothing between scrapes.
+    """
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, prefix="oak_"):
+        self.prefix = prefix
+        self.lines = []
+
+    def add(self, name, kind, help, samples):
+        # samples: [(labels dict, value)], None values are left out
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if value is not None:
+                self.lines.append(f"{name}{labelString(labels)} {float(value)!r}")
+
+    def histogram(self, name, help, series):
+        # series: [(labels dict, count, sum, per bucket counts as recorded by StageStats)]
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, count, total, buckets in series:
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float("inf"),), buckets):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                self.lines.append(f"{name}_bucket{labelString({**labels, 'le': le})} {cumulative}")
+            self.lines.append(f"{name}_sum{labelString(labels)} {total!r}")
+            self.lines.append(f"{name}_count{labelString(labels)} {count}")
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
@@ -0,0 +1,98 @@
+import time
+import numpy as np
+import cv2
+
+# Preview luma is shrunk by this factor before it is compared, 600x400 -> 150x100
+MOTION_SCALE = 4
+# A pixel differing from the background by more than this (0-255) has changed
+PIXEL_THRESHOLD = 25
+# Share of changed pixels that counts as motion
+MOTION_AREA = 0.01
+# Weight of a new frame in the running average background, adapts to slow light changes
+BACKGROUND_RATE = 0.05
+# Frames that only build the background after (re)starting
+WARMUP_FRAMES = 28
+# Recording goes on this long after the last motion (s)
+MOTION_HOLD = 10.0
+
+# 'manual' (RECORD_START/RECORD_STOP) or 'motion'
+TRIGGERS = ('manual', 'motion')
+DEFAULT_TRIGGER = 'manual'
+
+
+class MotionDetector:
+    """
+    Frame differencing against a running average background, per camera, on the luma
+    planes of the preview frames. Each plane is shrunk by `scale` with INTER_AREA (which
+    also averages out sensor noise) so a frame costs a few vectorized passes over
+    1/16th of the pixels. Motion in any camera counts, `active` stays set until `hold`
+    seconds after the last motion.
+    """
+    def __init__(self, scale=MOTION_SCALE, threshold=PIXEL_THRESHOLD, area=MOTION_AREA,
+                 rate=BACKGROUND_RATE, warmup=WARMUP_FRAMES, hold=MOTION_HOLD):
+        self.scale = scale
+        self.threshold = threshold
+        self.area = area
+        self.rate = rate
+        self.warmup = warmup
+        self.hold = hold
+
+        self.backgrounds = {}
+        self.frames = 0
+        self.active = False
+        self.last_motion = None
+
+        # Counters
+        self.calls = 0
+        self.events = 0
+        self.changed = 0.0
+        self.seconds = 0.0
+
+    def reset(self):
+        self.backgrounds = {}
+        self.frames = 0
+        self.active = False
+        self.last_motion = None
+
+    def changedShare(self, index, image):
+        (h, w) = image.shape[:2]
+        small = cv2.resize(image, (w // self.scale, h // self.scale), interpolation=cv2.INTER_AREA)
+        background = self.backgrounds.get(index)
+        if background is None or background.shape != small.shape:
+            self.backgrounds[index] = small.astype(np.float32)
+            return 0.0
+
+        diff = cv2.absdiff(small.astype(np.float32), background)
+        changed = cv2.countNonZero(cv2.compare(diff, self.threshold, cv2.CMP_GT)) / diff.size
+        cv2.accumulateWeighted(small, background, self.rate)
+        return changed
+
+    def update(self, images, now=None):
+        """
+        Takes the luma plane of every camera, returns whether motion is active.
+        """
+        start = time.perf_counter()
+        now = time.monotonic() if now is None else now
+
+        self.changed = max(self.changedShare(i, image) for i, image in enumerate(images))
+        self.frames += 1
+        if self.frames > self.warmup and self.changed > self.area:
+            if not self.active:
+                self.events += 1
+            self.last_motion = now
+            self.active = True
+        elif self.active and now - self.last_motion >= self.hold:
+            self.active = False
+
+        self.calls += 1
+        self.seconds += time.perf_counter() - start
+        return self.active
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "events": self.events,
+            "changed": round(self.changed, 4),
+            "ms": round(1000 * self.seconds / self.calls, 3) if self.calls else None,
+            "bytes": sum(background.nbytes for background in self.backgrounds.values()),
+        }
@@ -0,0 +1,186 @@
+import threading
+import time
+import traceback
+import depthai as dai
+
+from collections import deque
+from datetime import timedelta
+from python.bitstream import inspect
+
+# A packet that reaches the host later than this after capture is counted as late
+LATE_THRESHOLD = timedelta(milliseconds=500)
+# Encoded video kept from before a triggered recording starts, and the memory it may take
+PREROLL = timedelta(seconds=5)
+PREROLL_BYTES = 64 * 1024 * 1024
+
+
+class PrerollBuffer:
+    """
+    The newest `duration` of one camera's encoded packets while it is not recording.
+    Packets are kept per GOP and whole GOPs are dropped from the front, so the buffer
+    always starts at a keyframe and can be muxed as is. Holds somewhat more than
+    `duration`, at most a keyframe interval, and never more than `max_bytes`.
+    """
+    def __init__(self, duration=PREROLL, max_bytes=PREROLL_BYTES):
+        self.duration = duration
+        self.max_bytes = max_bytes
+        # [[(ts, data, keyframe, extradata), ...], ...] one list per GOP
+        self.gops = deque()
+        self.bytes = 0
+
+    def push(self, ts, data, keyframe, extradata):
+        if keyframe:
+            self.gops.append([])
+        elif not self.gops:
+            # The rest of a GOP whose keyframe is gone
+            return
+        self.gops[-1].append((ts, data, keyframe, extradata))
+        self.bytes += len(data)
+
+        # The next GOP alone still reaches back `duration`, or the memory is exhausted
+        while len(self.gops) > 1 and (self.gops[1][0][0] <= ts - self.duration or self.bytes > self.max_bytes):
+            self.bytes -= sum(len(packet[1]) for packet in self.gops.popleft())
+
+    def drain(self):
+        gops, self.gops, self.bytes = self.gops, deque(), 0
+        for gop in gops:
+            yield from gop
+
+    def start(self):
+        # Timestamp of the oldest keyframe held, None while empty
+        try:
+            return self.gops[0][0][0]
+        except IndexError:
+            return None
+
+    def span(self):
+        # Seconds of video held
+        if not self.gops:
+            return 0.0
+        return (self.gops[-1][-1][0] - self.gops[0][0][0]).total_seconds()
+
+
+class CameraRecorder(threading.Thread):
+    """
+    Muxer worker for one camera.
+
+    Drains the encoded bitstream queue continuously, whether or not a viewer is
+    connected, so the device side queue never fills up and drops frames. Packets are
+    only muxed while `recording` is set, each with its own device timestamp, into a
+    SegmentWriter.
+
+    `to_host` maps device timestamps onto a clock shared with other recorders and
+    `epoch` is time zero on that clock, packets captured before it are not written.
+    Without them the first recorded packet is time zero.
+
+    With a `preroll` buffer the packets that arrive while not recording are kept in it,
+    and written first when recording starts.
+    """
+    def __init__(self, queue, segments, name, clock=dai.Clock.now, to_host=None, stats=None):
+        super().__init__(name=name, daemon=True)
+        self.queue = queue
+        self.segments = segments
+        self.clock = clock
+        self.to_host = to_host or (lambda ts: ts)
+        self.stages = stats
+
+        self.running = True
+        self.recording = False
+        self.preroll = None
+        self.epoch = None
+        self.last_pts = None
+        self.last_seq = None
+
+        # Counters
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.late = 0
+        self.out_of_order = 0
+        self.depth = 0
+
+    def run(self):
+        while self.running:
+            start = time.perf_counter()
+            try:
+                # Whatever queued up meanwhile is handled in the same pass
+                batch = [self.queue.get()] + self.queue.tryGetAll()
+            except RuntimeError:
+                # Queue was closed together with its device
+                break
+            if self.stages is not None:
+                self.stages.record("mux_wait", time.perf_counter() - start)
+            self.depth = len(batch)
+
+            for encoded in batch:
+                start = time.perf_counter()
+                try:
+                    self.handle(encoded)
+                except Exception:
+                    traceback.print_exc()
+                if self.stages is not None and self.recording:
+                    self.stages.record("mux", time.perf_counter() - start)
+
+    def handle(self, encoded):
+        self.received += 1
+
+        # Gaps in the sequence numbers are packets dropped before reaching the host
+        seq = encoded.getSequenceNum()
+        if self.last_seq is not None and seq > self.last_seq + 1:
+            self.dropped += seq - self.last_seq - 1
+        self.last_seq = seq
+
+        if self.clock() - encoded.getTimestamp() > LATE_THRESHOLD:
+            self.late += 1
+
+        preroll = self.preroll
+        if not self.recording and preroll is None:
+            # A stopped recording is playable right away
+            self.segments.closeSegment()
+            return
+
+        ts = self.to_host(encoded.getTimestampDevice())
+        data = encoded.getData()
+        keyframe, extradata = inspect(data, self.segments.codec)
+        if not self.recording:
+            self.segments.closeSegment()
+            preroll.push(ts, data, keyframe, extradata)
+            return
+
+        if preroll is not None:
+            for packet in preroll.drain():
+                self.write(*packet)
+        self.write(ts, data, keyframe, extradata)
+
+    def write(self, ts, data, keyframe, extradata):
+        if self.epoch is None:
+            self.epoch = ts
+        if ts < self.epoch:
+            return
+
+        pts = int((ts - self.epoch).total_seconds() * 1e6)  # To microsec
+        if self.last_pts is not None and pts <= self.last_pts:
+            self.out_of_order += 1
+            return
+        self.last_pts = pts
+
+        if self.segments.mux(data, pts, keyframe, extradata):
+            self.written += 1
+
+    def stats(self):
+        return {
+            "received": self.received,
+            "written": self.written,
+            "dropped": self.dropped,
+            "late": self.late,
+            "out_of_order": self.out_of_order,
+            "depth": self.depth,
+            "preroll_bytes": 0 if self.preroll is None else self.preroll.bytes,
+            "preroll_s": 0.0 if self.preroll is None else round(self.preroll.span(), 2),
+        }
+
+    def stop(self, timeout=1.0):
+        self.running = False
+        self.recording = False
+        self.join(timeout)
+        self.segments.close()
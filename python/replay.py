@@ -0,0 +1,204 @@
+import json
+import struct
+import time
+import numpy as np
+
+from datetime import timedelta
+from pathlib import Path
+from python.fakedevice import FakeDetectionQueue, FakeImgFrame, FakeInputQueue, PacedQueue
+
+REPLAY_DIR = Path(__file__).parent.parent / 'cache' / 'replay'
+META_NAME = 'meta.json'
+# Per message: sequence number, host and device timestamp (us), data length
+RECORD = struct.Struct('<Iqqi')
+# Output queues of the camera pipeline, replayed from <name>.rec
+STREAMS = ('preview', 'encoded')
+# Canned detections (a network is not recorded) arrive this long after their preview
+# frame, about what MobileNet-SSD takes on the device
+DETECTION_LATENCY = 0.035
+
+
+def micros(ts):
+    return int(ts.total_seconds() * 1e6)
+
+
+class ReplayWriter:
+    """
+    Records one camera's output queues for replay: `<directory>/<mxid>/<stream>.rec`
+    with every message's sequence number, host and device timestamp and data, and a
+    meta.json describing the preview frames and the encoded stream.
+    """
+    def __init__(self, directory, mxid, preview_size, codec, size, pix_fmt, fps):
+        self.directory = Path(directory) / mxid
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.meta = {
+            "mxid": mxid,
+            "preview": list(preview_size),
+            "codec": codec,
+            "size": list(size),
+            "pix_fmt": pix_fmt,
+            "fps": fps,
+            "start": None,
+            "end": None,
+        }
+        self.files = {name: open(self.directory / f"{name}.rec", 'wb') for name in STREAMS}
+
+    def write(self, stream, seq, ts, ts_device, data):
+        data = bytes(data)
+        self.files[stream].write(RECORD.pack(seq, micros(ts), micros(ts_device), len(data)))
+        self.files[stream].write(data)
+        us = micros(ts)
+        self.meta["start"] = us if self.meta["start"] is None else min(self.meta["start"], us)
+        self.meta["end"] = us if self.meta["end"] is None else max(self.meta["end"], us)
+
+    def writeFrame(self, stream, frame):
+        # A depthai message as it came out of its output queue
+        self.write(stream, frame.getSequenceNum(), frame.getTimestamp(), frame.getTimestampDevice(), frame.getData())
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        with open(self.directory / META_NAME, 'w') as f:
+            json.dump(self.meta, f, indent=1)
+
+
+def readRecords(path):
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            (seq, ts, ts_device, length) = RECORD.unpack(header)
+            yield seq, ts, ts_device, f.read(length)
+
+
+class ReplayQueue(PacedQueue):
+    """
+    Replays a recorded stream through the output queue interface, every message due at
+    its recorded time after `start` and looping. The host timestamps are those due times
+    (time.monotonic(), what dai.Clock.now() reads) and the device timestamps keep their
+    recorded offset from them, sequence numbers keep counting across loops.
+    """
+    def __init__(self, path, meta, start=None, loop=True, size=None):
+        super().__init__(start=start)
+        self.path = path
+        # (width, height) of NV12 frames, None for a bitstream
+        self.size = size
+        self.loop = loop
+        # Time zero and length of one pass, shared by all streams of the recording
+        self.first = meta["start"]
+        self.length = meta["end"] - meta["start"] + 1e6 / meta["fps"]
+        self.passes = 0
+        self.records = readRecords(self.path)
+        self.pending = self.read()
+        self.first_seq = self.pending[0] if self.pending is not None else 0
+        self.seq_span = 0
+        self.schedule()
+
+    def read(self):
+        record = next(self.records, None)
+        if record is None and self.loop:
+            self.passes += 1
+            self.records = readRecords(self.path)
+            record = next(self.records, None)
+        return record
+
+    def schedule(self):
+        if self.pending is None:
+            # Done, nothing due any more
+            self.next_due = float('inf')
+            return
+        ts = self.pending[1]
+        self.next_due = self.start + (ts - self.first + self.passes * self.length) / 1e6
+
+    def _make(self):
+        with self.lock:
+            if self.pending is None:
+                return None
+            (seq, ts, ts_device, data) = self.pending
+            due = self.next_due
+            passes = self.passes
+            self.pending = self.read()
+            if self.passes > passes and not self.seq_span:
+                self.seq_span = seq - self.first_seq + 1
+            self.schedule()
+
+        host = timedelta(seconds=due)
+        device = host + timedelta(microseconds=ts_device - ts)
+        data = np.frombuffer(data, np.uint8)
+        img = data
+        if self.size is not None:
+            # getWidth()/getHeight() of an NV12 frame come from the luma plane
+            (w, h) = self.size
+            img = data[:w * h].reshape(h, w)
+        return FakeImgFrame(img, seq + passes * self.seq_span, host, data, device)
+
+
+class RecordedStream:
+    # What Camera.open needs to know about the encoded stream of a replayed camera
+    def __init__(self, meta):
+        self.codec = meta["codec"]
+        self.size = tuple(meta["size"])
+        self.pix_fmt = meta["pix_fmt"]
+
+
+class ReplayDevice:
+    """
+    Stands in for dai.Device, replaying a recorded camera (see ReplayWriter) through the
+    same output and input queues. With a detection stage, its queue has canned detections
+    for the replayed preview frames.
+    """
+    def __init__(self, directory, start=None, loop=True):
+        self.directory = Path(directory)
+        with open(self.directory / META_NAME) as f:
+            self.meta = json.load(f)
+        self.start = time.monotonic() if start is None else start
+        self.loop = loop
+        self.queues = []
+        self.inputs = {}
+
+    def getOutputQueue(self, name, maxSize=4, blocking=False):
+        if name == 'detections':
+            frames = ReplayQueue(self.directory / "preview.rec", self.meta, self.start, self.loop)
+            queue = FakeDetectionQueue(frames, latency=DETECTION_LATENCY)
+            self.queues.append(queue)
+            return queue
+        size = self.meta["preview"] if name == 'preview' else None
+        queue = ReplayQueue(self.directory / f"{name}.rec", self.meta, self.start, self.loop, size)
+        self.queues.append(queue)
+        return queue
+
+    def getInputQueue(self, name):
+        # Camera controls and configs are accepted and counted
+        return self.inputs.setdefault(name, FakeInputQueue())
+
+    def close(self):
+        for queue in self.queues:
+            queue.close()
+
+    def __repr__(self):
+        return f"ReplayDevice({self.directory})"
+
+
+class ReplayBackend:
+    """
+    Cameras replayed from `<directory>/<mxid>/`, recorded from the rig or synthesized by
+    benchmarks/record_replay.py. All cameras opened by the backend share time zero, so
+    cameras recorded together stay in sync.
+    """
+    name = "replay"
+
+    def __init__(self, directory=REPLAY_DIR, loop=True):
+        self.directory = Path(directory)
+        self.loop = loop
+        self.start = None
+
+    def discover(self):
+        return sorted(path.parent.name for path in self.directory.glob(f"*/{META_NAME}"))
+
+    def open(self, mxid, settings, detection=None):
+        if self.start is None:
+            # A little ahead, the other cameras are still being opened
+            self.start = time.monotonic() + 0.2
+        device = ReplayDevice(self.directory / mxid, self.start, self.loop)
+        return device, RecordedStream(device.meta)
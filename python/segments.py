@@ -0,0 +1,297 @@
+import json
+import os
+import shutil
+import struct
+import time
+import traceback
+import av
+
+from fractions import Fraction
+from pathlib import Path
+
+RECORDING_DIR = Path('/media/gary/usb_drive')
+# Length of one recording segment, a crash loses at most the one being written
+SEGMENT_DURATION = 60 * 1000 * 1000  # us, the recorders' pts unit
+# Writes are collected in a buffer this large, so the stick sees few big writes
+WRITE_BUFFER = 8 * 1024 * 1024
+# Oldest segments are evicted before a new one starts while less than this is free
+MIN_FREE_BYTES = 2 * 1024 ** 3
+INDEX_NAME = 'index.json'
+
+
+def readIndex(directory):
+    # Complete segments of one camera, oldest first, as listed in its index file
+    directory = Path(directory)
+    try:
+        with open(directory / INDEX_NAME) as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError):
+        traceback.print_exc()
+        return []
+    # Files removed by hand are forgotten
+    return [entry for entry in index if (directory / entry['file']).exists()]
+
+
+def mp4Boxes(data, start=0, end=None):
+    # (type, payload start, box end) of the boxes in data[start:end]
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        (size, kind) = struct.unpack_from('>I4s', data, start)
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack_from('>Q', data, start + 8)
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            return
+        yield kind, start + header, start + size
+        start += size
+
+
+def mp4SampleOffsets(path):
+    """
+    Byte offset of every sample of the first track of an MP4 file, from the sample
+    tables of its moov box. Only the box headers and the moov (at the end of a file
+    written by the muxer, tens of KB) are read, not the media data.
+    """
+    moov = None
+    with open(path, 'rb') as f:
+        position = 0
+        while True:
+            f.seek(position)
+            header = f.read(16)
+            if len(header) < 8:
+                break
+            (size, kind) = struct.unpack_from('>I4s', header)
+            length = 8
+            if size == 1:
+                (size,) = struct.unpack_from('>Q', header, 8)
+                length = 16
+            elif size == 0:
+                size = os.fstat(f.fileno()).st_size - position
+            if kind == b'moov':
+                f.seek(position + length)
+                moov = f.read(size - length)
+                break
+            if size < length:
+                break
+            position += size
+    if moov is None:
+        raise ValueError(f"{path} has no moov box")
+
+    def child(start, end, kind):
+        return next(((s, e) for k, s, e in mp4Boxes(moov, start, end) if k == kind), None)
+
+    box = (0, len(moov))
+    for kind in (b'trak', b'mdia', b'minf', b'stbl'):
+        box = child(*box, kind)
+        if box is None:
+            raise ValueError(f"{path} has no {kind.decode()} box")
+    tables = {kind: (start, end) for kind, start, end in mp4Boxes(moov, *box)}
+
+    # Sample sizes
+    start = tables[b'stsz'][0]
+    (sample_size, count) = struct.unpack_from('>II', moov, start + 4)
+    sizes = [sample_size] * count if sample_size else struct.unpack_from(f'>{count}I', moov, start + 12)
+    # Chunk offsets
+    if b'co64' in tables:
+        start = tables[b'co64'][0]
+        (chunks,) = struct.unpack_from('>I', moov, start + 4)
+        chunk_offsets = struct.unpack_from(f'>{chunks}Q', moov, start + 8)
+    else:
+        start = tables[b'stco'][0]
+        (chunks,) = struct.unpack_from('>I', moov, start + 4)
+        chunk_offsets = struct.unpack_from(f'>{chunks}I', moov, start + 8)
+    # Samples per chunk, runs of (first chunk, samples per chunk, description)
+    start = tables[b'stsc'][0]
+    (entries,) = struct.unpack_from('>I', moov, start + 4)
+    runs = [struct.unpack_from('>III', moov, start + 8 + 12 * i)[:2] for i in range(entries)]
+
+    offsets = []
+    for i, (first, per_chunk) in enumerate(runs):
+        last = runs[i + 1][0] - 1 if i + 1 < len(runs) else len(chunk_offsets)
+        for chunk in range(first - 1, last):
+            offset = chunk_offsets[chunk]
+            for _ in range(per_chunk):
+                if len(offsets) == len(sizes):
+                    return offsets
+                offsets.append(offset)
+                offset += sizes[len(offsets) - 1]
+    return offsets
+
+
+def fsyncDirectory(path):
+    # Makes renames/new files in `path` durable
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SegmentWriter:
+    """
+    Writes one camera's encoded packets as time-bounded MP4 segments in
+    `<directory>/<name>/`, listed in an index file.
+
+    Segments are cut where the packet pts (us since the shared recording epoch) crosses
+    a multiple of `duration`, so cameras recorded on the same epoch cut together. A
+    segment is fsynced when closed and only then added to the index, which is replaced
+    atomically. A crash therefore loses the open segment and nothing else. Before a new
+    segment starts the oldest indexed segments are evicted until `min_free` bytes are free.
+
+    Not thread-safe, it is driven by a single CameraRecorder thread.
+    """
+    def __init__(self, directory, name, codec, size, pix_fmt=None, duration=SEGMENT_DURATION,
+                 min_free=MIN_FREE_BYTES, buffer_size=WRITE_BUFFER):
+        self.directory = Path(directory) / name
+        self.name = name
+        self.codec = codec
+        self.size = size
+        self.pix_fmt = pix_fmt
+        self.duration = duration
+        self.min_free = min_free
+        self.buffer_size = buffer_size
+
+        self.file = None
+        self.container = None
+        self.stream = None
+        self.segment = None
+
+        self.evicted = 0
+        self.index = self.loadIndex()
+
+    @property
+    def index_path(self):
+        return self.directory / INDEX_NAME
+
+    def loadIndex(self):
+        return readIndex(self.directory)
+
+    def writeIndex(self):
+        tmp = self.index_path.with_suffix('.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+        fsyncDirectory(self.directory)
+
+    def mux(self, data, pts, keyframe=True, extradata=b''):
+        """
+        pts in us since the recording epoch. Segments only start on keyframes, for
+        H.264/H.265 `extradata` are the Annex-B parameter sets sent with the keyframe.
+        Returns whether the packet was written.
+        """
+        number = pts // self.duration
+        if self.segment is not None and number != self.segment['number'] and keyframe:
+            self.closeSegment()
+        if self.segment is None:
+            if not keyframe:
+                return False
+            self.openSegment(number, pts, extradata)
+
+        segment = self.segment
+        packet = av.Packet(data)
+        packet.pts = packet.dts = pts - segment['start'] + 1  # +1 to avoid zero dts
+        packet.is_keyframe = keyframe
+        packet.stream = self.stream
+        self.container.mux_one(packet)
+        if keyframe:
+            # Sample number and time, the byte offset is looked up once the segment is closed
+            segment['keyframes'].append([segment['frames'], round((pts - segment['start']) / 1e6, 6)])
+        segment['frames'] += 1
+        segment['end'] = pts
+        return True
+
+    def openSegment(self, number, pts, extradata=b''):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.evict()
+
+        started = time.time()
+        stem = f"{self.name}_{time.strftime('%Y%m%d-%H%M%S', time.localtime(started))}_{number:05d}"
+        filename, attempt = f"{stem}.mp4", 0
+        while (self.directory / filename).exists():
+            # Never overwrite, the pts restart at 0 with every run
+            attempt += 1
+            filename = f"{stem}-{attempt}.mp4"
+        self.file = open(self.directory / filename, 'wb', buffering=self.buffer_size)
+        self.container = av.open(self.file, mode='w', format='mp4')
+        if hasattr(self.container, 'add_mux_stream'):
+            # Packets are only muxed, no encoder is opened. The MP4 muxer takes the
+            # parameter sets for avcC/hvcC from the first keyframe, which carries them.
+            self.stream = self.container.add_mux_stream(self.codec, width=self.size[0], height=self.size[1])
+        else:
+            # PyAV < 17 only adds streams with a codec context, opened once muxing starts
+            self.stream = self.container.add_stream(self.codec)
+            self.stream.width, self.stream.height = self.size
+            if self.pix_fmt is not None:
+                self.stream.pix_fmt = self.pix_fmt
+            if extradata:
+                # Annex-B parameter sets, the MP4 muxer writes them as avcC/hvcC
+                self.stream.codec_context.extradata = extradata
+        self.stream.time_base = Fraction(1, 1000 * 1000)
+        self.segment = {
+            'file': filename,
+            'number': int(number),
+            'started': started,
+            'start': int(pts),
+            'end': int(pts),
+            'frames': 0,
+            'keyframes': [],
+        }
+
+    def closeSegment(self):
+        if self.segment is None:
+            return
+        segment, self.segment = self.segment, None
+        try:
+            self.container.close()
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        finally:
+            self.file.close()
+            self.container = self.stream = self.file = None
+
+        path = self.directory / segment['file']
+        segment['bytes'] = path.stat().st_size
+        segment['duration'] = (segment['end'] - segment['start']) / 1e6
+        # [seconds into the segment, byte offset] of every keyframe, where playback can
+        # start after a seek
+        try:
+            offsets = mp4SampleOffsets(path)
+            segment['keyframes'] = [[t, offsets[n]] for n, t in segment['keyframes'] if n < len(offsets)]
+        except (OSError, ValueError, KeyError, struct.error):
+            traceback.print_exc()
+            segment['keyframes'] = []
+        self.index.append(segment)
+        self.writeIndex()
+
+    def evict(self):
+        while self.index and shutil.disk_usage(self.directory).free < self.min_free:
+            oldest = self.index.pop(0)
+            print(f"{self.name}: low disk space, evicting {oldest['file']}")
+            try:
+                (self.directory / oldest['file']).unlink()
+            except FileNotFoundError:
+                pass
+            self.evicted += 1
+            self.writeIndex()
+
+    def stats(self):
+        return {
+            "codec": self.codec,
+            "segments": len(self.index),
+            "evicted": self.evicted,
+            "current": None if self.segment is None else self.segment['file'],
+            "free": shutil.disk_usage(self.directory).free if self.directory.exists() else None,
+        }
+
+    def close(self):
+        try:
+            self.closeSegment()
+        except Exception:
+            traceback.print_exc()
@@ -0,0 +1,214 @@
+import asyncio
+import os
+import time
+import traceback
+
+# Viewers served at the same time, each one costs an encoder of its own
+DEFAULT_MAX_VIEWERS = 4
+# A session that never connects, or stays disconnected, is closed after this long (s)
+HALF_OPEN_TIMEOUT = 30.0
+DISCONNECTED_TIMEOUT = 15.0
+# A connected session that neither pulls frames nor sends messages for this long is closed (s)
+IDLE_TIMEOUT = 120.0
+# How often sessions are checked (s)
+REAP_INTERVAL = 5.0
+
+
+def process_memory():
+    # Resident set size (bytes) and open file descriptors (USB handles among them)
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        fds = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None, None
+    return rss, fds
+
+
+class Session:
+    # One viewer: its peer connection, track, adaptive controller and data channel
+    def __init__(self, pc_id, pc, now):
+        self.pc_id = pc_id
+        self.pc = pc
+        self.created = now
+        self.last_message = now
+        self.disconnected = None
+        self.track = None
+        self.controller = None
+
+    @property
+    def state(self):
+        return self.pc.connectionState
+
+    def last_activity(self):
+        last_frame = self.track.last_frame if self.track is not None else None
+        return max(self.last_message, last_frame or self.created)
+
+    def expired(self, now, half_open=HALF_OPEN_TIMEOUT, disconnected=DISCONNECTED_TIMEOUT, idle=IDLE_TIMEOUT):
+        # Why the session should be reclaimed, None while it is in use
+        if self.state in ("new", "connecting") and now - self.created >= half_open:
+            return "half_open"
+        if self.state == "disconnected" and self.disconnected is not None and now - self.disconnected >= disconnected:
+            return "disconnected"
+        if self.state == "connected" and now - self.last_activity() >= idle:
+            return "idle"
+        return None
+
+    def status(self, now):
+        return {
+            "pc_id": self.pc_id,
+            "state": self.state,
+            "age_s": round(now - self.created, 1),
+            "idle_s": round(now - self.last_activity(), 1),
+        }
+
+
+class SessionManager:
+    """
+    Owns the viewers' peer sessions for the lifetime of the app: admits at most
+    `max_viewers`, and closes a session together with everything registered for it
+    (app.pcs, app.video_transforms, app.pcs_datachannels, its controller, detection
+    subscription) when its connection closes or fails, stays disconnected, never gets
+    connected or sits idle. The shared VideoRecorder and its devices are not a
+    session's, they stay up for the next viewer.
+    """
+    def __init__(self, application, max_viewers=None, interval=REAP_INTERVAL):
+        self.application = application
+        if max_viewers is None:
+            max_viewers = int(os.environ.get('MAX_VIEWERS', DEFAULT_MAX_VIEWERS))
+        if max_viewers < 1:
+            raise ValueError(f"MAX_VIEWERS must be at least 1, got {max_viewers}")
+        self.max_viewers = max_viewers
+        self.interval = interval
+        self.sessions = {}
+        self.task = None
+
+        # Counters
+        self.opened = 0
+        self.rejected = 0
+        self.closed = {}
+
+    def admit(self):
+        # Whether another viewer fits
+        if len(self.sessions) >= self.max_viewers:
+            self.rejected += 1
+            return False
+        return True
+
+    def add(self, pc, pc_id):
+        session = Session(pc_id, pc, time.monotonic())
+        self.sessions[pc_id] = session
+        self.application.pcs.add(pc)
+        self.opened += 1
+
+        @pc.on("connectionstatechange")
+        async def on_connectionstatechange():
+            state = pc.connectionState
+            if state == "disconnected":
+                session.disconnected = time.monotonic()
+            elif state == "connected":
+                session.disconnected = None
+            elif state in ("failed", "closed"):
+                await self.close(pc_id, state)
+        return session
+
+    def attach_track(self, pc_id, track, controller=None):
+        session = self.sessions[pc_id]
+        session.track = track
+        session.controller = controller
+        self.application.video_transforms[pc_id] = track
+
+    def touch(self, pc_id):
+        # A data channel message came in
+        session = self.sessions.get(pc_id)
+        if session is not None:
+            session.last_message = time.monotonic()
+
+    async def close(self, pc_id, reason):
+        # Closing the connection fires its "closed" state change, by then it is gone
+        session = self.sessions.pop(pc_id, None)
+        if session is None:
+            return
+        self.closed[reason] = self.closed.get(reason, 0) + 1
+        print(f"Session {pc_id} closed: {reason}")
+
+        app = self.application
+        if session.controller is not None:
+            session.controller.stop()
+        if session.track is not None:
+            session.track.stop()
+        app.video_transforms.pop(pc_id, None)
+        app.pcs_datachannels.pop(pc_id, None)
+        engine = app.video_transform
+        if engine is not None:
+            engine.detections.subscribers.discard(pc_id)
+        try:
+            await session.pc.close()
+        except Exception:
+            traceback.print_exc()
+        app.pcs.discard(session.pc)
+
+    async def reap(self, now=None):
+        now = time.monotonic() if now is None else now
+        for pc_id, session in list(self.sessions.items()):
+            reason = session.expired(now)
+            if reason is not None:
+                await self.close(pc_id, reason)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.reap()
+            except Exception:
+                traceback.print_exc()
+
+    def start(self):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        await asyncio.gather(*(self.close(pc_id, "shutdown") for pc_id in list(self.sessions)))
+
+    def stats(self):
+        now = time.monotonic()
+        rss, fds = process_memory()
+        states = {}
+        for session in self.sessions.values():
+            states[session.state] = states.get(session.state, 0) + 1
+        return {
+            "sessions": len(self.sessions),
+            "max_viewers": self.max_viewers,
+            "states": states,
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "closed": dict(self.closed),
+            # Everything a session registers, equal to `sessions` unless something leaks
+            "pcs": len(self.application.pcs),
+            "tracks": len(self.application.video_transforms),
+            "channels": len(self.application.pcs_datachannels),
+            "rss_bytes": rss,
+            "open_fds": fds,
+            "list": [
+                {**session.status(now), "channel": pc_id in self.application.pcs_datachannels}
+                for pc_id, session in self.sessions.items()
+            ],
+        }
+
+    def expose(self, out):
+        # Adds the session metrics to an Exposition
+        stats = self.stats()
+        out.add("sessions", "gauge", "Viewer sessions by connection state", [
+            ({"state": state}, n) for state, n in stats["states"].items()
+        ])
+        out.add("sessions_max", "gauge", "Viewer sessions admitted at most", [({}, self.max_viewers)])
+        out.add("sessions_opened_total", "counter", "Viewer sessions opened", [({}, self.opened)])
+        out.add("sessions_rejected_total", "counter", "Offers turned away at the viewer limit", [({}, self.rejected)])
+        out.add("sessions_closed_total", "counter", "Viewer sessions closed, by reason", [
+            ({"reason": reason}, n) for reason, n in stats["closed"].items()
+        ])
+        for name in ("pcs", "tracks", "channels"):
+            out.add(f"session_{name}", "gauge", f"Registered session {name}", [({}, stats[name])])
+        out.add("process_resident_bytes", "gauge", "Resident memory of the server", [({}, stats["rss_bytes"])])
+        out.add("process_open_fds", "gauge", "Open file descriptors of the server", [({}, stats["open_fds"])])
@@ -0,0 +1,90 @@
+import os
+import time
+import traceback
+import numpy as np
+
+from pathlib import Path
+from python.stitching import Stitcher
+
+CACHE_DIR = Path(__file__).parent.parent / 'cache'
+# Bump when the stored layout changes, older files are then ignored and removed
+CACHE_VERSION = 3
+# Cameras get bumped, after this long a homography is recomputed rather than trusted
+MAX_AGE = 30 * 24 * 3600  # s
+
+
+class HomographyCache:
+    """
+    Stores the homography between two neighbouring cameras and its score, keyed by the
+    MXIDs of the left (imageB) and right (imageA) device and the preview size, so the
+    panorama is stitched from the first frame after a restart. The Compositor rebuilds
+    its seams and blend weights from the homographies in a few milliseconds.
+    """
+    def __init__(self, directory=CACHE_DIR, max_age=MAX_AGE):
+        self.directory = Path(directory)
+        self.max_age = max_age
+
+    def path(self, mxidB, mxidA, shape):
+        (h, w) = shape[:2]
+        return self.directory / f"homography_{mxidB}_{mxidA}_{w}x{h}.npz"
+
+    def save(self, mxidB, mxidA, shape, stitcher):
+        path = self.path(mxidB, mxidA, shape)
+        tmp = path.with_suffix('.tmp')
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                np.savez(
+                    f,
+                    version=CACHE_VERSION,
+                    created=time.time(),
+                    mxids=np.array([mxidB, mxidA]),
+                    shape=np.array(shape),
+                    size=np.array(stitcher.size),
+                    homography=stitcher.homography,
+                    inliers=stitcher.inliers,
+                    error=stitcher.error,
+                )
+            # never leave a half written entry behind
+            os.replace(tmp, path)
+        except OSError:
+            traceback.print_exc()
+
+    def load(self, mxidB, mxidA, shape):
+        path = self.path(mxidB, mxidA, shape)
+        if not path.exists():
+            return None
+
+        try:
+            with np.load(path) as entry:
+                stitcher = self.validate(entry, mxidB, mxidA, shape)
+        except Exception as e:
+            print(f"Unreadable homography cache {path}: {e}")
+            stitcher = None
+
+        if stitcher is None:
+            print(f"Invalidating homography cache {path}")
+            self.invalidate(mxidB, mxidA, shape)
+        return stitcher
+
+    def validate(self, entry, mxidB, mxidA, shape):
+        if int(entry['version']) != CACHE_VERSION:
+            return None
+        if time.time() - float(entry['created']) > self.max_age:
+            return None
+        if list(entry['mxids']) != [mxidB, mxidA] or tuple(entry['shape']) != tuple(shape):
+            return None
+
+        homography = entry['homography']
+        if homography.shape != (3, 3) or not np.isfinite(homography).all():
+            return None
+
+        stitcher = Stitcher.from_homography(homography, size=tuple(int(v) for v in entry['size']))
+        stitcher.inliers, stitcher.error = int(entry['inliers']), float(entry['error'])
+        return stitcher
+
+    def invalidate(self, mxidB, mxidA, shape):
+        try:
+            self.path(mxidB, mxidA, shape).unlink()
+        except FileNotFoundError:
+            pass
@@ -2,56 +2,120 @@ import numpy as np
 import imutils
 import cv2
 
+# Feather the seam and match the exposure/white balance of the two cameras in the overlap
+BLEND = True
+# Frames between gain re-estimates and how much of each new estimate is taken over
+GAIN_INTERVAL = 14
+GAIN_SMOOTHING = 0.3
+GAIN_LIMITS = (0.5, 2.0)
+# One in this many feature matches is held out of the homography fit to score it
+HOLDOUT = 4
+
+class CanvasPool:
+	# A few preallocated output images used round robin. The composed frame is read by
+	# the viewer tracks after it is published, so it must not be overwritten by the very
+	# next frame; three buffers leave room for one frame in flight per stage.
+	def __init__(self, shape, count=3, fill=0):
+		self.shape = shape
+		self.buffers = [np.full(shape, fill, dtype=np.uint8) for _ in range(count)]
+		self.index = 0
+
+	def next(self):
+		self.index = (self.index + 1) % len(self.buffers)
+		return self.buffers[self.index]
+
 # This stitching code is based on Luxonis code found in Github at:
 # https://github.com/luxonis/depthai-calibration/blob/4fe9b94ad6d9be2a6c44ad75d4c15076e760271d/dynamic_recalibration.py#L113
+def estimateHomography(images, scale=1.0, reprojThresh=5.0, holdout=HOLDOUT):
+	# Module level so it can run in a worker process. `images` may be downscaled by
+	# `scale`, matched points are mapped back so the homography is in full resolution.
+	# Every `holdout`th match is kept out of the fit and returned for scoring: on the
+	# matches it was fitted to, a fresh homography beats any other one by a hair.
+	ransacMethod = cv2.RANSAC
+	if cv2.__version__ >= "4.5.4":
+		ransacMethod = cv2.USAC_MAGSAC
+
+	# unpack the images, then detect keypoints and extract
+	# local invariant descriptors from them
+	(imageB, imageA) = images
+	sift = cv2.SIFT_create()
+	kp1, des1 = sift.detectAndCompute(imageA,None)
+	kp2, des2 = sift.detectAndCompute(imageB,None)
+
+	FLANN_INDEX_KDTREE = 1
+
+	index_params = dict(algorithm = FLANN_INDEX_KDTREE, trees = 5)
+	search_params = dict(checks=50)
+
+	flann = cv2.FlannBasedMatcher(index_params,search_params)
+	matches = flann.knnMatch(des1,des2,k=2)
+
+	pts1 = []
+	pts2 = []
+
+	for i,(m,n) in enumerate(matches):
+		if m.distance < 0.8*n.distance:
+			pts2.append(kp2[m.trainIdx].pt)
+			pts1.append(kp1[m.queryIdx].pt)
+
+	minKeypoints = 20
+	if len(pts1) < minKeypoints:
+		raise Exception(f'Need at least {minKeypoints} keypoints!')
+
+	pts1 = np.float32(pts1) / scale
+	pts2 = np.float32(pts2) / scale
+	held = np.arange(len(pts1)) % holdout == 0
+
+	homography, mask = cv2.findHomography(pts1[~held], pts2[~held], method = ransacMethod, ransacReprojThreshold = reprojThresh)
+	if homography is None:
+		raise Exception('No homography found!')
+
+	return homography, pts1[held], pts2[held]
+
+def scoreHomography(homography, pts1, pts2, reprojThresh=5.0):
+	# inlier count and RMS reprojection error (pixels) of the inliers
+	projected = cv2.perspectiveTransform(pts1.reshape(-1, 1, 2), homography).reshape(-1, 2)
+	errors = np.linalg.norm(projected - pts2, axis=1)
+	inliers = errors < reprojThresh
+	count = int(inliers.sum())
+	rmse = float(np.sqrt(np.mean(errors[inliers] ** 2))) if count else float('inf')
+	return count, rmse
+
+def scaleHomography(homography, scale):
+	# the same homography between images scaled by `scale`, e.g. for the half size chroma planes
+	if scale == 1:
+		return homography
+	# pixel centres: x_scaled = scale * (x + 0.5) - 0.5
+	offset = 0.5 * scale - 0.5
+	S = np.array([[scale, 0, offset], [0, scale, offset], [0, 0, 1]])
+	return S @ homography @ np.linalg.inv(S)
+
 class Stitcher:
+	# The homography between two neighbouring cameras and its score, the Compositor warps with it
 	def __init__(self, images, ratio=0.75, reprojThresh=5.0):
 		# determine if we are using OpenCV v3.X
 		self.isv3 = imutils.is_cv3(or_better=True)
 
-		self.ransacMethod = cv2.RANSAC
-		if cv2.__version__ >= "4.5.4":
-			self.ransacMethod = cv2.USAC_MAGSAC
-
-		# unpack the images, then detect keypoints and extract
-		# local invariant descriptors from them
-		(imageB, imageA) = images
-		sift = cv2.SIFT_create()
-		kp1, des1 = sift.detectAndCompute(imageA,None)
-		kp2, des2 = sift.detectAndCompute(imageB,None)
-
-		FLANN_INDEX_KDTREE = 1
-
-		index_params = dict(algorithm = FLANN_INDEX_KDTREE, trees = 5)
-		search_params = dict(checks=50)
-
-		flann = cv2.FlannBasedMatcher(index_params,search_params)
-		matches = flann.knnMatch(des1,des2,k=2)
+		homography, pts1, pts2 = estimateHomography(images, reprojThresh=reprojThresh)
+		self.setHomography(homography, size=images[1].shape[:2])
+		self.inliers, self.error = scoreHomography(homography, pts1, pts2, reprojThresh)
 
-		pts1 = []
-		pts2 = []
-
-		for i,(m,n) in enumerate(matches):
-			if m.distance < 0.8*n.distance:
-				pts2.append(kp2[m.trainIdx].pt)
-				pts1.append(kp1[m.queryIdx].pt)
-
-		minKeypoints = 20
-		if len(pts1) < minKeypoints:
-			raise Exception(f'Need at least {minKeypoints} keypoints!')
-
-		pts1 = np.float32(pts1)
-		pts2 = np.float32(pts2)
-
-		self.homography, mask = cv2.findHomography(pts1, pts2, method = self.ransacMethod, ransacReprojThreshold = reprojThresh)
+	@classmethod
+	def from_homography(cls, homography, size=None):
+		# skip feature matching, e.g. for a homography computed earlier
+		self = cls.__new__(cls)
+		self.isv3 = imutils.is_cv3(or_better=True)
+		self.setHomography(homography, size)
+		self.inliers, self.error = 0, float('inf')
+		return self
 
-	def warp(self, images):
-		(imageB, imageA) = images
-		result = cv2.warpPerspective(imageA, self.homography, (imageA.shape[1] + imageB.shape[1], imageA.shape[0]))
-		result[0:imageB.shape[0], 0:imageB.shape[1]] = imageB
+	def setHomography(self, homography, size=None):
+		self.homography = homography
+		# (h, w) of imageA the homography was estimated on, smaller planes get a scaled copy
+		self.size = size
 
-		# return the stitched image
-		return result
+	def scaledHomography(self, shapeA):
+		return scaleHomography(self.homography, shapeA[1] / self.size[1])
 
 	def detectAndDescribe(self, image):
 		# convert the image to grayscale
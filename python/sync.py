@@ -0,0 +1,128 @@
+import asyncio
+
+from collections import deque
+from datetime import timedelta
+from python.capture import LatestFrame
+
+# Frames of different devices closer than this are taken as captured at the same instant,
+# half a frame period of the 28 FPS previews
+SYNC_TOLERANCE = timedelta(seconds=0.5 / 28)
+# Frames kept per device while waiting for a partner
+RING_SIZE = 8
+# Weight of a new sample in the smoothed device clock offsets
+OFFSET_SMOOTHING = 0.05
+# Sync errors kept for the statistics
+ERROR_WINDOW = 256
+
+
+class SyncInput:
+    # What a CaptureThread publishes to, stands in for a LatestFrame slot
+    def __init__(self, sync, index):
+        self.sync = sync
+        self.index = index
+
+    def put(self, captured):
+        # Safe to call from any thread
+        self.sync.loop.call_soon_threadsafe(self.sync.add, self.index, captured)
+
+
+class FrameSync:
+    """
+    Matches the frames of several devices by hardware timestamp.
+
+    Each device's Captured frames go into a small ring buffer. Device timestamps are
+    mapped onto the host clock with a smoothed per-device offset (the host synced
+    timestamps of depthai step whenever the clock sync updates). The newest frame of the
+    reference device (index 0) that has a partner within `tolerance` on every other
+    device is published to `output` together with its partners. Whatever is older is
+    discarded, so a hiccup on one device costs a few unmatched frames instead of leaving
+    the pairs permanently out of step.
+    """
+    def __init__(self, devices=2, tolerance=SYNC_TOLERANCE, size=RING_SIZE, smoothing=OFFSET_SMOOTHING, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+
+        self.rings = [deque(maxlen=size) for _ in range(devices)]
+        self.inputs = [SyncInput(self, i) for i in range(devices)]
+        self.offsets = [None] * devices
+        self.output = LatestFrame(self.loop)
+        # Host time of the last published set
+        self.last = None
+
+        # Counters
+        self.matched = 0
+        self.unmatched = [0] * devices
+        self.errors = deque(maxlen=ERROR_WINDOW)
+
+    def toHost(self, index, ts_device):
+        # Device clock -> host clock, unchanged until the device's first frame arrived
+        offset = self.offsets[index]
+        return ts_device if offset is None else ts_device - offset
+
+    def time(self, index, captured):
+        return self.toHost(index, captured.device_timestamp)
+
+    def add(self, index, captured):
+        sample = (captured.device_timestamp - captured.timestamp).total_seconds()
+        offset = self.offsets[index]
+        if offset is None:
+            self.offsets[index] = timedelta(seconds=sample)
+        else:
+            offset = offset.total_seconds()
+            self.offsets[index] = timedelta(seconds=offset + self.smoothing * (sample - offset))
+
+        ring = self.rings[index]
+        if len(ring) == ring.maxlen:
+            # Waited a whole ring for a partner
+            self.unmatched[index] += 1
+        ring.append(captured)
+        self.match()
+
+    def match(self):
+        reference = self.rings[0]
+        for ref in reversed(reference):
+            t = self.time(0, ref)
+            if self.last is not None and t <= self.last:
+                return
+
+            partners = []
+            for index, ring in enumerate(self.rings[1:], 1):
+                nearest = min(ring, key=lambda c: abs(self.time(index, c) - t), default=None)
+                if nearest is None or abs(self.time(index, nearest) - t) > self.tolerance:
+                    break
+                partners.append(nearest)
+            else:
+                self.publish(ref, partners, t)
+                return
+
+    def publish(self, ref, partners, t):
+        matched = [ref] + partners
+        for index, (ring, captured) in enumerate(zip(self.rings, matched)):
+            # Everything up to the match is used or too old to ever be matched
+            while ring:
+                oldest = ring.popleft()
+                if oldest is captured:
+                    break
+                self.unmatched[index] += 1
+
+        self.last = t
+        self.matched += 1
+        error = max((abs(self.time(i, c) - t) for i, c in enumerate(partners, 1)), default=timedelta(0))
+        self.errors.append(error.total_seconds())
+        self.output.put(tuple(matched))
+
+    def stats(self):
+        errors = sorted(self.errors)
+        offsets = [None if o is None else round(o.total_seconds() * 1000, 3) for o in self.offsets]
+        return {
+            "matched": self.matched,
+            "unmatched": self.unmatched,
+            "error_ms": {
+                "mean": round(1000 * sum(errors) / len(errors), 3) if errors else None,
+                "p95": round(1000 * errors[int(0.95 * (len(errors) - 1))], 3) if errors else None,
+                "max": round(1000 * errors[-1], 3) if errors else None,
+            },
+            # Device clock offset of every device against the reference device
+            "offset_ms": [None if o is None or offsets[0] is None else round(o - offsets[0], 3) for o in offsets],
+        }
@@ -1,234 +1,548 @@
+import asyncio
+import os
 import traceback
 import numpy as np
-import cv2
-import av
 import depthai as dai
-import blobconverter
 
 from aiortc import VideoStreamTrack
+from aiortc.mediastreams import MediaStreamError
+from concurrent.futures import ThreadPoolExecutor
 from fractions import Fraction
-from python.stitching import Stitcher
+from python.calibration import Calibrator
+from python.cameras import Camera, backend_from_env, load_config
+from python.capture import LatestFrame
+from python.compositor import Compositor, adjacent
+from python.frames import VIDEO_TIME_BASE, FramePool
+from python.controls import CameraControls, CameraRegions
+from python.datachannel import notify, send_binary
+from python.detection import BATCH_INTERVAL, DetectionBatcher, DetectionSettings
+from python.encoding import EncoderSettings
+from python.metrics import Exposition, StageStats
+from python.motion import DEFAULT_TRIGGER, TRIGGERS, MotionDetector
+from python.recording import PrerollBuffer
+from python.segments import RECORDING_DIR
+from python.stitchcache import HomographyCache
+from python.sync import FrameSync
 
 import time
 import sys
 
-PREVIEW_WIDTH = 600
-PREVIEW_HEIGHT = 400
-# FPS = 30
-FPS = 28
-# FPS = 20
+# Event-loop lag probe period and STATS push period (s)
+LAG_INTERVAL = 0.1
+STATS_INTERVAL = 2.0
 
 class VideoTransformTrack(VideoStreamTrack):
-    def __init__(self, application, pc_id):
+    """
+    Per-viewer track. Subscribes to the composed output of the shared VideoRecorder,
+    which is already a timestamped yuv420p av.VideoFrame, so a viewer costs no copy at
+    all. A viewer that can't keep up only ever sees the newest frame and skips the rest
+    on its own. `scale` and `max_fps` are set by the viewer's AdaptiveController.
+    """
+    def __init__(self, recorder, pc_id):
         super().__init__()  # don't forget this!
-        self.dummy = False
-        self.application = application
+        self.recorder = recorder
         self.pc_id = pc_id
-        self.frame = None
+        self.seen = 0
+        self.controller = None
+        self.latency = None
+        # When the viewer last pulled a frame (time.monotonic()), for idle sessions
+        self.last_frame = None
+
+        self.scale = 1.0
+        self.max_fps = None
+        self.next_due = 0
 
     # Has to receive a frame with data, will need to block if frame with data hasn't been received yet
     async def recv(self):
-        frame = await self.get_frame()
-
-        # print(f"Frame size: {frame.shape}")
-
-        pts, time_base = await self.next_timestamp()
-        new_frame = av.VideoFrame.from_ndarray(frame, format="bgr24")
-        new_frame.pts = pts
-        new_frame.time_base = time_base
-        return new_frame
-
-class VideoRecorder(VideoTransformTrack):
-    def __init__(self, application, pc_id):
-        super().__init__(application, pc_id)
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        while True:
+            self.seen, (frame, captured) = await self.recorder.output.next(self.seen)
+            if self.max_fps is None:
+                break
+            # Decimate to the target frame rate, keeping the average rather than the spacing
+            frame_time = frame.pts * frame.time_base
+            period = Fraction(1, self.max_fps)
+            if frame_time >= self.next_due:
+                self.next_due = max(self.next_due + period, frame_time - period)
+                break
+
+        start = time.perf_counter()
+        if self.scale != 1.0:
+            # Only degraded viewers pay for a copy of their own
+            width = int(frame.width * self.scale) // 2 * 2
+            height = int(frame.height * self.scale) // 2 * 2
+            scaled = frame.reformat(width=width, height=height)
+            scaled.pts, scaled.time_base = frame.pts, frame.time_base
+            frame = scaled
+
+        # The encoders want yuv420p, anything else would be converted once more per viewer
+        self.recorder.stats.record("send", time.perf_counter() - start, conversions=int(frame.format.name != "yuv420p"))
+
+        self.last_frame = time.monotonic()
+        # Glass to encoder: capture on the device (host-synced clock) until handed to aiortc
+        self.latency = (dai.Clock.now() - captured).total_seconds()
+        self.recorder.stats.record("latency", self.latency)
+        return frame
+
+class VideoRecorder:
+    """
+    Long-lived capture/compose engine owned by the app. Boots the cameras listed in the
+    camera config once, all at the same time, and composes one panorama per matched set
+    of device frames into `output`, which all viewer tracks share. Cameras that are missing
+    or fail to boot are left out, the others keep streaming and recording.
+
+    The devices come from `backend`, the connected OAKs unless DEVICE_BACKEND says
+    otherwise (see python/replay.py).
+    """
+    def __init__(self, application, backend=None, recordings=RECORDING_DIR):
+        self.application = application
+        self.backend = backend or backend_from_env()
+        self.task = None
+        self.monitor_task = None
 
-        self.is_recording = False
         self.is_stitch = False
         self.is_toggle = True
 
-        # Camera configurations
-        self.wbManual = 4000
-        self.expTime = 20000
-        self.sensIso = 800    
-
-        self.frame = np.zeros((PREVIEW_HEIGHT, PREVIEW_WIDTH, 3), np.uint8)
-        self.frame[:] = (0, 0, 0)
-
-        self.stitcher = None
-        self.translateX = 0
-        self.translateY = 0
-        self.start_ts = None
-
-        self.cam1, self.q1, self.qControl1, self.recorder1, self.qEncoded1, self.encStream1 = self.create_cam("18443010915D2D1300", "cam1")
-        self.cam2, self.q2, self.qControl2, self.recorder2, self.qEncoded2, self.encStream2 = self.create_cam("18443010D13E411300", "cam2")
-
-    def create_cam(self, mxid, name):
-        # ---------- Create pipeline
-        pipeline = dai.Pipeline()
-        
-        # ---------- Define sources and outputs
-        cam = pipeline.create(dai.node.ColorCamera)
-        cam.setFps(FPS)
-        cam.setResolution(dai.ColorCameraProperties.SensorResolution.THE_4_K)
-        # cam.setResolution(dai.ColorCameraProperties.SensorResolution.THE_12_MP) # (4056, 3040)
-        # cam.setResolution(dai.ColorCameraProperties.SensorResolution.THE_1080_P)
-        cam.setPreviewSize(PREVIEW_WIDTH, PREVIEW_HEIGHT)
-        cam.setInterleaved(False)
-        cam.setColorOrder(dai.ColorCameraProperties.ColorOrder.BGR)
-        cam.setImageOrientation(dai.CameraImageOrientation.ROTATE_180_DEG)
-
-        # Set up recording
-        recorder = av.open('/media/gary/usb_drive/' + name + '.mp4', mode='w')
-        codec = av.CodecContext.create('mjpeg', 'w')
-        # codec = av.CodecContext.create('hevc', 'w')
-        # stream = recorder.add_stream('hevc')
-        # stream = recorder.add_stream('h264')
-        stream = recorder.add_stream('mjpeg')
-        stream.width = 4032
-        stream.height = 3040
-        stream.time_base = Fraction(1, 1000 * 1000)
-        stream.pix_fmt = "yuvj420p" # only for MJPEG
-        
-        """
-        We have to use ImageManip, as ColorCamera.video can output up to 4K.
-        Workaround is to use ColorCamera.isp, and convert it to NV12
-        """
-        imageManip = pipeline.create(dai.node.ImageManip)
-        # YUV420 -> NV12 (required by VideoEncoder)
-        imageManip.initialConfig.setFrameType(dai.RawImgFrame.Type.NV12)
-        # Width must be multiple of 32, height multiple of 8 for H26x encoder
-        imageManip.initialConfig.setResize(4032, 3040)
-        imageManip.setMaxOutputFrameSize(18495360)
-        
-        # Encoder
-        videoEnc = pipeline.create(dai.node.VideoEncoder)
-        videoEnc.setDefaultProfilePreset(FPS, dai.VideoEncoderProperties.Profile.MJPEG)
-        # Higher quality would produce huge files
-        videoEnc.setQuality(60)
-        # videoEnc.setDefaultProfilePreset(FPS, dai.VideoEncoderProperties.Profile.H265_MAIN)
-
-        """
-        LINKING -- MAKE SURE THIS PART IS CORRECT! FAILURE IS HARD TO DETECT
-        """
-        outPreview = pipeline.create(dai.node.XLinkOut)
-        outEncoded = pipeline.create(dai.node.XLinkOut)
-
-        outPreview.setStreamName('preview')
-        outEncoded.setStreamName('encoded')
-        
-        print(f"Preview: {outPreview}")
-        print(f"Encoded: {outEncoded}")
-
-        # Preview stream
-        cam.preview.link(outPreview.input)
-        # Encoded stream
-        # CAM ISP --> IMAGE MANIPULATOR --> VIDEO ENCODER --> XLINKOUT (HOST)
-        # cam.isp.link(imageManip.inputImage)
-        # imageManip.out.link(videoEnc.input)
-        cam.video.link(videoEnc.input)
-        videoEnc.bitstream.link(outEncoded.input)
-        
-        """
-        CONTROL CAMERA CONFIGURATION SETTINGS (EXPOSURE, WHITE BALANCE, ETC.)
-        """
-        controlIn = pipeline.create(dai.node.XLinkIn)
-        configIn = pipeline.create(dai.node.XLinkIn)
-
-        controlIn.setStreamName('control')
-        configIn.setStreamName('config')
-
-        controlIn.out.link(cam.inputControl)
-        configIn.out.link(cam.inputConfig)
-
-        """
-        GET QUEUES AFTER CREATING DEVICE OBJECT
-        """
-        # Get device by ID
-        info = dai.DeviceInfo(mxid)
-        device = dai.Device(pipeline, info)
-
-        # Output queue
-        qOutPreview = device.getOutputQueue(name="preview", maxSize=4, blocking=False)
-        qOutEncoded = device.getOutputQueue(name="encoded", maxSize=30, blocking=False)
-
-        controlQueue = device.getInputQueue('control')
-        configQueue = device.getInputQueue('config')
-
-        print(f"Camera: {device}")
-        print(f"Queue: {qOutPreview}")
-        print(f"Recorder: {recorder}")
-        print(f"Queue Encoded: {qOutEncoded}")
-        print(f"Stream: {stream}")
-
-        return device, qOutPreview, controlQueue, recorder, qOutEncoded, stream
-        
-    async def get_frame(self):
-        if self.is_toggle:
-            frame1 = self.q1.get()
-            frame2 = self.q2.get()
-        else:
-            frame1 = self.q2.get()
-            frame2 = self.q1.get()
+        # One calibrator per pair of neighbouring cameras, created at boot
+        self.calibrators = []
+        self.frames = None
+        self.stats = StageStats()
+        self.fps = {}
+
+        # Recording encoder, H.265 unless the RECORD_* environment says otherwise
+        self.encoder = EncoderSettings.from_env()
+        # Recordings are started by RECORD_START or, with the 'motion' trigger, by motion
+        # in the previews, together with the few seconds before it
+        self.trigger = os.environ.get('RECORD_TRIGGER', DEFAULT_TRIGGER)
+        if self.trigger not in TRIGGERS:
+            raise ValueError(f"Unknown recording trigger {self.trigger}, expected one of {', '.join(TRIGGERS)}")
+        self.motion = MotionDetector()
+        # Optional detection network on every camera's preview (DETECTION_MODEL), its
+        # results batched to the viewers that subscribed
+        self.detection = DetectionSettings.from_env()
+
+        # Cameras of the rig, booted concurrently once run() starts
+        self.configured = [
+            Camera(camera["name"], camera.get("mxid"), self.backend, recordings) for camera in load_config()
+        ]
+        self.cameras = []
+        self.boot_time = None
+        self.detections = DetectionBatcher(len(self.configured))
+        self.publish_task = None
+
+        # Camera configurations, sent at most once per composed frame
+        self.controls = CameraControls([None] * len(self.configured), exposure=20000, iso=800, white_balance=4000)
+        # Preview regions (pan/zoom), cropped on the device
+        self.regions = CameraRegions([None] * len(self.configured))
+
+        # Homographies survive restarts, keyed by the device pair and preview size. The
+        # compositor chains those of all neighbours and warps the cameras on `warp_pool`.
+        self.cache = HomographyCache()
+        self.seam_keys = None
+        self.stitchers = []
+        self.compositor = None
+        self.compositor_regions = None
+        self.warp_pool = None
+
+        # Preview frames are pulled on one thread per device and matched by hardware
+        # timestamp, get_frame only awaits the newest matched set
+        self.output = LatestFrame()
+        self.sync = None
+        self.seen = 0
+
+    async def boot(self):
+        loop = asyncio.get_event_loop()
+        start = time.perf_counter()
+        try:
+            available = await loop.run_in_executor(None, self.backend.discover)
+        except RuntimeError:
+            traceback.print_exc()
+            available = []
+
+        # Entries without an MXID take the connected devices nobody claimed
+        claimed = {camera.mxid for camera in self.configured if camera.mxid}
+        unclaimed = [mxid for mxid in available if mxid not in claimed]
+        for camera in self.configured:
+            if camera.mxid is None and unclaimed:
+                camera.mxid = unclaimed.pop(0)
+            if camera.mxid not in available:
+                camera.state = "missing"
+                print(f"{camera.name} ({camera.mxid}): missing")
+
+        booting = [camera for camera in self.configured if camera.state == "pending"]
+        await asyncio.gather(*(loop.run_in_executor(None, camera.boot, self.encoder, self.detection) for camera in booting))
+
+        self.cameras = [camera for camera in self.configured if camera.running]
+        self.calibrators = [Calibrator() for _ in self.cameras[1:]]
+        if len(self.cameras) > 1:
+            self.warp_pool = ThreadPoolExecutor(len(self.cameras), thread_name_prefix="warp")
+        self.sync = FrameSync(devices=max(len(self.cameras), 1))
+        for i, camera in enumerate(self.cameras):
+            # Recordings share the clock offsets of the preview sync, so they share time zero
+            index = self.configured.index(camera)
+            camera.start(self.sync.inputs[i], lambda ts, i=i: self.sync.toHost(i, ts), self.stats,
+                         lambda seq, detections, index=index: self.detections.add(index, seq, detections))
+        self.controls.queues = [camera.control for camera in self.configured]
+        self.regions.queues = [camera.config for camera in self.configured]
+        self.set_trigger(self.trigger)
+
+        self.boot_time = time.perf_counter() - start
+        print(f"{len(self.cameras)}/{len(self.configured)} cameras running after {self.boot_time:.2f}s")
+
+    def set_trigger(self, trigger):
+        if trigger not in TRIGGERS:
+            raise ValueError(f"Unknown recording trigger {trigger}, expected one of {', '.join(TRIGGERS)}")
+        self.trigger = trigger
+        self.motion.reset()
+        for camera in self.cameras:
+            # Encoded packets are only held back while waiting for motion
+            camera.writer.preroll = PrerollBuffer() if trigger == "motion" else None
+        return self.motion_stats()
+
+    def motion_stats(self):
+        return {"trigger": self.trigger, **self.motion.stats()}
+
+    def detect(self, captured):
+        # Whether there is motion in any camera's preview
+        with self.stats.time("motion"):
+            return self.motion.update([c.image[0] for c in captured])
+
+    def stitch_status(self):
+        # Calibration state of every seam, left to right in the current camera order
+        cameras = self.cameras if self.is_toggle else self.cameras[::-1]
+        return [
+            {"left": left.name, "right": right.name, **calibrator.status_of(left.mxid, right.mxid)}
+            for left, right, calibrator in zip(cameras, cameras[1:], self.calibrators)
+        ]
+
+    def cameras_status(self):
+        return {
+            "boot_s": None if self.boot_time is None else round(self.boot_time, 3),
+            "cameras": [camera.status() for camera in self.configured],
+        }
+
+    @property
+    def is_recording(self):
+        return bool(self.cameras) and all(camera.writer.recording for camera in self.cameras)
+
+    @is_recording.setter
+    def is_recording(self, value):
+        if self.sync is None:
+            # Not booted yet, there is nothing to record
+            return
+        if value and not self.is_recording:
+            print("Recording...")
+            # All recordings start at the newest matched set, or at the oldest keyframe the
+            # pre-rolls hold: an earlier epoch would drop that keyframe, and its GOP with it
+            epoch = self.sync.last
+            if self.trigger == "motion":
+                starts = [camera.writer.preroll.start() for camera in self.cameras if camera.writer.preroll is not None]
+                starts = [start for start in starts if start is not None]
+                if starts:
+                    epoch = min(starts)
+            for camera in self.cameras:
+                if camera.writer.epoch is None:
+                    camera.writer.epoch = epoch
+        for camera in self.cameras:
+            camera.writer.recording = value
+
+    def recording_stats(self):
+        return {camera.name: {**camera.writer.stats(), **camera.segments.stats()} for camera in self.cameras}
+
+    def latency_stats(self):
+        stages = self.stats.summary()
+        return {
+            "latency": stages.get("latency"),
+            "compose": stages.get("compose"),
+            "skipped": {camera.name: camera.capture.skipped for camera in self.cameras},
+        }
+
+    def sync_stats(self):
+        return self.sync.stats() if self.sync is not None else None
+
+    def queue_stats(self):
+        # Drop counters and depths of every device output queue
+        return {
+            camera.name: {
+                "preview": {"dropped": camera.capture.dropped, "skipped": camera.capture.skipped, "depth": camera.capture.depth},
+                "encoded": camera.writer.stats(),
+            }
+            for camera in self.cameras
+        }
+
+    def detection_stats(self):
+        return {**self.detection.as_dict(), **self.detections.stats()}
+
+    def stats_payload(self):
+        stages = self.stats.summary()
+        for name, fps in self.fps.items():
+            if name in stages:
+                stages[name]["fps"] = round(fps, 2)
+        return {
+            "stages": stages,
+            "queues": self.queue_stats(),
+            "sync": self.sync_stats(),
+            "cameras": self.cameras_status(),
+            "recording": self.is_recording,
+            "motion": self.motion_stats(),
+            "detections": self.detection_stats(),
+            "viewers": len(self.application.video_transforms),
+        }
+
+    def metrics(self):
+        # Prometheus text exposition of the pipeline, gathered on scrape
+        out = Exposition()
+        histograms = self.stats.histograms()
+        out.histogram("stage_seconds", "Time spent per frame in each pipeline stage", [
+            ({"stage": name}, count, seconds, buckets)
+            for name, (count, seconds, _, _, buckets) in histograms.items()
+        ])
+        out.add("stage_copied_bytes_total", "counter", "Bytes copied per pipeline stage", [
+            ({"stage": name}, copied) for name, (_, _, copied, _, _) in histograms.items()
+        ])
+        out.add("stage_conversions_total", "counter", "Color conversions per pipeline stage", [
+            ({"stage": name}, conversions) for name, (_, _, _, conversions, _) in histograms.items()
+        ])
+        out.add("stage_fps", "gauge", "Frames per second through each stage", [
+            ({"stage": name}, fps) for name, fps in self.fps.items()
+        ])
+
+        queues = self.queue_stats()
+        out.add("queue_dropped_total", "counter", "Frames lost before reaching the host", [
+            ({"camera": cam, "queue": queue}, stats["dropped"])
+            for cam, q in queues.items() for queue, stats in q.items()
+        ])
+        out.add("queue_skipped_total", "counter", "Stale preview frames drained unseen", [
+            ({"camera": cam, "queue": "preview"}, q["preview"]["skipped"]) for cam, q in queues.items()
+        ])
+        out.add("queue_depth", "gauge", "Frames queued on the host at the last read", [
+            ({"camera": cam, "queue": queue}, stats["depth"])
+            for cam, q in queues.items() for queue, stats in q.items()
+        ])
+        for counter in ("late", "out_of_order", "written"):
+            out.add(f"recording_{counter}_total", "counter", f"Encoded packets {counter.replace('_', ' ')}", [
+                ({"camera": cam}, q["encoded"][counter]) for cam, q in queues.items()
+            ])
 
-        img1 = frame1.getCvFrame()
-        img2 = frame2.getCvFrame()
+        out.add("preroll_bytes", "gauge", "Encoded video held back for the next triggered recording", [
+            ({"camera": cam}, q["encoded"]["preroll_bytes"]) for cam, q in queues.items()
+        ])
 
-        if img1 is None or img2 is None:
-            print("Empty image after frame to opencv conversion!!!!")
-            return None
+        out.add("camera_up", "gauge", "Whether the camera booted and is streaming", [
+            ({"camera": camera.name}, camera.running) for camera in self.configured
+        ])
+        out.add("camera_boot_seconds", "gauge", "Time the camera took to boot", [
+            ({"camera": camera.name}, camera.boot_time) for camera in self.configured
+        ])
 
-        M = np.float32([
-            [1, 0, self.translateX],
-            [0, 1, self.translateY]
+        sync = self.sync_stats()
+        if sync is not None:
+            names = [camera.name for camera in self.cameras]
+            out.add("sync_matched_total", "counter", "Camera frame sets matched by timestamp", [({}, sync["matched"])])
+            out.add("sync_unmatched_total", "counter", "Frames discarded without a partner", [
+                ({"camera": name}, n) for name, n in zip(names, sync["unmatched"])
+            ])
+            error = sync["error_ms"]["mean"]
+            out.add("sync_error_seconds", "gauge", "Mean capture time difference of matched sets", [
+                ({}, None if error is None else error / 1000)
+            ])
+            out.add("clock_offset_seconds", "gauge", "Device clock offset against the first camera", [
+                ({"camera": name}, None if o is None else o / 1000) for name, o in zip(names, sync["offset_ms"])
+            ])
+
+        out.add("recording", "gauge", "Whether the cameras are being recorded", [({}, self.is_recording)])
+        out.add("motion_active", "gauge", "Whether motion holds the recording on", [({}, self.motion.active)])
+        out.add("motion_events_total", "counter", "Recordings started by motion", [({}, self.motion.events)])
+        detections = self.detections.stats()
+        out.add("detections_total", "counter", "Objects detected on the devices", [({}, detections["detections"])])
+        out.add("detection_unmatched_total", "counter", "Detection results sent without a video frame", [
+            ({}, detections["unmatched"])
         ])
+        out.add("detection_packed_bytes_total", "counter", "Detection batches packed", [({}, detections["bytes"])])
+        out.add("detection_sent_bytes_total", "counter", "Detection batches sent, summed over the viewers",
+                [({}, detections["sent_bytes"])])
+        out.add("viewers", "gauge", "Connected viewer tracks", [({}, len(self.application.video_transforms))])
+        return out.text()
 
-        if self.translateX != 0 or self.translateY != 0:
-            img2 = cv2.warpAffine(img2, M, (WIDTH, HEIGHT))
-        
-        if self.is_stitch:
-            self.stitcher = Stitcher([img1, img2])
-            self.is_stitch = False
+    def stitch_keys(self, cameras, shape):
+        # (left device, right device, preview shape) of every pair of neighbours
+        return [(left.mxid, right.mxid, shape) for left, right in zip(cameras, cameras[1:])]
 
-        if self.stitcher is not None:
-            result = self.stitcher.warp([img1, img2])
+    async def get_frame(self):
+        # Newest frames of all running cameras captured within the sync tolerance of each other
+        self.seen, captured = await self.sync.output.next(self.seen)
+        return captured
+
+    def compose(self, captured):
+        start = time.perf_counter()
+        if len(captured) == 1:
+            # Degraded to a single camera, nothing to stitch
+            (y, uv) = captured[0].image
+            frame, copied = self.single(y, uv)
         else:
-            result = np.concatenate((img1, img2), axis=1)        
-            
-        if self.is_recording and self.qEncoded1.has() and self.qEncoded2.has():
-            print("Recording...")
-            if self.is_toggle:
-                encoded1 = self.qEncoded1.tryGet()
-                encoded2 = self.qEncoded2.tryGet()
-            else:
-                encoded1 = self.qEncoded2.tryGet()
-                encoded2 = self.qEncoded1.tryGet()
-            
-            if self.start_ts is None:
-                self.start_ts = encoded1.getTimestampDevice()
-
-            ts = int((encoded1.getTimestampDevice() - self.start_ts).total_seconds() * 1e6)  # To microsec
-            packet1 = av.Packet(encoded1.getData())
-            packet1.dts = ts + 1  # +1 to avoid zero dts
-            packet1.pts = ts + 1
-            packet1.stream = self.encStream1
-            self.recorder1.mux_one(packet1)  # Mux the Packet into container
-
-            packet2 = av.Packet(encoded2.getData())
-            packet2.dts = ts + 1  # +1 to avoid zero dts
-            packet2.pts = ts + 1
-            packet2.stream = self.encStream2
-            self.recorder2.mux_one(packet2)  # Mux the Packet into container
-
-        return result
+            frame, copied = self.panorama([c.image for c in captured])
+
+        # Device clock of the reference camera, whatever the toggle order
+        reference = captured[0]
+        if self.clock_start is None:
+            self.clock_start = reference.device_timestamp
+        frame.pts = int((reference.device_timestamp - self.clock_start).total_seconds() / VIDEO_TIME_BASE)
+        frame.time_base = VIDEO_TIME_BASE
+        # Detections find their video frame by the preview sequence numbers
+        for camera, c in zip(self.cameras, captured):
+            self.detections.composed(self.configured.index(camera), c.sequence, frame.pts)
+        self.stats.record("compose", time.perf_counter() - start, copied)
+        return frame, reference.timestamp
+
+    def single(self, y, uv):
+        (h, w) = y.shape
+        if self.frames is None or (self.frames.height, self.frames.width) != (h, w):
+            self.frames = FramePool(w, h)
+        frame, (Y, U, V) = self.frames.next()
+        Y[:] = y
+        U[:] = uv[..., 0]
+        V[:] = uv[..., 1]
+        return frame, Y.nbytes + U.nbytes + V.nbytes
+
+    def panorama(self, planes):
+        cameras = self.cameras
+        if not self.is_toggle:
+            # TOGGLE reverses the camera order
+            cameras, planes = cameras[::-1], planes[::-1]
+        ys = [y for (y, _) in planes]
+        uvs = [uv for (_, uv) in planes]
+        # Preview regions of the cameras, in this order
+        regions = [self.configured.index(camera) for camera in cameras]
+
+        keys = self.stitch_keys(cameras, ys[0].shape)
+        if keys != self.seam_keys:
+            # Camera order or preview size changed, the homographies in use belong to the other one
+            self.stitchers = [self.cache.load(*key) for key in keys]
+            self.seam_keys = keys
+            self.compositor = None
+
+        # Homographies are estimated in a worker process per seam on the luma planes,
+        # the current ones stay in use meanwhile. They belong to the full views, a seam
+        # is only calibrated while neither camera is panned or zoomed.
+        for i, (key, calibrator) in enumerate(zip(keys, self.calibrators)):
+            full = self.regions.full(regions[i]) and self.regions.full(regions[i + 1])
+            if full and (self.is_stitch or calibrator.refine_due(self.stitchers[i])):
+                calibrator.submit([ys[i], ys[i + 1]], key)
+
+            # A result computed before a TOGGLE is of the other order, poll drops it
+            stitcher = calibrator.poll(self.stitchers[i], key)
+            if stitcher is not None:
+                print(f"New homography {cameras[i].name}|{cameras[i + 1].name}, inliers: {stitcher.inliers} error: {stitcher.error:.2f}px")
+                self.stitchers[i] = stitcher
+                self.cache.save(*key, stitcher)
+                self.compositor = None
+        self.is_stitch = False
+
+        if self.compositor is None or self.compositor_regions != self.regions.generation:
+            # Neighbours without a homography yet are shown side by side. The others are
+            # moved from the full views onto the regions: a config takes a few frames to
+            # reach the device, until then the seams of a moving camera are off.
+            affines = [self.regions.affine(i) for i in regions]
+            homographies = [
+                adjacent(ys[i].shape[1]) if stitcher is None
+                else affines[i] @ stitcher.scaledHomography(ys[i + 1].shape) @ np.linalg.inv(affines[i + 1])
+                for i, stitcher in enumerate(self.stitchers)
+            ]
+            self.compositor = Compositor(homographies, ys[0].shape[:2], pool=self.warp_pool)
+            self.compositor_regions = self.regions.generation
+
+        h, w = ys[0].shape[0], sum(y.shape[1] for y in ys)
+        if self.frames is None or (self.frames.height, self.frames.width) != (h, w):
+            self.frames = FramePool(w, h)
+        frame, (Y, U, V) = self.frames.next()
+
+        # Compose directly into the planes of a pooled yuv420p frame
+        self.compositor.warp(ys, out=Y)
+        uv = self.compositor.warp(uvs)
+        U[:] = uv[..., 0]
+        V[:] = uv[..., 1]
+        return frame, Y.nbytes + uv.nbytes + U.nbytes + V.nbytes
+
+    def start(self):
+        self.clock_start = None
+        self.task = asyncio.ensure_future(self.run())
+        self.monitor_task = asyncio.ensure_future(self.monitor())
+        self.publish_task = asyncio.ensure_future(self.publish())
+
+    async def monitor(self):
+        # Event-loop lag probe, pushes STATS to every viewer every STATS_INTERVAL
+        loop = asyncio.get_event_loop()
+        next_push = loop.time() + STATS_INTERVAL
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            now = loop.time()
+            self.stats.record("loop_lag", max(now - start - LAG_INTERVAL, 0.0))
+
+            if now >= next_push:
+                next_push = now + STATS_INTERVAL
+                self.fps = self.stats.rates()
+                try:
+                    payload = self.stats_payload()
+                    for pc_id in list(self.application.pcs_datachannels):
+                        notify(self.application, pc_id, "STATS", payload)
+                except Exception:
+                    traceback.print_exc()
+
+    async def publish(self):
+        # One binary batch of detections per BATCH_INTERVAL to every subscribed viewer
+        while True:
+            await asyncio.sleep(BATCH_INTERVAL)
+            subscribers = self.detections.subscribers
+            subscribers.intersection_update(self.application.pcs_datachannels)
+            if not subscribers:
+                # Not packed, the sent batches and bytes only count what goes out
+                self.detections.clear()
+                continue
+            data = self.detections.pack()
+            if data is None:
+                continue
+            for pc_id in list(subscribers):
+                if send_binary(self.application, pc_id, data):
+                    self.detections.sent += len(data)
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        await self.boot()
+        if not self.cameras:
+            print("No camera running, nothing to stream")
+            return
+
+        while True:
+            captured = await self.get_frame()
+            # Camera control and preview region changes since the last frame, merged
+            self.controls.flush()
+            self.regions.flush()
+            try:
+                if self.trigger == "motion":
+                    active = self.motion.active
+                    if await loop.run_in_executor(None, self.detect, captured) != active:
+                        print("Motion" if not active else "Motion stopped")
+                        self.is_recording = not active
+                # Warping/stitching is CPU bound and OpenCV releases the GIL, keep it off the loop
+                result = await loop.run_in_executor(None, self.compose, captured)
+            except Exception:
+                traceback.print_exc()
+                continue
+            self.output.put(result)
 
     def stop(self):
         print("VideoRecorder stop...")
-        super().stop()
-
-        # Clean up
-        self.recorder1.close()
-        self.recorder2.close()
-        self.cam1.close()
-        self.cam2.close()
-        del self.cam1
-        del self.cam2
+        for task in (self.task, self.monitor_task, self.publish_task):
+            if task is not None:
+                task.cancel()
+        for calibrator in self.calibrators:
+            calibrator.stop()
+        if self.warp_pool is not None:
+            self.warp_pool.shutdown(wait=False)
+
+        # Clean up, closing the devices unblocks the capture and writer threads
+        for camera in self.configured:
+            camera.stop()